@@ -0,0 +1,76 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Binary to write a dataset split at training resolution to the cache.
+
+Example:
+  python -m compare_gan.build_dataset_cache --dataset=imagenet_128 \\
+      --split=train --cache_margin=8 --data_cache_dir=/tmp/dataset_cache \\
+      --gin_bindings="train_imagenet_transform.crop_method = 'middle'"
+
+Training jobs with the same --data_cache_dir then read the cached split.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from absl import app
+from absl import flags
+from absl import logging
+
+from compare_gan import dataset_cache
+from compare_gan import datasets
+
+import gin
+import tensorflow as tf
+
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string("dataset", None, "Name of the dataset to cache.")
+flags.DEFINE_enum("split", "train", ["train", "test"], "Split to cache.")
+flags.DEFINE_integer(
+    "cache_margin", 0,
+    "Number of pixels by which the cached images are larger than the "
+    "training resolution. Only supported for the training split of ImageNet "
+    "datasets.")
+flags.DEFINE_integer("cache_num_shards", 64, "Number of TFRecord files.")
+flags.DEFINE_multi_string(
+    "gin_config", [],
+    "List of paths to the config files.")
+flags.DEFINE_multi_string(
+    "gin_bindings", [],
+    "Newline separated list of Gin parameter bindings.")
+
+
+def main(unused_argv):
+  gin.parse_config_files_and_bindings(FLAGS.gin_config, FLAGS.gin_bindings)
+  dataset = datasets.get_dataset(FLAGS.dataset)
+  path = dataset_cache.get_cache_path(
+      FLAGS.data_cache_dir, dataset.name, FLAGS.split)
+  if dataset_cache.cache_exists(path):
+    logging.info("Cache %s already exists.", path)
+    return
+  with tf.Graph().as_default():
+    ds = dataset.get_cache_source(FLAGS.split, margin=FLAGS.cache_margin)
+    dataset_cache.write_cache(
+        ds, path, num_shards=FLAGS.cache_num_shards, margin=FLAGS.cache_margin,
+        transform_metadata=dataset.get_cache_transform_metadata(FLAGS.split))
+
+
+if __name__ == "__main__":
+  flags.mark_flags_as_required(["dataset", "data_cache_dir"])
+  app.run(main)
@@ -0,0 +1,179 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cache of dataset splits preprocessed to the training resolution.
+
+Decoding full size images and resizing them in every epoch is wasteful if
+most of the pixels are thrown away. A split can instead be written once as
+uint8 images at (or slightly above) the training resolution into sharded
+TFRecord files. `ImageDatasetV2` reads these files instead of the TFDS data
+if --data_cache_dir contains the requested split.
+
+Each cached split is a directory with the files:
+- metadata.json: Image shape, label dtype, number of examples and shards, the
+  margin and the dataset specific preprocessing (e.g. the crop method).
+- data-<shard>-of-<num_shards>.tfrecord: Serialized `tf.train.Example`s with
+  the raw image bytes and the label.
+
+Use build_dataset_cache.py to create the cache.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+from absl import logging
+from six.moves import range
+import tensorflow as tf
+
+_METADATA_FILENAME = "metadata.json"
+
+
+def get_cache_path(cache_dir, dataset_name, split_name):
+  """Returns the directory of the cached split."""
+  return os.path.join(cache_dir, dataset_name, split_name)
+
+
+def cache_exists(path):
+  """Returns True if path contains a completely written cache."""
+  return tf.gfile.Exists(os.path.join(path, _METADATA_FILENAME))
+
+
+def read_metadata(path):
+  """Returns the metadata dictionary of the cache in path."""
+  with tf.gfile.Open(os.path.join(path, _METADATA_FILENAME)) as f:
+    return json.load(f)
+
+
+def _get_shard_filename(path, shard, num_shards):
+  return os.path.join(
+      path, "data-%05d-of-%05d.tfrecord" % (shard, num_shards))
+
+
+def write_cache(ds, path, num_shards=64, margin=0, batch_size=256,
+                transform_metadata=None):
+  """Writes the examples of a dataset to the cache directory path.
+
+  The metadata is written last, so partially written caches are not used.
+
+  Args:
+    ds: `tf.data.Dataset` with tuples of uint8 images with a fixed shape and
+      scalar integer labels.
+    path: Directory of the cache.
+    num_shards: Number of TFRecord files. The examples are distributed
+      round-robin over the files.
+    margin: Number of pixels by which the images are larger than the training
+      resolution. Only stored in the metadata.
+    batch_size: Number of examples read per session call.
+    transform_metadata: Optional dictionary describing the preprocessing of
+      the images. Stored in the metadata, readers of the cache must check
+      that it matches their preprocessing.
+
+  Returns:
+    The number of written examples.
+
+  Raises:
+    ValueError: If the images are not uint8 with a fixed shape or the labels
+      are not scalars.
+  """
+  images_type, labels_type = ds.output_types
+  images_shape, labels_shape = ds.output_shapes
+  if images_type != tf.uint8 or not images_shape.is_fully_defined():
+    raise ValueError("Images must be uint8 with a fixed shape, got %s %s." %
+                     (images_type, images_shape))
+  if labels_shape.ndims != 0:
+    raise ValueError("Only scalar labels can be cached, got shape %s." %
+                     labels_shape)
+  tf.gfile.MakeDirs(path)
+  logging.info("Writing cache with images of shape %s to %s.",
+               images_shape, path)
+  num_examples = 0
+  writers = [
+      tf.python_io.TFRecordWriter(_get_shard_filename(path, i, num_shards))
+      for i in range(num_shards)
+  ]
+  try:
+    next_batch = ds.batch(batch_size).make_one_shot_iterator().get_next()
+    with tf.Session() as sess:
+      while True:
+        try:
+          images, labels = sess.run(next_batch)
+        except tf.errors.OutOfRangeError:
+          break
+        for image, label in zip(images, labels):
+          example = tf.train.Example(features=tf.train.Features(feature={
+              "image": tf.train.Feature(
+                  bytes_list=tf.train.BytesList(value=[image.tobytes()])),
+              "label": tf.train.Feature(
+                  int64_list=tf.train.Int64List(value=[int(label)])),
+          }))
+          writers[num_examples % num_shards].write(example.SerializeToString())
+          num_examples += 1
+        logging.info("Cached %d examples.", num_examples)
+  finally:
+    for writer in writers:
+      writer.close()
+  metadata = {
+      "image_shape": images_shape.as_list(),
+      "num_examples": num_examples,
+      "num_shards": num_shards,
+      "margin": margin,
+      "label_dtype": labels_type.name,
+      "transform": transform_metadata or {},
+  }
+  with tf.gfile.Open(os.path.join(path, _METADATA_FILENAME), "w") as f:
+    json.dump(metadata, f)
+  logging.info("Done writing %d examples to %s.", num_examples, path)
+  return num_examples
+
+
+def load_cache(path, num_parallel_calls=-1):
+  """Reads the cache in path.
+
+  Args:
+    path: Directory of the cache.
+    num_parallel_calls: Number of shards read and examples parsed in parallel.
+      -1 lets tf.data tune the parsing.
+
+  Returns:
+    `tf.data.Dataset` with tuples of uint8 images and labels with the dtype of
+    the written labels. The examples are in the order in which they were
+    written.
+  """
+  metadata = read_metadata(path)
+  image_shape = metadata["image_shape"]
+  label_dtype = tf.as_dtype(metadata.get("label_dtype", "int64"))
+  num_shards = metadata["num_shards"]
+  filenames = [_get_shard_filename(path, i, num_shards)
+               for i in range(num_shards)]
+  ds = tf.data.Dataset.from_tensor_slices(filenames)
+  # Reading the shards round-robin restores the original order.
+  ds = ds.apply(tf.data.experimental.parallel_interleave(
+      tf.data.TFRecordDataset, cycle_length=num_shards, block_length=1,
+      sloppy=False))
+
+  def parse_fn(serialized):
+    features = tf.parse_single_example(serialized, {
+        "image": tf.FixedLenFeature((), tf.string),
+        "label": tf.FixedLenFeature((), tf.int64),
+    })
+    image = tf.decode_raw(features["image"], tf.uint8)
+    image = tf.reshape(image, image_shape)
+    return image, tf.cast(features["label"], label_dtype)
+
+  return ds.map(parse_fn, num_parallel_calls=num_parallel_calls)
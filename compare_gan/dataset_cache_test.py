@@ -0,0 +1,72 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the dataset cache."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+from compare_gan import dataset_cache
+import numpy as np
+import tensorflow as tf
+
+
+class DatasetCacheTest(tf.test.TestCase):
+
+  def _write_cache(self, images, labels, num_shards):
+    path = os.path.join(self.get_temp_dir(), "cache")
+    with tf.Graph().as_default():
+      ds = tf.data.Dataset.from_tensor_slices((images, labels))
+      num_examples = dataset_cache.write_cache(
+          ds, path, num_shards=num_shards, margin=2, batch_size=4,
+          transform_metadata={"crop_method": "middle"})
+    self.assertEqual(num_examples, len(images))
+    return path
+
+  def testRoundTripKeepsOrder(self):
+    images = np.random.randint(0, 256, size=(10, 6, 5, 3)).astype(np.uint8)
+    labels = np.arange(10, dtype=np.int32)
+    path = self._write_cache(images, labels, num_shards=3)
+    self.assertTrue(dataset_cache.cache_exists(path))
+    metadata = dataset_cache.read_metadata(path)
+    self.assertEqual(metadata["image_shape"], [6, 5, 3])
+    self.assertEqual(metadata["num_examples"], 10)
+    self.assertEqual(metadata["margin"], 2)
+    self.assertEqual(metadata["transform"], {"crop_method": "middle"})
+    with tf.Graph().as_default():
+      ds = dataset_cache.load_cache(path).batch(20)
+      self.assertEqual(ds.output_types[1], tf.int32)
+      next_batch = ds.make_one_shot_iterator().get_next()
+      with self.session() as sess:
+        cached_images, cached_labels = sess.run(next_batch)
+    self.assertAllEqual(cached_images, images)
+    self.assertAllEqual(cached_labels, labels)
+
+  def testMissingCache(self):
+    path = os.path.join(self.get_temp_dir(), "missing")
+    self.assertFalse(dataset_cache.cache_exists(path))
+
+  def testFloatImagesRaise(self):
+    images = np.zeros((2, 4, 4, 3), dtype=np.float32)
+    labels = np.zeros((2,), dtype=np.int32)
+    with self.assertRaises(ValueError):
+      self._write_cache(images, labels, num_shards=1)
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -32,9 +32,11 @@ from __future__ import print_function
 
 import functools
 import inspect
+import os
 
 from absl import flags
 from absl import logging
+from compare_gan import dataset_cache
 from compare_gan.tpu import tpu_random
 import gin
 import numpy as np
@@ -49,6 +51,11 @@ flags.DEFINE_string(
     "'~/tensorflow_datasets'. If the directory does not contain the requested "
     "dataset TFDS will download the dataset to this folder.")
 
+flags.DEFINE_string(
+    "data_cache_dir", None,
+    "If set, dataset splits are read from the cache written to this directory "
+    "by build_dataset_cache.py (when the split was cached) instead of TFDS.")
+
 flags.DEFINE_boolean(
     "data_fake_dataset", False,
     "If True don't load datasets from disk but create fake values.")
@@ -57,11 +64,137 @@ flags.DEFINE_integer(
     "data_shuffle_buffer_size", 10000,
     "Number of examples for the shuffle buffer.")
 
-# Deprecated, only used for "replacing labels". TFDS will always use 64 threads.
+flags.DEFINE_integer(
+    "data_num_parallel_calls", -1,
+    "Number of examples decoded and transformed in parallel by the input "
+    "pipelines. -1 lets tf.data tune the value dynamically (AUTOTUNE).")
+
+flags.DEFINE_boolean(
+    "data_fast_train_pipeline", False,
+    "If True, train_input_fn() transforms the examples in parallel, fuses the "
+    "preprocessing with the batching and lets tf.data fuse and autotune the "
+    "remaining operations. The input is then no longer deterministic since "
+    "the random transformations run in parallel.")
+
+flags.DEFINE_integer(
+    "data_private_threadpool_size", 0,
+    "If positive, the fast train pipeline runs in a private thread pool with "
+    "this many threads instead of the shared inter-op thread pool.")
+
+flags.DEFINE_boolean(
+    "data_uint8_pipeline", False,
+    "If True, train_input_fn() keeps the images as uint8 through decoding, "
+    "cropping, shuffling, batching and prefetching. Every 4 bytes of the "
+    "batched images are packed into an int32 for the TPU infeed and the GANs "
+    "convert them to float32 in model_fn(). Evaluation images are still "
+    "float32.")
+
+flags.DEFINE_boolean(
+    "data_decode_and_crop", False,
+    "If True, ImageNet datasets read the encoded JPEGs from the TFDS files and "
+    "only decode the region cropped by the transformation "
+    "(tf.image.decode_and_crop_jpeg).")
+
+flags.DEFINE_boolean(
+    "data_shuffle_before_decode", False,
+    "If True, train_input_fn() reads the TFRecord files prepared by TFDS in a "
+    "random order (seeded per host), shuffles the serialized examples in a "
+    "buffer of --data_record_shuffle_buffer_size and decodes the images only "
+    "after shuffling. The decoded examples are not shuffled again.")
+
+flags.DEFINE_integer(
+    "data_record_shuffle_buffer_size", 10000,
+    "Number of serialized examples in the shuffle buffer used with "
+    "--data_shuffle_before_decode. The buffer holds the encoded images, "
+    "e.g. about 110 KB per full-size ImageNet JPEG, so 10000 examples use "
+    "about 1.1 GB of host memory.")
+
+# Only used for "replacing labels" and --data_decode_and_crop. TFDS will always
+# use 64 threads.
 flags.DEFINE_integer(
     "data_reading_num_threads", 64,
     "The number of threads used to read the dataset.")
 
+# Number of examples read from the NumPy arrays of a NumpyDataset at once.
+_NUMPY_CHUNK_SIZE = 256
+
+
+def _convert_uint8_image(image):
+  """Returns the decoded uint8 image in the dtype used by the input pipeline.
+
+  Args:
+    image: uint8 tensor.
+
+  Returns:
+    `image` if --data_uint8_pipeline is set, otherwise the image as float32
+    with values in [0, 1].
+  """
+  if FLAGS.data_uint8_pipeline:
+    return image
+  return tf.cast(image, tf.float32) / 255.0
+
+
+def _images_to_float(images):
+  """Converts uint8 images to float32 in [0, 1], float images are unchanged."""
+  if images.dtype == tf.uint8:
+    return tf.cast(images, tf.float32) / 255.0
+  return images
+
+
+def _resize_images(images, size):
+  """Resizes images with bilinear interpolation and keeps uint8 images uint8."""
+  resized = tf.image.resize_images(images, size)
+  if images.dtype == tf.uint8:
+    resized = tf.cast(tf.round(tf.clip_by_value(resized, 0.0, 255.0)),
+                      tf.uint8)
+  return resized
+
+
+def pack_uint8_images(images):
+  """Packs every 4 bytes of uint8 images into an int32.
+
+  The TPU infeed does not support uint8 tensors. Packing keeps the transferred
+  data 4 times smaller than float32 images.
+
+  Args:
+    images: uint8 tensor with shape [..., height, width, colors]. The last 3
+      dimensions must be static and their product divisible by 4.
+
+  Returns:
+    int32 tensor with shape [..., height * width * colors / 4].
+
+  Raises:
+    ValueError: If the number of values per image is not divisible by 4.
+  """
+  shape = images.shape.as_list()
+  num_values = np.prod(shape[-3:])
+  if num_values % 4:
+    raise ValueError("Cannot pack images with shape %s into int32." % shape)
+  images = tf.reshape(images, shape[:-3] + [num_values // 4, 4])
+  return tf.bitcast(images, tf.int32)
+
+
+def _unpack_uint8_values(packed):
+  """Inverse of pack_uint8_images() without the final reshape.
+
+  Runs on the device inside the model_fn. Instead of a bitcast (XLA only
+  bitcasts between types of the same size) the bytes are extracted with
+  shifts and masks, the first byte of the packed value is the least
+  significant one.
+
+  Args:
+    packed: int32 tensor with shape [..., num_values / 4].
+
+  Returns:
+    float32 tensor with shape [..., num_values / 4, 4] with values in
+    [0, 255].
+  """
+  values = tf.stack(
+      [tf.bitwise.bitwise_and(tf.bitwise.right_shift(packed, shift), 0xFF)
+       for shift in (0, 8, 16, 24)],
+      axis=-1)
+  return tf.cast(values, tf.float32)
+
 
 class ImageDatasetV2(object):
   """Interface for Image datasets based on TFDS (TensorFlow Datasets).
@@ -87,6 +220,26 @@ class ImageDatasetV2(object):
 
   Step 1-3 are done by _load_dataset() and wrap tfds.load().
   Step 4-11 are done by train_input_fn() and eval_input_fn().
+
+  If --data_cache_dir contains the split, steps 1-5 read the images stored by
+  build_dataset_cache.py instead. The cache is created from the output of
+  step 4 and 5 (the training filter is only applied to the training split)
+  followed by _cache_transform_fn().
+
+  With --data_fast_train_pipeline the training examples are shuffled after
+  step 7 and steps 8 and 10 are fused into a single parallel map and batch.
+
+  With --data_uint8_pipeline the images stay uint8 in steps 2-11 of the
+  training pipeline. The transformations keep the dtype of the images. The
+  batched images are packed with pack_uint8_images() and unpack_images()
+  converts them to float32 in the model_fn(). eval_input_fn() converts the
+  images after batching.
+
+  With --data_decode_and_crop ImageNet images are still encoded after step 5.
+  The transformation in step 7 only decodes the cropped region.
+
+  With --data_shuffle_before_decode the files and the serialized examples are
+  shuffled in step 1 and 2 before the images are decoded. Step 9 is skipped.
   """
 
   def __init__(self,
@@ -133,6 +286,15 @@ class ImageDatasetV2(object):
     """Returns a tuple with the image shape."""
     return (self._resolution, self._resolution, self._colors)
 
+  @property
+  def eval_transform_name(self):
+    """Name of the transformation applied to the evaluation images.
+
+    Used to identify cached statistics of the real images. Datasets with
+    configurable evaluation transformations must include the configuration.
+    """
+    return "none"
+
   def _make_fake_dataset(self, split):
     """Returns a fake data set with the correct shapes."""
     np.random.seed(self._seed)
@@ -140,6 +302,8 @@ class ImageDatasetV2(object):
     num_epochs = self.eval_test_samples // 100 if split == "test" else None
     images_shape = [num_samples_per_epoch] + list(self.image_shape)
     images = np.random.uniform(size=images_shape).astype(np.float32)
+    if FLAGS.data_uint8_pipeline:
+      images = np.round(images * 255).astype(np.uint8)
     labels = np.ones((num_samples_per_epoch,), dtype=np.int32)
     ds = tf.data.Dataset.from_tensor_slices((images, labels))
     return ds.repeat(num_epochs)
@@ -223,9 +387,135 @@ class ImageDatasetV2(object):
     return feature_dict
 
   def _parse_fn(self, features):
-    image = tf.cast(features["image"], tf.float32) / 255.0
+    image = _convert_uint8_image(features["image"])
     return image, features["label"]
 
+  def _get_cache_split_name(self, split):
+    """Returns the name of the split in the dataset cache."""
+    if split == self._train_split:
+      return "train"
+    if split == self._eval_split:
+      return "test"
+    return str(split)
+
+  def _get_cache_path(self, split):
+    """Returns the cache directory of the split or None if it is not cached.
+
+    Args:
+      split: Name of the split.
+
+    Returns:
+      Path of the cache or None.
+
+    Raises:
+      ValueError: If the cache does not match the current configuration,
+        e.g. because it was written with a different crop method or
+        resolution.
+    """
+    if not FLAGS.data_cache_dir or FLAGS.data_fake_dataset:
+      return None
+    split_name = self._get_cache_split_name(split)
+    path = dataset_cache.get_cache_path(
+        FLAGS.data_cache_dir, self.name, split_name)
+    if not dataset_cache.cache_exists(path):
+      return None
+    self._check_cacheable(split_name)
+    metadata = dataset_cache.read_metadata(path)
+    margin = metadata["margin"]
+    if margin and split_name != "train":
+      raise ValueError("The cache in %s has a margin, which is only "
+                       "supported for the training split." % path)
+    expected_shape = [self._resolution + margin, self._resolution + margin,
+                      self._colors]
+    expected_transform = self.get_cache_transform_metadata(split_name)
+    if (metadata["image_shape"] != expected_shape or
+        metadata["transform"] != expected_transform):
+      raise ValueError(
+          "The cache in %s was written with images of shape %s and the "
+          "transformation %s, but %s and %s are configured." % (
+              path, metadata["image_shape"], metadata["transform"],
+              expected_shape, expected_transform))
+    return path
+
+  def _check_cacheable(self, split_name):
+    """Raises a ValueError if the labels of the split cannot be cached."""
+    if _get_replace_labels_file_pattern():
+      raise ValueError("Cannot cache split %s of %s with replaced labels." %
+                       (split_name, self.name))
+
+  def get_cache_transform_metadata(self, split_name):
+    """Returns a description of the _cache_transform_fn() of a split.
+
+    The description is stored with the cache. A cache is only read if it
+    matches the description of the current configuration.
+
+    Args:
+      split_name: "train" or "test".
+
+    Returns:
+      JSON serializable dictionary.
+    """
+    del split_name
+    return {}
+
+  def _cache_transform_fn(self, image, label, split_name, margin):
+    """Transforms parsed examples before they are written to the cache.
+
+    Args:
+      image: Image with values in [0, 1] returned by _parse_fn().
+      label: Label returned by _parse_fn().
+      split_name: "train" or "test".
+      margin: Number of pixels by which the cached images are larger than
+        the training resolution.
+
+    Returns:
+      Tuple of the transformed image and label.
+
+    Raises:
+      ValueError: If margin is not 0, this dataset has no random crops.
+    """
+    del split_name
+    if margin:
+      raise ValueError("Dataset %s does not support margins." % self.name)
+    return image, label
+
+  def get_cache_source(self, split_name, margin=0):
+    """Returns the examples to write to the cache for a split.
+
+    Args:
+      split_name: "train" or "test".
+      margin: Number of pixels by which the cached images are larger than
+        the training resolution. Leaves room for random crops. Only
+        supported for the training split.
+
+    Returns:
+      `tf.data.Dataset` with tuples of uint8 images and labels.
+
+    Raises:
+      ValueError: If the labels cannot be cached or margin is set for the
+        test split.
+    """
+    self._check_cacheable(split_name)
+    if margin and split_name != "train":
+      raise ValueError("Margins are only supported for the training split.")
+    split = {"train": self._train_split, "test": self._eval_split}[split_name]
+    ds = self._load_tfds_dataset(split)
+    if split_name == "train":
+      # The filters may depend on the original image.
+      ds = ds.filter(self._train_filter_fn)
+    ds = ds.map(functools.partial(self._cache_transform_fn,
+                                  split_name=split_name, margin=margin),
+                num_parallel_calls=FLAGS.data_num_parallel_calls)
+    def to_uint8(image, label):
+      if image.dtype != tf.uint8:
+        image = tf.cast(tf.round(image * 255.0), tf.uint8)
+      return image, label
+    return ds.map(to_uint8, num_parallel_calls=FLAGS.data_num_parallel_calls)
+
+  def _parse_cached_fn(self, image, label):
+    # The cache keeps the dtype of the labels returned by _parse_fn().
+    return _convert_uint8_image(image), label
+
   def _load_dataset(self, split):
     """Loads the underlying dataset split from disk.
 
@@ -237,13 +527,115 @@ class ImageDatasetV2(object):
     """
     if FLAGS.data_fake_dataset:
       return self._make_fake_dataset(split)
-    ds = tfds.load(
+    cache_path = self._get_cache_path(split)
+    if cache_path:
+      logging.info("Reading split %s from the cache in %s.", split, cache_path)
+      ds = dataset_cache.load_cache(
+          cache_path, num_parallel_calls=FLAGS.data_num_parallel_calls)
+      ds = ds.map(self._parse_cached_fn,
+                  num_parallel_calls=FLAGS.data_num_parallel_calls)
+      return ds.prefetch(tf.contrib.data.AUTOTUNE)
+    return self._load_tfds_dataset(split)
+
+  def _load_tfds_features(self, split):
+    """Returns the dataset with the TFDS feature dictionaries of the split."""
+    return tfds.load(
         self._tfds_name,
         split=split,
         data_dir=FLAGS.tfds_data_dir,
         as_dataset_kwargs={"shuffle_files": False})
+
+  def _load_tfds_dataset(self, split):
+    """Loads the split from TFDS and parses it, see _load_dataset()."""
+    ds = self._load_tfds_features(split)
     ds = self._replace_labels(split, ds)
-    ds = ds.map(self._parse_fn)
+    ds = ds.map(self._parse_fn,
+                num_parallel_calls=FLAGS.data_num_parallel_calls)
+    return ds.prefetch(tf.contrib.data.AUTOTUNE)
+
+  def _get_tfds_filenames(self, split):
+    """Returns the TFRecord files prepared by TFDS for the split.
+
+    Args:
+      split: Name of the split.
+
+    Returns:
+      Sorted list of filenames.
+
+    Raises:
+      ValueError: If the split is not a prepared TFDS split (e.g. a subsplit).
+    """
+    builder = tfds.builder(self._tfds_name, data_dir=FLAGS.tfds_data_dir)
+    if str(split) not in builder.info.splits:
+      raise ValueError("Cannot read the files of split {} of {}.".format(
+          split, self._tfds_name))
+    file_pattern = os.path.join(
+        builder.data_dir, "{}-{}.tfrecord*".format(builder.name, split))
+    filenames = sorted(tf.gfile.Glob(file_pattern))
+    if not filenames:
+      raise ValueError("No files match {}.".format(file_pattern))
+    return filenames
+
+  def _parse_tfds_record(self, serialized):
+    """Parses a serialized TFDS example without decoding the image."""
+    features_spec = {"image": tf.FixedLenFeature((), tf.string)}
+    if self._num_classes:
+      features_spec["label"] = tf.FixedLenFeature((), tf.int64)
+    return tf.parse_single_example(serialized, features_spec)
+
+  def _decode_tfds_features(self, features):
+    """Decodes the image in the features from _parse_tfds_record()."""
+    builder = tfds.builder(self._tfds_name, data_dir=FLAGS.tfds_data_dir)
+    image_shape = builder.info.features["image"].shape
+    features = dict(features)
+    features["image"] = tf.image.decode_image(
+        features["image"], channels=image_shape[-1])
+    features["image"].set_shape(image_shape)
+    return features
+
+  def _shuffles_records(self):
+    """Whether the training examples are shuffled before decoding."""
+    return (FLAGS.data_shuffle_before_decode and
+            not FLAGS.data_fake_dataset and
+            not self._get_cache_path(self._train_split))
+
+  def _load_shuffled_train_records(self, seed):
+    """Returns the training examples shuffled before decoding.
+
+    Args:
+      seed: Random seed for this host.
+
+    Returns:
+      `tf.data.Dataset` with an infinite stream of filtered (image, label)
+      tuples.
+
+    Raises:
+      ValueError: If the labels are replaced. The replacements are matched
+        by the order of the examples.
+    """
+    if _get_replace_labels_file_pattern():
+      raise ValueError("Replacing labels is not supported with "
+                       "--data_shuffle_before_decode.")
+    filenames = self._get_tfds_filenames(self._train_split)
+    logging.info("Shuffling %d files and serialized examples with seed %s.",
+                 len(filenames), seed)
+    ds = tf.data.Dataset.from_tensor_slices(filenames)
+    ds = ds.shuffle(len(filenames), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.apply(tf.data.experimental.parallel_interleave(
+        tf.data.TFRecordDataset,
+        cycle_length=min(len(filenames), FLAGS.data_reading_num_threads),
+        sloppy=False))
+    # Repeating after the shuffle keeps the epochs separate: every example is
+    # seen once per epoch and every epoch has a new order.
+    ds = ds.shuffle(FLAGS.data_record_shuffle_buffer_size, seed=seed,
+                    reshuffle_each_iteration=True)
+    ds = ds.repeat()
+    num_parallel_calls = FLAGS.data_num_parallel_calls
+    ds = ds.map(self._parse_tfds_record, num_parallel_calls=num_parallel_calls)
+    ds = ds.map(self._decode_tfds_features,
+                num_parallel_calls=num_parallel_calls)
+    ds = ds.map(self._parse_fn, num_parallel_calls=num_parallel_calls)
+    ds = ds.filter(self._train_filter_fn)
     return ds.prefetch(tf.contrib.data.AUTOTUNE)
 
   def _train_filter_fn(self, image, label):
@@ -258,6 +650,32 @@ class ImageDatasetV2(object):
     del seed
     return image, label
 
+  def _load_train_dataset(self, seed, tpu_context=None):
+    """Returns the filtered and repeated training examples (step 1-6).
+
+    Args:
+      seed: Random seed for this host.
+      tpu_context: TPU execution context.
+
+    Returns:
+      `tf.data.Dataset` with an infinite stream of (image, label) tuples.
+    """
+    del tpu_context  # Unused.
+    if self._shuffles_records():
+      return self._load_shuffled_train_records(seed)
+    ds = self._load_dataset(split=self._train_split)
+    if not self._get_cache_path(self._train_split):
+      # The cached training split is already filtered.
+      ds = ds.filter(self._train_filter_fn)
+    return ds.repeat()
+
+  def _shuffle_train_dataset(self, ds, seed):
+    """Shuffles the transformed training examples (step 9)."""
+    if self._shuffles_records():
+      # The serialized examples were shuffled.
+      return ds
+    return ds.shuffle(FLAGS.data_shuffle_buffer_size, seed=seed)
+
   def train_input_fn(self, params=None, preprocess_fn=None):
     """Input function for reading data.
 
@@ -275,9 +693,9 @@ class ImageDatasetV2(object):
     seed = self._get_per_host_random_seed(params.get("context", None))
     logging.info("train_input_fn(): params=%s seed=%s", params, seed)
 
-    ds = self._load_dataset(split=self._train_split)
-    ds = ds.filter(self._train_filter_fn)
-    ds = ds.repeat()
+    ds = self._load_train_dataset(seed, params.get("context", None))
+    if FLAGS.data_fast_train_pipeline:
+      return self._fast_train_pipeline(ds, params, preprocess_fn, seed)
     ds = ds.map(functools.partial(self._train_transform_fn, seed=seed))
     if preprocess_fn is not None:
       if "seed" in inspect.getargspec(preprocess_fn).args:
@@ -285,12 +703,94 @@ class ImageDatasetV2(object):
       ds = ds.map(preprocess_fn)
       # Add a feature for the random offset of operations in tpu_random.py.
       ds = tpu_random.add_random_offset_to_features(ds)
-    ds = ds.shuffle(FLAGS.data_shuffle_buffer_size, seed=seed)
+    ds = self._shuffle_train_dataset(ds, seed)
     if "batch_size" in params:
       ds = ds.batch(params["batch_size"], drop_remainder=True)
+    if FLAGS.data_uint8_pipeline:
+      ds = ds.map(self._pack_images_fn)
     return ds.prefetch(tf.contrib.data.AUTOTUNE)
 
-  def eval_input_fn(self, params=None, split=None):
+  def _fast_train_pipeline(self, ds, params, preprocess_fn, seed):
+    """Transforms, shuffles and batches the repeated training examples.
+
+    The transformation runs in parallel. The preprocessing and the random
+    offset are fused into a single function which is applied in parallel by
+    `map_and_batch`. Preprocessing after the shuffling does not change the
+    distribution of the examples, the offsets only need to be unique.
+
+    Args:
+      ds: `tf.data.Dataset` with the filtered and repeated (image, label)
+        tuples.
+      params: Python dictionary with parameters, see train_input_fn().
+      preprocess_fn: Function to process single examples, see
+        train_input_fn().
+      seed: Random seed for this host.
+
+    Returns:
+      `tf.data.Dataset` with preprocessed and batched examples.
+    """
+    num_parallel_calls = FLAGS.data_num_parallel_calls
+    ds = ds.map(functools.partial(self._train_transform_fn, seed=seed),
+                num_parallel_calls=num_parallel_calls)
+    ds = self._shuffle_train_dataset(ds, seed)
+    map_fn = None
+    if preprocess_fn is not None:
+      if "seed" in inspect.getargspec(preprocess_fn).args:
+        preprocess_fn = functools.partial(preprocess_fn, seed=seed)
+      # Add a feature for the random offset of operations in tpu_random.py.
+      ds = ds.apply(tf.data.experimental.enumerate_dataset(start=1))
+      def map_fn(offset, example):
+        return tpu_random.add_random_offset_to_example(
+            offset, preprocess_fn(*example))
+    if "batch_size" in params:
+      if map_fn is not None:
+        ds = ds.apply(tf.data.experimental.map_and_batch(
+            map_fn, params["batch_size"],
+            num_parallel_calls=num_parallel_calls, drop_remainder=True))
+      else:
+        ds = ds.batch(params["batch_size"], drop_remainder=True)
+    elif map_fn is not None:
+      ds = ds.map(map_fn, num_parallel_calls=num_parallel_calls)
+    if FLAGS.data_uint8_pipeline:
+      ds = ds.map(self._pack_images_fn, num_parallel_calls=num_parallel_calls)
+    ds = ds.prefetch(tf.contrib.data.AUTOTUNE)
+
+    options = tf.data.Options()
+    options.experimental_optimization.map_fusion = True
+    options.experimental_optimization.map_and_batch_fusion = True
+    options.experimental_optimization.autotune = True
+    if FLAGS.data_private_threadpool_size > 0:
+      options.experimental_threading.private_threadpool_size = (
+          FLAGS.data_private_threadpool_size)
+    return ds.with_options(options)
+
+  def _pack_images_fn(self, features, labels):
+    """Packs the uint8 images for the infeed, see pack_uint8_images()."""
+    if isinstance(features, dict):
+      features = dict(features)
+      features["images"] = pack_uint8_images(features["images"])
+    else:
+      features = pack_uint8_images(features)
+    return features, labels
+
+  def unpack_images(self, images):
+    """Converts images from train_input_fn() to float32 in [0, 1].
+
+    Args:
+      images: Batch of images. Either int32 images packed by
+        pack_uint8_images(), uint8 or float32 images.
+
+    Returns:
+      float32 tensor with shape [batch_size] + image_shape.
+    """
+    if images.dtype == tf.int32:
+      images = _unpack_uint8_values(images)
+      images = tf.reshape(
+          images, images.shape.as_list()[:-2] + list(self.image_shape))
+      return images / 255.0
+    return _images_to_float(images)
+
+  def eval_input_fn(self, params=None, split=None, drop_remainder=True):
     """Input function for reading data.
 
     Args:
@@ -298,6 +798,8 @@ class ImageDatasetV2(object):
         "batch_size". TPUEstimator will set this for you!
       split: Name of the split to use. If None will use the default eval split
         of the dataset.
+      drop_remainder: Whether to drop the last batch if it is smaller than
+        the batch size. Must be True on TPUs.
 
     Returns:
       `tf.data.Dataset` with preprocessed and batched examples.
@@ -311,10 +813,13 @@ class ImageDatasetV2(object):
 
     ds = self._load_dataset(split=split)
     # No filter, no rpeat.
-    ds = ds.map(functools.partial(self._eval_transform_fn, seed=seed))
+    ds = ds.map(functools.partial(self._eval_transform_fn, seed=seed),
+                num_parallel_calls=FLAGS.data_num_parallel_calls)
     # No shuffle.
     if "batch_size" in params:
-      ds = ds.batch(params["batch_size"], drop_remainder=True)
+      ds = ds.batch(params["batch_size"], drop_remainder=drop_remainder)
+    if FLAGS.data_uint8_pipeline:
+      ds = ds.map(lambda image, label: (_images_to_float(image), label))
     return ds.prefetch(tf.contrib.data.AUTOTUNE)
 
   # For backwards compatibility ImageDataset.
@@ -388,10 +893,10 @@ class CelebaDataset(ImageDatasetV2):
     """Returns 64x64x3 image and constant label."""
     image = features["image"]
     image = tf.image.resize_image_with_crop_or_pad(image, 160, 160)
+    image = _convert_uint8_image(image)
     # Note: possibly consider using NumPy's imresize(image, (64, 64))
-    image = tf.image.resize_images(image, [64, 64])
+    image = _resize_images(image, [64, 64])
     image.set_shape(self.image_shape)
-    image = tf.cast(image, tf.float32) / 255.0
     label = tf.constant(0, dtype=tf.int32)
     return image, label
 
@@ -422,56 +927,91 @@ class LsunBedroomDataset(ImageDatasetV2):
     image = features["image"]
     image = tf.image.resize_image_with_crop_or_pad(
         image, target_height=128, target_width=128)
-    image = tf.cast(image, tf.float32) / 255.0
+    image = _convert_uint8_image(image)
     label = tf.constant(0, dtype=tf.int32)
     return image, label
 
 
+def _get_image_shape(image):
+  """Returns the shape of a decoded image or of an encoded JPEG string."""
+  if image.dtype == tf.string:
+    return tf.image.extract_jpeg_shape(image)
+  return tf.shape(image)
+
+
+def _crop_image(image, begin, size, channels):
+  """Crops a decoded image or decodes only the crop of an encoded JPEG.
+
+  Args:
+    image: 3-D tensor with a single image or scalar string tensor with the
+      encoded JPEG.
+    begin: Offset (y, x) of the crop window.
+    size: Size (height, width) of the crop window.
+    channels: Number of color channels.
+
+  Returns:
+    3-D tensor with the cropped image. Decoded JPEGs are converted with
+    _convert_uint8_image().
+  """
+  if image.dtype == tf.string:
+    crop_window = tf.stack([begin[0], begin[1], size[0], size[1]])
+    image = tf.image.decode_and_crop_jpeg(image, crop_window,
+                                          channels=channels)
+    return _convert_uint8_image(image)
+  return tf.slice(image, [begin[0], begin[1], 0], [size[0], size[1], -1])
+
+
 def _transform_imagnet_image(image, target_image_shape, crop_method, seed):
   """Preprocesses ImageNet images to have a target image shape.
 
+  Encoded images are not fully decoded, the crop window is computed from the
+  JPEG header and only the cropped region is decoded.
+
   Args:
-    image: 3-D tensor with a single image.
+    image: 3-D tensor with a single image or scalar string tensor with the
+      encoded JPEG.
     target_image_shape: List/Tuple with target image shape.
     crop_method: Method for cropping the image:
       One of: distorted, random, middle, none
     seed: Random seed, only used for `crop_method=distorted`.
 
   Returns:
-    Image tensor with shape `target_image_shape`.
+    Image tensor with shape `target_image_shape`. Decoded images keep their
+    dtype, see _convert_uint8_image() for encoded images.
   """
+  channels = target_image_shape[-1]
+  shape = _get_image_shape(image)
   if crop_method == "distorted":
     begin, size, _ = tf.image.sample_distorted_bounding_box(
-        tf.shape(image),
+        shape,
         tf.zeros([0, 0, 4], tf.float32),
         aspect_ratio_range=[1.0, 1.0],
         area_range=[0.5, 1.0],
         use_image_if_no_bounding_boxes=True,
         seed=seed)
-    image = tf.slice(image, begin, size)
-    # Unfortunately, the above operation loses the depth-dimension. So we need
-    # to restore it the manual way.
-    image.set_shape([None, None, target_image_shape[-1]])
+    image = _crop_image(image, begin[:2], size[:2], channels)
   elif crop_method == "random":
     tf.set_random_seed(seed)
-    shape = tf.shape(image)
     h, w = shape[0], shape[1]
     size = tf.minimum(h, w)
     begin = [h - size, w - size] * tf.random.uniform([2], 0, 1)
     begin = tf.cast(begin, tf.int32)
-    begin = tf.concat([begin, [0]], axis=0)  # Add channel dimension.
-    image = tf.slice(image, begin, [size, size, 3])
+    image = _crop_image(image, begin, [size, size], channels)
   elif crop_method == "middle":
-    shape = tf.shape(image)
     h, w = shape[0], shape[1]
     size = tf.minimum(h, w)
     begin = tf.cast([h - size, w - size], tf.float32) / 2.0
     begin = tf.cast(begin, tf.int32)
-    begin = tf.concat([begin, [0]], axis=0)  # Add channel dimension.
-    image = tf.slice(image, begin, [size, size, 3])
+    image = _crop_image(image, begin, [size, size], channels)
   elif crop_method != "none":
     raise ValueError("Unsupported crop method: {}".format(crop_method))
-  image = tf.image.resize_images(
+  elif image.dtype == tf.string:
+    image = _convert_uint8_image(
+        tf.image.decode_jpeg(image, channels=channels))
+  # Slicing and decoding lose the depth-dimension. So we need to restore it
+  # the manual way.
+  image.set_shape([None, None, channels])
+  image = _resize_images(
       image, [target_image_shape[0], target_image_shape[1]])
   image.set_shape(target_image_shape)
   return image
@@ -497,6 +1037,32 @@ def _eval_imagenet_transform(image, target_image_shape, seed,
       seed=seed)
 
 
+def _get_replace_labels_file_pattern():
+  """Returns the file pattern bound to replace_labels or None."""
+  try:
+    return gin.query_parameter("replace_labels.file_pattern")
+  except ValueError:
+    return None
+
+
+def _get_train_imagenet_crop_method():
+  """Returns the crop method used by _train_imagenet_transform()."""
+  try:
+    return gin.query_parameter("train_imagenet_transform.crop_method")
+  except ValueError:
+    # Not bound, _train_imagenet_transform() uses its default value.
+    return "distorted"
+
+
+def _get_eval_imagenet_crop_method():
+  """Returns the crop method used by _eval_imagenet_transform()."""
+  try:
+    return gin.query_parameter("eval_imagenet_transform.crop_method")
+  except ValueError:
+    # Not bound, _eval_imagenet_transform() uses its default value.
+    return "middle"
+
+
 class ImagenetDataset(ImageDatasetV2):
   """ImageNet2012 as defined by TF Datasets."""
 
@@ -514,6 +1080,88 @@ class ImagenetDataset(ImageDatasetV2):
     self._eval_split = tfds.Split.VALIDATION
     self._filter_unlabeled = filter_unlabeled
 
+  def _load_tfds_features(self, split):
+    """Returns the features of the split with encoded images.
+
+    With --data_decode_and_crop the images are not decoded. The TFDS version
+    used does not support skipping the decoding, so the serialized examples
+    are read from the TFRecord files prepared by TFDS.
+
+    Args:
+      split: Name of the split to load.
+
+    Returns:
+      `tf.data.Dataset` with feature dictionaries.
+
+    Raises:
+      ValueError: If the split was not prepared, see _get_tfds_filenames().
+    """
+    if not FLAGS.data_decode_and_crop:
+      return super(ImagenetDataset, self)._load_tfds_features(split)
+    ds = tf.data.TFRecordDataset(
+        self._get_tfds_filenames(split),
+        num_parallel_reads=FLAGS.data_reading_num_threads)
+    return ds.map(self._parse_tfds_record,
+                  num_parallel_calls=FLAGS.data_num_parallel_calls)
+
+  def _parse_tfds_record(self, serialized):
+    features_spec = {
+        "image": tf.FixedLenFeature((), tf.string),
+        "label": tf.FixedLenFeature((), tf.int64),
+        "file_name": tf.FixedLenFeature((), tf.string),
+    }
+    return tf.parse_single_example(serialized, features_spec)
+
+  def _decode_tfds_features(self, features):
+    if FLAGS.data_decode_and_crop:
+      # The transformations decode the cropped region of the JPEG.
+      return features
+    return super(ImagenetDataset, self)._decode_tfds_features(features)
+
+  def _parse_fn(self, features):
+    if FLAGS.data_decode_and_crop:
+      # The transformations decode the cropped region of the JPEG.
+      return features["image"], features["label"]
+    return super(ImagenetDataset, self)._parse_fn(features)
+
+  def _get_crop_method(self, split_name):
+    if split_name == "train":
+      return _get_train_imagenet_crop_method()
+    return _get_eval_imagenet_crop_method()
+
+  def get_cache_transform_metadata(self, split_name):
+    return {"crop_method": self._get_crop_method(split_name),
+            "resolution": self._resolution}
+
+  def _cache_transform_fn(self, image, label, split_name, margin):
+    """Crops the image and resizes it to the resolution plus margin.
+
+    The crop method configured for the split is used.
+
+    Args:
+      image: Image returned by _parse_fn().
+      label: Label returned by _parse_fn().
+      split_name: "train" or "test".
+      margin: Number of pixels by which the cached images are larger than
+        the training resolution.
+
+    Returns:
+      Tuple of the transformed image and label.
+
+    Raises:
+      ValueError: If the crop method is random. Cached random crops would be
+        the same in every epoch.
+    """
+    crop_method = self._get_crop_method(split_name)
+    if crop_method not in ("middle", "none"):
+      raise ValueError("Cannot cache images with random crop method %s." %
+                       crop_method)
+    size = self._resolution + margin
+    image = _transform_imagnet_image(
+        image, target_image_shape=(size, size, self._colors),
+        crop_method=crop_method, seed=None)
+    return image, label
+
   def _train_filter_fn(self, image, label):
     del image
     if not self._filter_unlabeled:
@@ -522,15 +1170,25 @@ class ImagenetDataset(ImageDatasetV2):
     return tf.math.greater_equal(label, 0)
 
   def _train_transform_fn(self, image, label, seed):
+    if image.shape.as_list() == list(self.image_shape):
+      # Cached without margin, the image is already transformed.
+      return image, label
     image = _train_imagenet_transform(
         image=image, target_image_shape=self.image_shape, seed=seed)
     return image, label
 
   def _eval_transform_fn(self, image, label, seed):
+    if image.shape.as_list() == list(self.image_shape):
+      # The cached image is already transformed.
+      return image, label
     image = _eval_imagenet_transform(
         image=image, target_image_shape=self.image_shape, seed=seed)
     return image, label
 
+  @property
+  def eval_transform_name(self):
+    return "imagenet_{}".format(_get_eval_imagenet_crop_method())
+
 
 class SizeFilteredImagenetDataset(ImagenetDataset):
   """ImageNet from TFDS filtered by image size."""
@@ -545,7 +1203,7 @@ class SizeFilteredImagenetDataset(ImagenetDataset):
   def _train_filter_fn(self, image, label):
     """The minimum image dimension has to be larger than the threshold."""
     del label
-    size = tf.math.reduce_min(tf.shape(image)[:2])
+    size = tf.math.reduce_min(_get_image_shape(image)[:2])
     return tf.greater_equal(size, self._threshold)
 
 
@@ -583,6 +1241,11 @@ class RandomClassImagenetDataset(ImagenetDataset):
     label = tf.random.uniform(minval=0, maxval=1000, dtype=tf.int32)
     return image, label
 
+  def _check_cacheable(self, split_name):
+    # Cached labels would be the same in every epoch.
+    raise ValueError("Cannot cache split %s of %s with random labels." %
+                     (split_name, self.name))
+
 
 class SoftLabeledImagenetDataset(ImagenetDataset):
   """ImageNet2012 dataset with soft labels."""
@@ -617,6 +1280,127 @@ class SoftLabeledImagenetDataset(ImagenetDataset):
     return feature_dict
 
 
+@gin.configurable("numpy_dataset", whitelist=["name", "data_dir",
+                                               "num_classes"])
+class NumpyDataset(ImageDatasetV2):
+  """Dataset with all images of a split in a single uint8 array.
+
+  Low resolution datasets fit in memory. Instead of parsing TFDS protobufs the
+  images and labels are read from the memory-mapped NumPy files
+  "<split>_images.npy" (uint8 with shape [N, H, W, C]) and
+  "<split>_labels.npy" (integers with shape [N]) in `data_dir`. The splits are
+  "train" and "test". Only the accessed pages are read by the OS and shared
+  between processes.
+
+  The training examples are shuffled by drawing a new permutation of the
+  indices in every epoch, there is no shuffle buffer.
+
+  The arrays are read with `tf.data.Dataset.from_generator()`, which runs
+  Python code in the input pipeline. This is not supported by Cloud TPUs, the
+  dataset can only be used for training on CPUs and GPUs.
+  """
+
+  def __init__(self, seed, name="numpy", data_dir=None, num_classes=None):
+    if not data_dir:
+      raise ValueError("NumpyDataset requires a data_dir.")
+    self._data_dir = data_dir
+    test_images, _ = self._load_arrays("test")
+    _, resolution, width, colors = test_images.shape
+    if resolution != width:
+      raise ValueError("Only square images are supported, got shape %s." %
+                       (test_images.shape,))
+    super(NumpyDataset, self).__init__(
+        name=name,
+        tfds_name=None,
+        resolution=resolution,
+        colors=colors,
+        num_classes=num_classes,
+        eval_test_samples=len(test_images),
+        seed=seed)
+    self._train_split = "train"
+    self._eval_split = "test"
+
+  def _load_arrays(self, split):
+    """Returns the memory-mapped images and labels of the split."""
+    path = os.path.join(self._data_dir, str(split))
+    images = np.load(path + "_images.npy", mmap_mode="r")
+    labels = np.load(path + "_labels.npy", mmap_mode="r")
+    if images.dtype != np.uint8 or images.ndim != 4:
+      raise ValueError("Expected uint8 images with 4 dimensions in %s, got "
+                       "%s %s." % (path, images.dtype, images.shape))
+    if labels.shape != images.shape[:1]:
+      raise ValueError("Expected %d labels in %s, got shape %s." %
+                       (len(images), path, labels.shape))
+    return images, labels
+
+  def _make_dataset(self, images, labels, generate_indices):
+    """Creates a dataset from the arrays.
+
+    Args:
+      images: Array with the images.
+      labels: Array with the labels.
+      generate_indices: Function without arguments returning an iterable of
+        slices or index arrays into the arrays. The examples are returned in
+        this order.
+
+    Returns:
+      `tf.data.Dataset` with (image, label) tuples.
+    """
+    def generator():
+      for indices in generate_indices():
+        yield images[indices], labels[indices].astype(np.int32)
+
+    ds = tf.data.Dataset.from_generator(
+        generator,
+        output_types=(tf.uint8, tf.int32),
+        output_shapes=([None] + list(images.shape[1:]), [None]))
+    ds = ds.apply(tf.data.experimental.unbatch())
+    ds = ds.map(self._parse_fn,
+                num_parallel_calls=FLAGS.data_num_parallel_calls)
+    return ds.prefetch(tf.contrib.data.AUTOTUNE)
+
+  def _parse_fn(self, image, label):
+    return _convert_uint8_image(image), label
+
+  @property
+  def eval_transform_name(self):
+    # Datasets with the same name can be read from different directories.
+    return "numpy_{}".format(os.path.abspath(self._data_dir))
+
+  def _load_dataset(self, split):
+    if FLAGS.data_fake_dataset:
+      return self._make_fake_dataset(split)
+    images, labels = self._load_arrays(split)
+    def generate_indices():
+      for start in range(0, len(images), _NUMPY_CHUNK_SIZE):
+        yield slice(start, start + _NUMPY_CHUNK_SIZE)
+    return self._make_dataset(images, labels, generate_indices)
+
+  def _load_train_dataset(self, seed, tpu_context=None):
+    if FLAGS.data_fake_dataset:
+      return super(NumpyDataset, self)._load_train_dataset(seed, tpu_context)
+    if tpu_context is not None:
+      raise ValueError("NumpyDataset uses Python code in the input pipeline "
+                       "and does not support TPUs.")
+    images, labels = self._load_arrays(self._train_split)
+
+    def generate_indices():
+      random_state = np.random.RandomState(seed)
+      while True:
+        indices = random_state.permutation(len(images))
+        for start in range(0, len(indices), _NUMPY_CHUNK_SIZE):
+          yield indices[start:start + _NUMPY_CHUNK_SIZE]
+
+    ds = self._make_dataset(images, labels, generate_indices)
+    return ds.filter(self._train_filter_fn)
+
+  def _shuffle_train_dataset(self, ds, seed):
+    if FLAGS.data_fake_dataset:
+      return super(NumpyDataset, self)._shuffle_train_dataset(ds, seed)
+    # The examples are already in random order.
+    return ds
+
+
 DATASETS = {
     "celeb_a": CelebaDataset,
     "cifar10": Cifar10Dataset,
@@ -637,6 +1421,7 @@ DATASETS = {
         RandomClassImagenetDataset, resolution=128),
     "labeled_only_imagenet_128": functools.partial(
         ImagenetDataset, resolution=128, filter_unlabeled=True),
+    "numpy": NumpyDataset,
 }
 
 
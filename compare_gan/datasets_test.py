@@ -19,11 +19,14 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+
 from absl import flags
 from absl.testing import flagsaver
 from absl.testing import parameterized
 from compare_gan import datasets
 
+import numpy as np
 import tensorflow as tf
 
 FLAGS = flags.FLAGS
@@ -101,6 +104,232 @@ class DatasetsTest(parameterized.TestCase, tf.test.TestCase):
       self.assertAllClose(batches1[i][0], batches2[i][0])
       self.assertAllClose(batches1[i][1], batches2[i][1])
 
+  @flagsaver.flagsaver
+  def test_fast_train_pipeline(self):
+    FLAGS.data_fake_dataset = True
+    FLAGS.data_fast_train_pipeline = True
+    FLAGS.data_private_threadpool_size = 2
+    dataset = datasets.get_dataset("cifar10")
+    with tf.Graph().as_default():
+      ds = dataset.input_fn(params={"batch_size": 4},
+                            preprocess_fn=_preprocess_fn_id)
+      features, labels = ds.make_one_shot_iterator().get_next()
+      self.assertAllEqual(features["images"].shape.as_list(), [4, 32, 32, 3])
+      self.assertAllEqual(labels.shape.as_list(), [4])
+      with self.session() as sess:
+        offsets = [sess.run(features["_RANDOM_OFFSET"]) for _ in range(5)]
+    # Every example gets a unique offset.
+    self.assertLen(set(np.concatenate(offsets)), 20)
+
+  @flagsaver.flagsaver
+  def test_uint8_pipeline(self):
+    FLAGS.data_fake_dataset = True
+    FLAGS.data_uint8_pipeline = True
+    dataset = datasets.get_dataset("cifar10")
+    with tf.Graph().as_default():
+      ds = dataset.input_fn(params={"batch_size": 4},
+                            preprocess_fn=_preprocess_fn_id)
+      features, _ = ds.make_one_shot_iterator().get_next()
+      self.assertEqual(features["images"].dtype, tf.int32)
+      self.assertAllEqual(features["images"].shape.as_list(), [4, 768])
+      images = dataset.unpack_images(features["images"])
+      self.assertEqual(images.dtype, tf.float32)
+      self.assertAllEqual(images.shape.as_list(), [4, 32, 32, 3])
+      eval_images, _ = dataset.eval_input_fn(
+          params={"batch_size": 4}).make_one_shot_iterator().get_next()
+      self.assertEqual(eval_images.dtype, tf.float32)
+      with self.session() as sess:
+        images = sess.run(images)
+    self.assertGreaterEqual(images.min(), 0.0)
+    self.assertLessEqual(images.max(), 1.0)
+
+  def test_pack_uint8_images(self):
+    images = np.random.randint(0, 256, size=(2, 4, 4, 3)).astype(np.uint8)
+    with tf.Graph().as_default():
+      packed = datasets.pack_uint8_images(tf.constant(images))
+      self.assertAllEqual(packed.shape.as_list(), [2, 12])
+      unpacked = tf.bitcast(packed, tf.uint8)
+      with self.session() as sess:
+        unpacked = sess.run(tf.reshape(unpacked, [2, 4, 4, 3]))
+    self.assertAllEqual(unpacked, images)
+
+  @flagsaver.flagsaver
+  def test_unpack_images_compiles_with_xla(self):
+    FLAGS.data_fake_dataset = True
+    dataset = datasets.get_dataset("cifar10")
+    images = np.random.randint(0, 256, size=(2, 32, 32, 3)).astype(np.uint8)
+    with tf.Graph().as_default():
+      packed = datasets.pack_uint8_images(tf.constant(images))
+      # Only the unpacking runs on the device, like in the model_fn.
+      packed = tf.placeholder_with_default(packed, packed.shape)
+      unpacked = tf.contrib.compiler.xla.compile(
+          dataset.unpack_images, inputs=[packed])
+      with self.session() as sess:
+        unpacked = sess.run(unpacked)
+    unpacked = unpacked[0] if isinstance(unpacked, list) else unpacked
+    self.assertAllClose(unpacked, images / 255.0)
+
+  @parameterized.parameters("middle", "distorted", "none")
+  def test_transform_encoded_imagenet_image(self, crop_method):
+    image = np.random.randint(0, 256, size=(48, 64, 3)).astype(np.uint8)
+    with tf.Graph().as_default():
+      encoded = tf.image.encode_jpeg(image, quality=100,
+                                     chroma_downsampling=False)
+      decoded = tf.cast(tf.image.decode_jpeg(encoded), tf.float32) / 255.0
+      transformed = [
+          datasets._transform_imagnet_image(
+              x, target_image_shape=(32, 32, 3), crop_method=crop_method,
+              seed=7)
+          for x in [encoded, decoded]]
+      self.assertEqual(transformed[0].dtype, tf.float32)
+      with self.session() as sess:
+        from_encoded, from_decoded = sess.run(transformed)
+    self.assertAllClose(from_encoded, from_decoded, atol=2.0 / 255)
+
+  def _write_fake_cache(self, dataset, split_name, image_shape, labels,
+                        transform_metadata, margin=0):
+    path = dataset_cache.get_cache_path(
+        FLAGS.data_cache_dir, dataset.name, split_name)
+    images = np.zeros([len(labels)] + image_shape, np.uint8)
+    with tf.Graph().as_default():
+      dataset_cache.write_cache(
+          tf.data.Dataset.from_tensor_slices((images, labels)), path,
+          num_shards=1, margin=margin, transform_metadata=transform_metadata)
+
+  @flagsaver.flagsaver
+  def test_cached_split_keeps_label_dtype(self):
+    FLAGS.data_cache_dir = os.path.join(self.get_temp_dir(), "label_dtype")
+    dataset = datasets.get_dataset("cifar10")
+    self._write_fake_cache(dataset, "test", [32, 32, 3],
+                           np.arange(4, dtype=np.int64), {})
+    with tf.Graph().as_default():
+      ds = dataset._load_dataset(dataset._eval_split)
+      self.assertEqual(ds.output_types[1], tf.int64)
+
+  @flagsaver.flagsaver
+  def test_cache_with_other_crop_method_is_rejected(self):
+    FLAGS.data_cache_dir = os.path.join(self.get_temp_dir(), "crop_method")
+    dataset = datasets.get_dataset("imagenet_64")
+    self._write_fake_cache(dataset, "test", [64, 64, 3],
+                           np.arange(4, dtype=np.int64),
+                           dataset.get_cache_transform_metadata("test"))
+    self.assertTrue(dataset._get_cache_path(dataset._eval_split))
+    gin.bind_parameter("eval_imagenet_transform.crop_method", "none")
+    try:
+      with self.assertRaises(ValueError):
+        dataset._get_cache_path(dataset._eval_split)
+    finally:
+      gin.clear_config()
+
+  def test_cache_source_rejects_test_margin_and_random_labels(self):
+    with self.assertRaises(ValueError):
+      datasets.get_dataset("imagenet_64").get_cache_source("test", margin=8)
+    with self.assertRaises(ValueError):
+      datasets.get_dataset("random_class_imagenet_128").get_cache_source(
+          "train")
+
+  def _make_numpy_dataset(self, num_train_examples, num_test_examples,
+                          sub_dir="numpy"):
+    data_dir = os.path.join(self.get_temp_dir(), sub_dir)
+    tf.gfile.MakeDirs(data_dir)
+    for split, num_examples in [("train", num_train_examples),
+                                ("test", num_test_examples)]:
+      images = np.random.randint(0, 256, size=(num_examples, 8, 8, 3))
+      np.save(os.path.join(data_dir, split + "_images.npy"),
+              images.astype(np.uint8))
+      np.save(os.path.join(data_dir, split + "_labels.npy"),
+              np.arange(num_examples))
+    return datasets.NumpyDataset(seed=1, data_dir=data_dir, num_classes=10)
+
+  def test_numpy_dataset_eval(self):
+    dataset = self._make_numpy_dataset(10, 300)
+    self.assertEqual(dataset.image_shape, (8, 8, 3))
+    self.assertEqual(dataset.eval_test_samples, 300)
+    with tf.Graph().as_default():
+      ds = dataset.eval_input_fn(params={"batch_size": 300})
+      images, labels = ds.make_one_shot_iterator().get_next()
+      with self.session() as sess:
+        images, labels = sess.run([images, labels])
+    self.assertAllEqual(labels, np.arange(300))
+    self.assertEqual(images.dtype, np.float32)
+    self.assertLessEqual(images.max(), 1.0)
+
+  def test_numpy_dataset_train_sees_every_example_per_epoch(self):
+    dataset = self._make_numpy_dataset(10, 5)
+    with tf.Graph().as_default():
+      ds = dataset.train_input_fn(params={"batch_size": 5})
+      _, labels = ds.make_one_shot_iterator().get_next()
+      with self.session() as sess:
+        epochs = [np.concatenate([sess.run(labels), sess.run(labels)])
+                  for _ in range(3)]
+    for epoch in epochs:
+      self.assertAllEqual(np.sort(epoch), np.arange(10))
+    self.assertFalse(np.array_equal(epochs[0], epochs[1]))
+
+  def test_numpy_dataset_eval_transform_name_depends_on_data_dir(self):
+    dataset1 = self._make_numpy_dataset(10, 5, sub_dir="numpy1")
+    dataset2 = self._make_numpy_dataset(10, 5, sub_dir="numpy2")
+    self.assertEqual(dataset1.name, dataset2.name)
+    self.assertNotEqual(dataset1.eval_transform_name,
+                        dataset2.eval_transform_name)
+
+  def test_numpy_dataset_rejects_tpu(self):
+    dataset = self._make_numpy_dataset(10, 5)
+    tpu_context = mock.Mock(current_host=0, num_hosts=1)
+    with tf.Graph().as_default():
+      with self.assertRaises(ValueError):
+        dataset.train_input_fn(params={"batch_size": 5,
+                                       "context": tpu_context})
+
+  def _write_tfds_records(self, num_shards, examples_per_shard):
+    """Writes TFRecord shards like TFDS, the labels number the examples."""
+    filenames = []
+    with tf.Graph().as_default():
+      image = tf.placeholder(tf.uint8, [32, 32, 3])
+      encoded_image = tf.image.encode_png(image)
+      with self.session() as sess:
+        for shard in range(num_shards):
+          filename = os.path.join(self.get_temp_dir(),
+                                  "cifar10-train.tfrecord-%05d" % shard)
+          with tf.python_io.TFRecordWriter(filename) as writer:
+            for i in range(examples_per_shard):
+              label = shard * examples_per_shard + i
+              encoded = sess.run(encoded_image, {
+                  image: np.full([32, 32, 3], label, np.uint8)})
+              example = tf.train.Example(features=tf.train.Features(feature={
+                  "image": tf.train.Feature(
+                      bytes_list=tf.train.BytesList(value=[encoded])),
+                  "label": tf.train.Feature(
+                      int64_list=tf.train.Int64List(value=[label])),
+              }))
+              writer.write(example.SerializeToString())
+          filenames.append(filename)
+    return filenames
+
+  def _read_shuffled_train_labels(self, dataset, seed, num_examples):
+    with tf.Graph().as_default():
+      ds = dataset._load_train_dataset(seed)
+      _, label = ds.make_one_shot_iterator().get_next()
+      with self.session() as sess:
+        return np.array([sess.run(label) for _ in range(num_examples)])
+
+  @flagsaver.flagsaver
+  def test_shuffle_before_decode(self):
+    FLAGS.data_shuffle_before_decode = True
+    FLAGS.data_record_shuffle_buffer_size = 8
+    filenames = self._write_tfds_records(num_shards=4, examples_per_shard=5)
+    dataset = datasets.get_dataset("cifar10")
+    self.assertTrue(dataset._shuffles_records())
+    with mock.patch.object(dataset, "_get_tfds_filenames",
+                           return_value=filenames):
+      labels = self._read_shuffled_train_labels(dataset, 7, 40)
+      labels_same_seed = self._read_shuffled_train_labels(dataset, 7, 40)
+    epochs = [labels[:20], labels[20:]]
+    for epoch in epochs:
+      self.assertAllEqual(np.sort(epoch), np.arange(20))
+    self.assertFalse(np.array_equal(epochs[0], epochs[1]))
+    self.assertAllEqual(labels, labels_same_seed)
+
   @flagsaver.flagsaver
   def test_train_input_fn_noise_changes(self):
     FLAGS.data_fake_dataset = True
@@ -19,6 +19,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import functools
 import os
 from absl import flags
 from absl import logging
@@ -36,6 +38,12 @@ import tensorflow_hub as hub
 
 FLAGS = flags.FLAGS
 
+flags.DEFINE_bool(
+    "eval_bootstrap", False,
+    "If True, the generated data is sampled once and the statistics over "
+    "num_eval_averaging_runs are computed on bootstrap resamples of it. "
+    "Otherwise a new data set is generated for every run.")
+
 # Special value returned when a fake image generated by a GAN has NaNs.
 NAN_DETECTED = 31337.0
 
@@ -62,38 +70,226 @@ def z_generator(shape, distribution_fn=tf.random.uniform,
       stddev=stddev, name=name)
 
 
-def _update_bn_accumulators(sess, generated, num_accu_examples):
-  """Returns True if the accumlators for batch norm were updated.
+# Ops to fill the batch norm accumulators, see _build_bn_accumulator_ops().
+BatchNormAccumulatorOps = collections.namedtuple(
+    "BatchNormAccumulatorOps", ["enable_updates", "disable_updates",
+                                "estimates"])
 
-  Args:
-    sess: `tf.Session` object. Checkpoint should already be loaded.
-    generated: Output tensor of the generator.
-    num_accu_examples: How many examples should be used to update accumulators.
+
+def _build_bn_accumulator_ops():
+  """Builds the ops to fill the batch norm accumulators of the default graph.
+
+  The ops are built once per graph, so evaluating many checkpoints with the
+  same graph does not add ops.
 
   Returns:
-    True if there were accumlators.
+    `BatchNormAccumulatorOps` or None if the graph has no accumulators.
+    `estimates` is a tuple of two 1-D tensors with the accumulated means and
+    variances of all batch norm layers, each divided by the number of
+    accumulated batches.
   """
-  # Create update ops for batch statistic updates for each batch normalization
-  # with accumlators.
   update_accu_switches = [v for v in tf.global_variables()
                           if "accu/update_accus" in v.name]
   logging.info("update_accu_switches: %s", update_accu_switches)
   if not update_accu_switches:
-    return False
-  sess.run([tf.assign(v, 1) for v in update_accu_switches])
+    return None
+  # The other accumulator variables are in the scope of the switch.
+  variables_by_name = {v.op.name: v for v in tf.global_variables()}
+  means, variances = [], []
+  for switch in update_accu_switches:
+    scope = switch.op.name[:-len("update_accus")]
+    counter = variables_by_name[scope + "accu_counter"]
+    means.append(tf.reshape(
+        variables_by_name[scope + "accu_mean"] / counter, [-1]))
+    variances.append(tf.reshape(
+        variables_by_name[scope + "accu_variance"] / counter, [-1]))
+  return BatchNormAccumulatorOps(
+      enable_updates=tf.group([tf.assign(v, 1) for v in update_accu_switches]),
+      disable_updates=tf.group(
+          [tf.assign(v, 0) for v in update_accu_switches]),
+      estimates=(tf.concat(means, axis=0), tf.concat(variances, axis=0)))
+
+
+def _relative_change(new_value, old_value, epsilon=1e-12):
+  return (np.linalg.norm(new_value - old_value) /
+          max(np.linalg.norm(old_value), epsilon))
+
+
+@gin.configurable("bn_accumulators",
+                  whitelist=["max_examples", "min_examples",
+                             "check_every_examples", "tolerance"])
+def _update_bn_accumulators(sess, generated, accu_ops, max_examples=204800,
+                            min_examples=20480, check_every_examples=10240,
+                            tolerance=1e-3):
+  """Fills the accumulators for batch norm and returns the examples used.
+
+  The accumulators store the sum of the batch moments, the estimates used
+  during inference are these sums divided by the number of batches. Every
+  `check_every_examples` examples the relative change of the estimates is
+  computed and the update stops early once it is below `tolerance` for both
+  the means and the variances.
+
+  Args:
+    sess: `tf.Session` object. Checkpoint should already be loaded.
+    generated: Output tensor of the generator. Larger batches reduce the
+      number of session calls.
+    accu_ops: `BatchNormAccumulatorOps` built by _build_bn_accumulator_ops()
+      in the graph of `sess` or None if there are no accumulators.
+    max_examples: Maximum number of examples used to update the accumulators.
+    min_examples: Number of examples used before checking for convergence.
+    check_every_examples: How often to check for convergence.
+    tolerance: Maximum relative change of the estimates (in L2 norm) between
+      two checks to stop. Set to 0 to always use `max_examples`.
+
+  Returns:
+    Number of examples that were used to update the accumulators, 0 if the
+    generator has no accumulators.
+  """
+  if accu_ops is None:
+    return 0
   batch_size = generated.shape[0].value
-  num_batches = num_accu_examples // batch_size
+  num_batches = max(max_examples // batch_size, 1)
+  min_batches = min_examples // batch_size
+  check_every_batches = max(check_every_examples // batch_size, 1)
+  sess.run(accu_ops.enable_updates)
+  previous_estimates = None
   for i in range(num_batches):
     if i % 500 == 0:
       logging.info("Updating BN accumulators %d/%d steps.", i, num_batches)
     sess.run(generated)
-  sess.run([tf.assign(v, 0) for v in update_accu_switches])
-  logging.info("Done updating BN accumulators.")
-  return True
+    if tolerance <= 0 or (i + 1) % check_every_batches:
+      continue
+    mean, variance = sess.run(accu_ops.estimates)
+    if previous_estimates is not None and i + 1 >= min_batches:
+      mean_change = _relative_change(mean, previous_estimates[0])
+      variance_change = _relative_change(variance, previous_estimates[1])
+      logging.info("Relative change of BN accumulators after %d examples: "
+                   "mean %.3g, variance %.3g.", (i + 1) * batch_size,
+                   mean_change, variance_change)
+      if max(mean_change, variance_change) < tolerance:
+        num_batches = i + 1
+        break
+    previous_estimates = (mean, variance)
+  sess.run(accu_ops.disable_updates)
+  num_examples = num_batches * batch_size
+  logging.info("Done updating BN accumulators with %d examples.", num_examples)
+  return num_examples
+
+
+def _run_eval_tasks(eval_tasks, fake_dsets, real_dset):
+  """Runs all the tasks and returns the statistics of their results.
+
+  Args:
+    eval_tasks: List of objects that inherit from EvalTask.
+    fake_dsets: Iterable with an `EvalDataSample` for each averaging run.
+      It is iterated once per task.
+    real_dset: `EvalDataSample` with the real data.
+
+  Returns:
+    Dict[Text, float] with mean, standard deviation and list of the scores.
+  """
+  result_dict = {}
+  for task in eval_tasks:
+    task_results_dicts = [
+        task.run_after_session(fake_dset, real_dset)
+        for fake_dset in fake_dsets
+    ]
+    # Average the score for each key.
+    result_statistics = {}
+    for key in task_results_dicts[0].keys():
+      scores_for_key = np.array([d[key] for d in task_results_dicts])
+      mean, std = np.mean(scores_for_key), np.std(scores_for_key)
+      scores_as_string = "_".join([str(x) for x in scores_for_key])
+      result_statistics[key + "_mean"] = mean
+      result_statistics[key + "_std"] = std
+      result_statistics[key + "_list"] = scores_as_string
+    logging.info("Computed results for task %s: %s", task, result_statistics)
+
+    result_dict.update(result_statistics)
+  return result_dict
+
+
+def _evaluate_generator(sess, generated, dataset, eval_tasks,
+                        num_averaging_runs, inception_extractor,
+                        accu_generated=None, accu_ops=None,
+                        accu_save_path=None):
+  """Evaluates the generator in the given session.
+
+  Args:
+    sess: `tf.Session` object. Checkpoint should already be loaded.
+    generated: Output tensor of the generator.
+    dataset: `ImageDataset` object with the real images.
+    eval_tasks: List of objects that inherit from EvalTask.
+    num_averaging_runs: Determines how many times each metric is computed.
+      See --eval_bootstrap.
+    inception_extractor: `eval_utils.InceptionFeatureExtractor` to use.
+    accu_generated: Optional output tensor of the same generator with a larger
+      batch size, used to fill the batch norm accumulators.
+    accu_ops: `BatchNormAccumulatorOps` of the generator or None if it has no
+      batch norm accumulators.
+    accu_save_path: If set and the generator has batch norm accumulators, the
+      weights with the updated accumulators are saved to this path.
+
+  Returns:
+    Dict[Text, float] with all the computed results.
+
+  Raises:
+    NanFoundError: If generator output has any NaNs.
+  """
+  num_test_examples = dataset.eval_test_samples
+  batch_size = generated.shape[0].value
+  num_batches = int(np.ceil(num_test_examples / batch_size))
+
+  if accu_generated is None:
+    accu_generated = generated
+  if (_update_bn_accumulators(sess, accu_generated, accu_ops) and
+      accu_save_path):
+    saver = tf.train.Saver()
+    checkpoint_path = saver.save(sess, save_path=accu_save_path)
+    logging.info("Exported generator with accumulated batch stats to "
+                 "%s.", checkpoint_path)
+  if not eval_tasks:
+    logging.error("Task list is empty, returning.")
+    return
+
+  # Images and activations are only kept if a task needs them. For
+  # ImageNet128 50k images are ~9 GiB, the Inception features are ~0.4 GiB
+  # and their moments ~32 MiB.
+  requires_images = any(task.requires_images() for task in eval_tasks)
+  requires_activations = any(
+      task.requires_activations() for task in eval_tasks)
+  if FLAGS.eval_bootstrap and num_averaging_runs > 1:
+    logging.info("Generating fake data set for %d bootstrap resamples.",
+                 num_averaging_runs)
+    # The activations are needed to compute the moments of each resample.
+    fake_dset = eval_utils.sample_fake_features(
+        sess, generated, num_batches, keep_images=requires_images,
+        inception_extractor=inception_extractor,
+        num_examples=num_test_examples)
+    fake_dsets = eval_utils.BootstrapSamples(
+        fake_dset, num_averaging_runs, keep_activations=requires_activations)
+  else:
+    fake_dsets = []
+    for i in range(num_averaging_runs):
+      logging.info("Generating fake data set %d/%d.", i+1, num_averaging_runs)
+      fake_dsets.append(eval_utils.sample_fake_features(
+          sess, generated, num_batches, keep_images=requires_images,
+          inception_extractor=inception_extractor,
+          keep_activations=requires_activations,
+          num_examples=num_test_examples))
+
+  # The real images never change between checkpoints, their features may be
+  # read from the cache (see --eval_real_cache_dir).
+  real_dset = eval_utils.get_real_eval_data(
+      dataset=dataset, num_examples=num_test_examples, batch_size=batch_size,
+      inception_extractor=inception_extractor)
+
+  return _run_eval_tasks(eval_tasks, fake_dsets, real_dset)
 
 
 def evaluate_tfhub_module(module_spec, eval_tasks, use_tpu,
-                          num_averaging_runs):
+                          num_averaging_runs, inception_extractor=None,
+                          session_config=None):
   """Evaluate model at given checkpoint_path.
 
   Args:
@@ -101,6 +297,9 @@ def evaluate_tfhub_module(module_spec, eval_tasks, use_tpu,
     eval_tasks: List of objects that inherit from EvalTask.
     use_tpu: Whether to use TPUs.
     num_averaging_runs: Determines how many times each metric is computed.
+    inception_extractor: `eval_utils.InceptionFeatureExtractor` to use. If None
+      the extractor shared by this process is used.
+    session_config: Optional `tf.ConfigProto` for the generator session.
 
   Returns:
     Dict[Text, float] with all the computed results.
@@ -110,18 +309,15 @@ def evaluate_tfhub_module(module_spec, eval_tasks, use_tpu,
   """
   # Make sure that the same latent variables are used for each evaluation.
   np.random.seed(42)
+  if inception_extractor is None:
+    inception_extractor = eval_utils.get_inception_feature_extractor()
   dataset = datasets.get_dataset()
-  num_test_examples = dataset.eval_test_samples
-
   batch_size = 64
-  num_batches = int(np.ceil(num_test_examples / batch_size))
 
   # Load and update the generator.
-  result_dict = {}
-  fake_dsets = []
   with tf.Graph().as_default():
     tf.set_random_seed(42)
-    with tf.Session() as sess:
+    with tf.Session(config=session_config) as sess:
       if use_tpu:
         sess.run(tf.contrib.tpu.initialize_system())
       def sample_from_generator():
@@ -152,61 +348,103 @@ def evaluate_tfhub_module(module_spec, eval_tasks, use_tpu,
 
       tf.global_variables_initializer().run()
 
+      return _evaluate_generator(
+          sess, generated, dataset, eval_tasks,
+          num_averaging_runs=num_averaging_runs,
+          inception_extractor=inception_extractor,
+          accu_ops=_build_bn_accumulator_ops(),
+          accu_save_path=os.path.join(module_spec, "model-with-accu.ckpt"))
 
-      if _update_bn_accumulators(sess, generated, num_accu_examples=204800):
-        saver = tf.train.Saver()
-        save_path = os.path.join(module_spec, "model-with-accu.ckpt")
-        checkpoint_path = saver.save(
-            sess,
-            save_path=save_path)
-        logging.info("Exported generator with accumulated batch stats to "
-                     "%s.", checkpoint_path)
-      if not eval_tasks:
-        logging.error("Task list is empty, returning.")
-        return
-      for i in range(num_averaging_runs):
-        logging.info("Generating fake data set %d/%d.", i+1, num_averaging_runs)
-        fake_dset = eval_utils.EvalDataSample(
-            eval_utils.sample_fake_dataset(sess, generated, num_batches))
-        fake_dsets.append(fake_dset)
-        logging.info("Computing inception features for generated data %d/%d.",
-                     i+1, num_averaging_runs)
-        activations, logits = eval_utils.inception_transform_np(
-            fake_dset.images, batch_size)
-        fake_dset.set_inception_features(
-            activations=activations, logits=logits)
-        fake_dset.set_num_examples(num_test_examples)
-        if i != 0:
-          # Free up some memory by releasing additional fake data samples.
-          # For ImageNet128 50k images are ~9 GiB. This will blow up metrics
-          # (such as fractal dimension) if num_averaging_runs > 1.
-          fake_dset.discard_images()
-
-  real_dset = eval_utils.EvalDataSample(
-      eval_utils.get_real_images(
-          dataset=dataset, num_examples=num_test_examples))
-  logging.info("Getting Inception features for real images.")
-  real_dset.activations, _ = eval_utils.inception_transform_np(
-      real_dset.images, batch_size)
-  real_dset.set_num_examples(num_test_examples)
-
-  # Run all the tasks and update the result dictionary with the task statistics.
-  result_dict = {}
-  for task in eval_tasks:
-    task_results_dicts = [
-        task.run_after_session(fake_dset, real_dset)
-        for fake_dset in fake_dsets
-    ]
-    # Average the score for each key.
-    result_statistics = {}
-    for key in task_results_dicts[0].keys():
-      scores_for_key = np.array([d[key] for d in task_results_dicts])
-      mean, std = np.mean(scores_for_key), np.std(scores_for_key)
-      scores_as_string = "_".join([str(x) for x in scores_for_key])
-      result_statistics[key + "_mean"] = mean
-      result_statistics[key + "_std"] = std
-      result_statistics[key + "_list"] = scores_as_string
-    logging.info("Computed results for task %s: %s", task, result_statistics)
 
-    result_dict.update(result_statistics)
-  return result_dict
+@gin.configurable("checkpoint_evaluator",
+                  whitelist=["batch_size", "accu_batch_size"])
+class CheckpointEvaluator(object):
+  """Evaluates checkpoints of a GAN without exporting TF Hub modules.
+
+  The generator graph is built once and each checkpoint is restored into it
+  with a `tf.train.Saver`. The graph is finalized, evaluating a checkpoint
+  cannot add ops to it. A new session is created for every checkpoint, this
+  resets the random ops so all checkpoints are evaluated with the same latent
+  samples.
+  """
+
+  def __init__(self, gan, use_tpu=False, batch_size=64, accu_batch_size=256,
+               session_config=None):
+    """Constructor.
+
+    Args:
+      gan: `ModularGAN` object that was used for training the checkpoints.
+      use_tpu: Whether to use TPUs.
+      batch_size: Number of images generated per session call.
+      accu_batch_size: Number of images generated per session call while
+        filling the batch norm accumulators. If larger than `batch_size` a
+        second copy of the generator with shared variables is built for this.
+      session_config: Optional `tf.ConfigProto` for the generator session.
+    """
+    self._session_config = session_config
+    self._dataset = datasets.get_dataset()
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      tf.set_random_seed(42)
+      def sample_from_generator(num_samples):
+        """Create graph for sampling images."""
+        z = z_generator(shape=[num_samples, gan.z_dim])
+        labels = None
+        if gan.conditional:
+          labels = tf.random.uniform(
+              [num_samples], maxval=self._dataset.num_classes, dtype=tf.int32)
+        return gan.generate_for_eval(z, labels=labels)
+      def build_generator(num_samples):
+        if use_tpu:
+          return tf.contrib.tpu.rewrite(
+              functools.partial(sample_from_generator, num_samples))
+        return sample_from_generator(num_samples)
+      self._generated = build_generator(batch_size)
+      self._accu_generated = None
+      if accu_batch_size > batch_size:
+        self._accu_generated = build_generator(accu_batch_size)
+      self._accu_ops = _build_bn_accumulator_ops()
+      self._initialize_tpu = None
+      if use_tpu:
+        self._initialize_tpu = tf.contrib.tpu.initialize_system()
+      self._saver = tf.train.Saver()
+    self._graph.finalize()
+
+  @property
+  def graph(self):
+    """The finalized `tf.Graph` with the generator."""
+    return self._graph
+
+  def evaluate(self, checkpoint_path, eval_tasks, num_averaging_runs,
+               inception_extractor=None):
+    """Evaluate model at given checkpoint_path.
+
+    Args:
+      checkpoint_path: Path of the checkpoint to evaluate.
+      eval_tasks: List of objects that inherit from EvalTask.
+      num_averaging_runs: Determines how many times each metric is computed.
+      inception_extractor: `eval_utils.InceptionFeatureExtractor` to use. If
+        None the extractor shared by this process is used.
+
+    Returns:
+      Dict[Text, float] with all the computed results.
+
+    Raises:
+      NanFoundError: If generator output has any NaNs.
+    """
+    # Make sure that the same latent variables are used for each evaluation.
+    np.random.seed(42)
+    if inception_extractor is None:
+      inception_extractor = eval_utils.get_inception_feature_extractor()
+    with self._graph.as_default():
+      with tf.Session(config=self._session_config) as sess:
+        if self._initialize_tpu is not None:
+          sess.run(self._initialize_tpu)
+        logging.info("Restoring generator from %s.", checkpoint_path)
+        self._saver.restore(sess, checkpoint_path)
+        return _evaluate_generator(
+            sess, self._generated, self._dataset, eval_tasks,
+            num_averaging_runs=num_averaging_runs,
+            inception_extractor=inception_extractor,
+            accu_generated=self._accu_generated,
+            accu_ops=self._accu_ops)
@@ -29,6 +29,7 @@ from absl.testing import parameterized
 from compare_gan import datasets
 from compare_gan import eval_gan_lib
 from compare_gan import eval_utils
+from compare_gan.architectures import arch_ops
 from compare_gan.gans import consts as c
 from compare_gan.gans.modular_gan import ModularGAN
 from compare_gan.metrics import fid_score
@@ -119,6 +120,152 @@ class EvalGanLibTest(parameterized.TestCase, tf.test.TestCase):
         required_key = "%s_%s" % (score, stats)
         self.assertIn(required_key, result_dict, "Missing: %s." % required_key)
 
+  @parameterized.parameters([
+      (c.RESNET_CIFAR_ARCH, False),
+      (c.RESNET_BIGGAN_ARCH, True),
+  ])
+  def test_end2end_checkpoint_without_export(self, architecture, g_use_ema):
+    """Evaluates a checkpoint without exporting a TF Hub module."""
+    gin.bind_parameter("dataset.name", "cifar10")
+    dataset = datasets.get_dataset("cifar10")
+    options = {
+        "architecture": architecture,
+        "z_dim": 120,
+        "disc_iters": 1,
+        "lambda": 1,
+    }
+    model_dir = os.path.join(tf.test.get_temp_dir(), self.id())
+    run_config = tf.contrib.tpu.RunConfig(model_dir=model_dir)
+    gan = ModularGAN(dataset=dataset,
+                     parameters=options,
+                     conditional="biggan" in architecture,
+                     g_use_ema=g_use_ema,
+                     model_dir=model_dir)
+    estimator = gan.as_estimator(run_config, batch_size=2, use_tpu=False)
+    estimator.train(input_fn=gan.input_fn, steps=1)
+    checkpoint_path = os.path.join(model_dir, "model.ckpt-1")
+
+    eval_tasks = [
+        fid_score.FIDScoreTask(),
+        inception_score.InceptionScoreTask(),
+    ]
+    evaluator = eval_gan_lib.CheckpointEvaluator(gan)
+    result_dict = evaluator.evaluate(
+        checkpoint_path, eval_tasks, num_averaging_runs=1)
+    # The same latent samples are used for every evaluation.
+    self.assertEqual(
+        result_dict,
+        evaluator.evaluate(checkpoint_path, eval_tasks, num_averaging_runs=1))
+    for score in ["fid_score", "inception_score"]:
+      for stats in ["mean", "std", "list"]:
+        required_key = "%s_%s" % (score, stats)
+        self.assertIn(required_key, result_dict, "Missing: %s." % required_key)
+    self.assertFalse(tf.gfile.Exists(os.path.join(model_dir, "tfhub")))
+
+  def test_checkpoint_evaluator_does_not_add_ops(self):
+    gin.bind_parameter("dataset.name", "cifar10")
+    dataset = datasets.get_dataset("cifar10")
+    options = {
+        "architecture": c.RESNET_CIFAR_ARCH,
+        "z_dim": 120,
+        "disc_iters": 1,
+        "lambda": 1,
+    }
+    model_dir = os.path.join(tf.test.get_temp_dir(), self.id())
+    run_config = tf.contrib.tpu.RunConfig(
+        model_dir=model_dir, save_checkpoints_steps=1)
+    gan = ModularGAN(dataset=dataset, parameters=options, model_dir=model_dir)
+    estimator = gan.as_estimator(run_config, batch_size=2, use_tpu=False)
+    estimator.train(input_fn=gan.input_fn, steps=2)
+
+    evaluator = eval_gan_lib.CheckpointEvaluator(gan)
+    self.assertTrue(evaluator.graph.finalized)
+    num_ops = len(evaluator.graph.get_operations())
+    for step in [1, 2]:
+      evaluator.evaluate(
+          os.path.join(model_dir, "model.ckpt-%d" % step),
+          [fid_score.FIDScoreTask()], num_averaging_runs=1)
+      self.assertLen(evaluator.graph.get_operations(), num_ops)
+
+  @flagsaver.flagsaver
+  def test_end2end_checkpoint_with_bootstrap(self):
+    FLAGS.eval_bootstrap = True
+    gin.bind_parameter("dataset.name", "cifar10")
+    dataset = datasets.get_dataset("cifar10")
+    options = {
+        "architecture": c.RESNET_CIFAR_ARCH,
+        "z_dim": 120,
+        "disc_iters": 1,
+        "lambda": 1,
+    }
+    model_dir = os.path.join(tf.test.get_temp_dir(), self.id())
+    run_config = tf.contrib.tpu.RunConfig(model_dir=model_dir)
+    gan = ModularGAN(dataset=dataset, parameters=options, model_dir=model_dir)
+    estimator = gan.as_estimator(run_config, batch_size=2, use_tpu=False)
+    estimator.train(input_fn=gan.input_fn, steps=1)
+
+    eval_tasks = [
+        fid_score.FIDScoreTask(),
+        inception_score.InceptionScoreTask(),
+    ]
+    with mock.patch.object(
+        eval_utils, "sample_fake_features",
+        wraps=eval_utils.sample_fake_features) as mock_sample_fake_features:
+      result_dict = eval_gan_lib.CheckpointEvaluator(gan).evaluate(
+          os.path.join(model_dir, "model.ckpt-1"), eval_tasks,
+          num_averaging_runs=3)
+      # The fake data is only generated once.
+      self.assertEqual(mock_sample_fake_features.call_count, 1)
+    for score in ["fid_score", "inception_score"]:
+      self.assertLen(result_dict[score + "_list"].split("_"), 3)
+    self.assertGreater(result_dict["fid_score_std"], 0.0)
+
+  def _build_generator_with_accumulators(self, batch_size):
+    inputs = tf.random.normal([batch_size, 4, 4, 8], mean=1.0, stddev=2.0)
+    return arch_ops.standardize_batch(
+        inputs, is_training=False, use_moving_averages=False,
+        use_cross_replica_mean=False)
+
+  def test_update_bn_accumulators_stops_early(self):
+    with tf.Graph().as_default():
+      generated = self._build_generator_with_accumulators(batch_size=64)
+      with self.session() as sess:
+        tf.global_variables_initializer().run()
+        num_examples = eval_gan_lib._update_bn_accumulators(
+            sess, generated, eval_gan_lib._build_bn_accumulator_ops(),
+            max_examples=64000, min_examples=640,
+            check_every_examples=640, tolerance=1e-2)
+        self.assertGreaterEqual(num_examples, 1280)
+        self.assertLess(num_examples, 64000)
+        self.assertEqual(num_examples % 640, 0)
+        variables = {v.op.name: v for v in tf.global_variables()}
+        accu_mean, accu_variance, accu_counter, update_accus = sess.run([
+            variables["accu/accu_mean"], variables["accu/accu_variance"],
+            variables["accu/accu_counter"], variables["accu/update_accus"]])
+        self.assertAllClose(accu_counter, num_examples / 64)
+        self.assertAllClose(accu_mean / accu_counter, [1.0] * 8, atol=0.1)
+        self.assertAllClose(accu_variance / accu_counter, [4.0] * 8, atol=0.4)
+        self.assertEqual(update_accus, 0)
+
+  def test_update_bn_accumulators_without_tolerance(self):
+    with tf.Graph().as_default():
+      generated = self._build_generator_with_accumulators(batch_size=16)
+      with self.session() as sess:
+        tf.global_variables_initializer().run()
+        num_examples = eval_gan_lib._update_bn_accumulators(
+            sess, generated, eval_gan_lib._build_bn_accumulator_ops(),
+            max_examples=100, tolerance=0)
+        self.assertEqual(num_examples, 96)
+
+  def test_update_bn_accumulators_without_accumulators(self):
+    with tf.Graph().as_default():
+      generated = tf.random.normal([16, 4])
+      accu_ops = eval_gan_lib._build_bn_accumulator_ops()
+      self.assertIsNone(accu_ops)
+      with self.session() as sess:
+        self.assertEqual(
+            eval_gan_lib._update_bn_accumulators(sess, generated, accu_ops), 0)
+
 
 if __name__ == "__main__":
   tf.test.main()
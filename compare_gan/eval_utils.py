@@ -19,21 +19,66 @@ Includes:
 - A helper class to hold images and Inception features for evaluation.
 - A method to load a dataset as NumPy array.
 - Sample from the generator and return the data as a NumPy array.
+- Sample from the generator and compute Inception features batch by batch.
+- An on-disk cache for Inception features of the real images.
 """
 
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import hashlib
 import os
+import threading
+import time
 
+from absl import flags
 from absl import logging
 
+from compare_gan.metrics import fid_score
+
 import numpy as np
+from six.moves import queue
 from six.moves import range
 import tensorflow as tf
 import tensorflow_gan as tfgan
 
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string(
+    "eval_real_cache_dir", None,
+    "If set, Inception activations and FID moments of the real images are "
+    "stored in this directory and reused by later evaluations of the same "
+    "dataset, split and Inception graph.")
+flags.DEFINE_integer(
+    "eval_inception_intra_op_threads", 0,
+    "Number of threads used within an op of the Inception graph. 0 lets "
+    "TensorFlow pick the number of threads.")
+flags.DEFINE_integer(
+    "eval_inception_inter_op_threads", 0,
+    "Number of ops of the Inception graph run in parallel. 0 lets TensorFlow "
+    "pick the number of threads.")
+flags.DEFINE_integer(
+    "eval_generator_intra_op_threads", 0,
+    "Number of threads used within an op of the generator graph. 0 lets "
+    "TensorFlow pick the number of threads.")
+flags.DEFINE_integer(
+    "eval_generator_inter_op_threads", 0,
+    "Number of ops of the generator graph run in parallel. 0 lets TensorFlow "
+    "pick the number of threads.")
+flags.DEFINE_integer(
+    "eval_fake_queue_size", 4,
+    "Number of generated batches buffered between the generator thread and "
+    "the Inception thread. 0 runs both stages one after the other.")
+
+# InceptionFeatureExtractor shared by all evaluations in this process.
+_inception_feature_extractor = None
+
+# SHA1 digest of the serialized Inception graph, see _get_real_cache_key().
+_inception_graph_digest = None
+
+# Inception GraphDef returned by get_inception_graph_def().
+_inception_graph_def = None
 
 # Special value returned when fake image generated by GAN has nans.
 NAN_DETECTED = 31337.0
@@ -43,10 +88,26 @@ INCEPTION_FROZEN_GRAPH = "inceptionv1_for_inception_score.pb"
 
 
 def get_inception_graph_def():
-  return tfgan.eval.get_graph_def_from_url_tarball(  # pylint: disable=unreachable
-      url=INCEPTION_URL,
-      filename=INCEPTION_FROZEN_GRAPH,
-      tar_filename=os.path.basename(INCEPTION_URL))
+  """Returns the Inception GraphDef, it is only loaded once per process."""
+  global _inception_graph_def
+  if _inception_graph_def is None:
+    _inception_graph_def = tfgan.eval.get_graph_def_from_url_tarball(  # pylint: disable=unreachable
+        url=INCEPTION_URL,
+        filename=INCEPTION_FROZEN_GRAPH,
+        tar_filename=os.path.basename(INCEPTION_URL))
+  return _inception_graph_def
+
+
+def set_inception_graph_def(graph_def):
+  """Sets the GraphDef returned by get_inception_graph_def().
+
+  Used by worker processes to reuse the graph loaded by the parent process.
+
+  Args:
+    graph_def: `tf.GraphDef` of the Inception network.
+  """
+  global _inception_graph_def
+  _inception_graph_def = graph_def
 
 
 class NanFoundError(Exception):
@@ -63,6 +124,8 @@ class EvalDataSample(object):
     self.images = images
     self.activations = None
     self.logits = None
+    # Optional tuple (mean, covariance) of the activations.
+    self.moments = None
 
   def discard_images(self):
     logging.info("Deleting references to images: %s", self.images.shape)
@@ -72,6 +135,9 @@ class EvalDataSample(object):
     self.activations = activations
     self.logits = logits
 
+  def set_moments(self, mean, covariance):
+    self.moments = (mean, covariance)
+
   def set_num_examples(self, num_examples):
     if self.images is not None:
       assert self.images.shape[0] >= num_examples
@@ -84,12 +150,105 @@ class EvalDataSample(object):
       self.logits = self.logits[:num_examples]
 
 
+class _IndexedImages(object):
+  """Read-only view of the rows `indices` of an image array.
+
+  Rows are only copied when they are accessed. Tasks that read a few batches
+  (e.g. MS-SSIM) never copy the whole resample, np.asarray() copies all rows.
+  """
+
+  def __init__(self, images, indices):
+    self._images = images
+    self._indices = indices
+
+  @property
+  def shape(self):
+    return (len(self._indices),) + self._images.shape[1:]
+
+  @property
+  def dtype(self):
+    return self._images.dtype
+
+  def __len__(self):
+    return len(self._indices)
+
+  def __getitem__(self, key):
+    if isinstance(key, tuple):
+      return self._images[(self._indices[key[0]],) + key[1:]]
+    return self._images[self._indices[key]]
+
+  def __array__(self, dtype=None):
+    images = self._images[self._indices]
+    return images if dtype is None else images.astype(dtype)
+
+
+class BootstrapSamples(object):
+  """Bootstrap resamples of the generated data.
+
+  Instead of generating several data sets to estimate the variance of a
+  metric, the rows of a single data set are resampled with replacement. The
+  indices are drawn once, so all tasks see the same resamples. The resamples
+  are created while iterating, only one is in memory at a time. The images of
+  a resample are a lazy view of the generated images, see `_IndexedImages`.
+  """
+
+  def __init__(self, dset, num_resamples, keep_activations=True, seed=42):
+    """Constructor.
+
+    Args:
+      dset: `EvalDataSample` with the activations of the generated data.
+      num_resamples: Number of resamples.
+      keep_activations: If False the resamples only contain the moments of
+        the activations.
+      seed: Seed for drawing the indices.
+    """
+    self._dset = dset
+    self._keep_activations = keep_activations
+    num_examples = dset.activations.shape[0]
+    random_state = np.random.RandomState(seed)
+    self._indices = random_state.randint(
+        num_examples, size=(num_resamples, num_examples))
+    # Moments of the resampled activations, computed once per resample.
+    self._moments = [None] * num_resamples
+
+  def __len__(self):
+    return len(self._indices)
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self._get_resample(i)
+
+  def _get_resample(self, i):
+    """Returns resample `i` as `EvalDataSample`."""
+    indices = self._indices[i]
+    dset = self._dset
+    if self._moments[i] is None:
+      counts = np.bincount(indices, minlength=dset.activations.shape[0])
+      self._moments[i] = fid_score.compute_moments(
+          dset.activations, counts=counts)
+    images = (None if dset.images is None
+              else _IndexedImages(dset.images, indices))
+    resample = EvalDataSample(images)
+    resample.set_inception_features(
+        activations=(dset.activations[indices] if self._keep_activations
+                     else None),
+        logits=None if dset.logits is None else dset.logits[indices])
+    resample.set_moments(*self._moments[i])
+    return resample
+
+
 def get_real_images(dataset,
                     num_examples,
                     split=None,
-                    failure_on_insufficient_examples=True):
+                    failure_on_insufficient_examples=True,
+                    batch_size=500,
+                    dtype=np.float32,
+                    mmap_path=None):
   """Get num_examples images from the given dataset/split.
 
+  Images are read in batches from `dataset.eval_input_fn()` and written
+  directly into a preallocated array.
+
   Args:
     dataset: `ImageDataset` object.
     num_examples: Number of images to read.
@@ -98,6 +257,11 @@ def get_real_images(dataset,
     failure_on_insufficient_examples: If True raise an exception if the
       dataset/split does not images. Otherwise will log to error and return
       fewer images.
+    batch_size: Number of images to read per session call.
+    dtype: NumPy type of the returned array. For np.uint8 the values are
+      rounded to the nearest integer.
+    mmap_path: Optional path to a .npy file. If set, the images are written to
+      a memory-mapped array backed by this file.
 
   Returns:
     4-D NumPy array with images with values in [0, 256].
@@ -107,59 +271,260 @@ def get_real_images(dataset,
         requested images and `failure_on_insufficient_examples` is True.
   """
   logging.info("Start loading real data.")
+  num_read = 0
   with tf.Graph().as_default():
-    ds = dataset.eval_input_fn(split=split)
-    # Get real images from the dataset. In the case of a 1-channel
-    # dataset (like MNIST) convert it to 3 channels.
+    ds = dataset.eval_input_fn(
+        params={"batch_size": batch_size}, split=split, drop_remainder=False)
     next_batch = ds.make_one_shot_iterator().get_next()[0]
-    shape = [num_examples] + next_batch.shape.as_list()
-    is_single_channel = shape[-1] == 1
-    if is_single_channel:
-      shape[-1] = 3
-    real_images = np.empty(shape, dtype=np.float32)
+    # In the case of a 1-channel dataset (like MNIST) the images are
+    # broadcasted to 3 channels when writing them into the array.
+    shape = [num_examples] + next_batch.shape.as_list()[1:3] + [3]
+    if mmap_path:
+      real_images = np.lib.format.open_memmap(
+          mmap_path, mode="w+", dtype=dtype, shape=tuple(shape))
+    else:
+      real_images = np.empty(shape, dtype=dtype)
     with tf.Session() as sess:
-      for i in range(num_examples):
+      while num_read < num_examples:
         try:
           b = sess.run(next_batch)
-          b *= 255.0
-          if is_single_channel:
-            b = np.tile(b, [1, 1, 3])
-          real_images[i] = b
         except tf.errors.OutOfRangeError:
-          logging.error("Reached the end of dataset. Read: %d samples.", i)
+          logging.error("Reached the end of dataset. Read: %d samples.",
+                        num_read)
           break
-
-  if real_images.shape[0] != num_examples:
+        b = b[:num_examples - num_read]
+        b *= 255.0
+        if np.issubdtype(dtype, np.integer):
+          np.rint(b, out=b)
+        real_images[num_read:num_read + b.shape[0]] = b
+        num_read += b.shape[0]
+
+  if num_read != num_examples:
     if failure_on_insufficient_examples:
       raise ValueError("Not enough examples in the dataset %s: %d / %d" %
-                       (dataset, real_images.shape[0], num_examples))
+                       (dataset, num_read, num_examples))
     else:
       logging.error("Not enough examples in the dataset %s: %d / %d", dataset,
-                    real_images.shape[0], num_examples)
+                    num_read, num_examples)
+      real_images = real_images[:num_read]
 
   logging.info("Done loading real data.")
   return real_images
 
 
-def sample_fake_dataset(sess, generator, num_batches):
-  """Returns a generated data set as a NumPy array."""
-  logging.info("Generating a fake data set.")
-  samples = []
+def _to_inception_range(images):
+  """Scales images from [0, 1] to [0, 255] and converts them to RGB."""
+  images = images * 255.0
+  # Convert 1-channel datasets (like MNIST) to 3 channels.
+  if images.shape[3] == 1:
+    images = np.tile(images, [1, 1, 1, 3])
+  return images
+
+
+def get_session_config(intra_op_parallelism_threads=0,
+                       inter_op_parallelism_threads=0):
+  """Returns a `tf.ConfigProto` with the given number of threads.
+
+  If the number of inter op threads is set the session gets its own thread
+  pool instead of sharing the one of the process. This keeps the generator
+  and the Inception sessions from competing for the same threads.
+
+  Args:
+    intra_op_parallelism_threads: Number of threads used within an op. 0 lets
+      TensorFlow choose.
+    inter_op_parallelism_threads: Number of ops run in parallel. 0 lets
+      TensorFlow choose.
+
+  Returns:
+    `tf.ConfigProto` object.
+  """
+  return tf.ConfigProto(
+      intra_op_parallelism_threads=intra_op_parallelism_threads,
+      inter_op_parallelism_threads=inter_op_parallelism_threads,
+      use_per_session_threads=inter_op_parallelism_threads > 0)
+
+
+def get_generator_session_config():
+  """Returns the `tf.ConfigProto` for generator sessions set by the flags."""
+  return get_session_config(
+      intra_op_parallelism_threads=FLAGS.eval_generator_intra_op_threads,
+      inter_op_parallelism_threads=FLAGS.eval_generator_inter_op_threads)
+
+
+def _generate_batches(sess, generator, num_batches, timings):
+  """Yields generated batches scaled to [0, 255] with 3 channels.
+
+  Args:
+    sess: `tf.Session` for running `generator`.
+    generator: Output tensor of the generator with values in [0, 1].
+    num_batches: Number of batches to sample.
+    timings: Dictionary, the time spent in the generator is added to the
+      "generator" entry.
+
+  Yields:
+    NumPy arrays with a batch of generated images each.
+
+  Raises:
+    NanFoundError: If generator output has any NaNs.
+  """
   for _ in range(num_batches):
+    start_time = time.time()
     x = sess.run(generator)
     # If NaNs were generated, ignore this checkpoint and assign a very high
     # FID score which we handle specially later.
     if np.isnan(x).any():
       logging.error("Detected NaN in fake_images! Returning NaN.")
       raise NanFoundError("Detected NaN in fake images.")
-    samples.append(x)
-  fake_images = np.concatenate(samples, axis=0)
-  fake_images *= 255.0
-  # Convert 1-channel datasets (like MNIST) to 3 channels.
-  if fake_images.shape[3] == 1:
-    fake_images = np.tile(fake_images, [1, 1, 1, 3])
+    x = _to_inception_range(x)
+    timings["generator"] += time.time() - start_time
+    yield x
+
+
+def _iterate_in_background(iterable, queue_size):
+  """Yields the items of `iterable`, which is consumed by another thread.
+
+  The thread runs ahead by at most `queue_size` items. Exceptions raised by
+  `iterable` are re-raised in the calling thread.
+
+  Args:
+    iterable: Iterable to consume in the background.
+    queue_size: Maximum number of buffered items.
+
+  Yields:
+    The items of `iterable`.
+  """
+  item_queue = queue.Queue(maxsize=queue_size)
+  stop_event = threading.Event()
+  end_of_items = object()
+
+  def put(item):
+    # Check regularly whether the consumer stopped, the queue might never be
+    # drained otherwise.
+    while not stop_event.is_set():
+      try:
+        item_queue.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def produce():
+    try:
+      for item in iterable:
+        if not put((item, None)):
+          return
+      put((end_of_items, None))
+    except Exception as e:  # pylint: disable=broad-except
+      put((None, e))
+
+  thread = threading.Thread(target=produce, name="eval_producer")
+  thread.daemon = True
+  thread.start()
+  try:
+    while True:
+      item, error = item_queue.get()
+      if error is not None:
+        raise error
+      if item is end_of_items:
+        return
+      yield item
+  finally:
+    stop_event.set()
+    thread.join()
+
+
+def sample_fake_features(sess, generator, num_batches, keep_images=False,
+                         inception_extractor=None, queue_size=None,
+                         keep_activations=True, num_examples=None):
+  """Samples from the generator and computes the Inception features.
+
+  Each generated batch is passed directly to the Inception graph, only the
+  activations and logits are kept. This avoids holding all generated images
+  in memory (~9 GiB for 50k ImageNet128 images). The moments of the
+  activations are accumulated batch by batch, so the activations themselves
+  can be dropped if no task needs them.
+
+  Unless `queue_size` is 0, the generator runs in a separate thread and
+  fills a bounded queue that is drained by the Inception graph in this
+  thread. Both stages then overlap and the throughput is bounded by the
+  slower one. Use different session configs (see get_session_config()) to
+  give each stage its own threads.
+
+  Args:
+    sess: `tf.Session` for running `generator`.
+    generator: Output tensor of the generator with values in [0, 1].
+    num_batches: Number of batches to sample.
+    keep_images: If True the generated images (in [0, 255]) are stored in
+      the returned sample as well.
+    inception_extractor: `InceptionFeatureExtractor` to use. If None the
+      extractor shared by this process is used.
+    queue_size: Maximum number of generated batches waiting for the
+      Inception graph. Defaults to --eval_fake_queue_size.
+    keep_activations: If False only the moments of the Inception activations
+      are stored in the returned sample.
+    num_examples: Number of examples to keep from the generated batches.
+      Defaults to all of them.
+
+  Returns:
+    `EvalDataSample` with Inception features, their moments and optionally
+    the images of the generated data.
+
+  Raises:
+    NanFoundError: If generator output has any NaNs.
+  """
+  logging.info("Generating fake data and computing Inception features.")
+  if inception_extractor is None:
+    inception_extractor = get_inception_feature_extractor()
+  if queue_size is None:
+    queue_size = FLAGS.eval_fake_queue_size
+  batch_size = generator.shape[0].value
+  if num_examples is None:
+    num_examples = num_batches * batch_size
+  assert num_examples <= num_batches * batch_size
+  images = None
+  activations = None
+  logits = None
+  moments = fid_score.StreamingMoments()
+  timings = {"generator": 0.0, "inception": 0.0}
+  start_time = time.time()
+  batches = _generate_batches(sess, generator, num_batches, timings)
+  if queue_size > 0:
+    batches = _iterate_in_background(batches, queue_size)
+  try:
+    for i, x in enumerate(batches):
+      batch_slice = slice(i * batch_size,
+                          min((i + 1) * batch_size, num_examples))
+      x = x[:batch_slice.stop - batch_slice.start]
+      inception_start_time = time.time()
+      batch_activations, batch_logits = inception_extractor.extract(x)
+      timings["inception"] += time.time() - inception_start_time
+      moments.update(batch_activations)
+      if logits is None:
+        logits = np.empty((num_examples, batch_logits.shape[1]), np.float32)
+        if keep_activations:
+          activations = np.empty(
+              (num_examples, batch_activations.shape[1]), np.float32)
+        if keep_images:
+          images = np.empty((num_examples,) + x.shape[1:], np.float32)
+      logits[batch_slice] = batch_logits
+      if keep_activations:
+        activations[batch_slice] = batch_activations
+      if keep_images:
+        images[batch_slice] = x
+  finally:
+    # Stops the generator thread if the Inception graph failed.
+    batches.close()
+  total_time = time.time() - start_time
+  logging.info(
+      "Sampled %d images in %.1f s (%.1f images/s, pipelined: %s). Time "
+      "spent in generator: %.1f s, in Inception: %.1f s.", num_examples,
+      total_time, num_examples / max(total_time, 1e-6), queue_size > 0,
+      timings["generator"], timings["inception"])
+  fake_dset = EvalDataSample(images)
+  fake_dset.set_inception_features(activations=activations, logits=logits)
+  fake_dset.set_moments(*moments.moments())
   logging.info("Done sampling a generated data set.")
-  return fake_images
+  return fake_dset
 
 
 def inception_transform(inputs):
@@ -175,32 +540,194 @@ def inception_transform(inputs):
       output_tensor=["pool_3:0", "logits:0"])
 
 
-def inception_transform_np(inputs, batch_size):
-  """Computes the inception features and logits for a given NumPy array.
+class InceptionFeatureExtractor(object):
+  """Computes Inception features and logits for NumPy arrays.
 
-  The inputs are first preprocessed to match the input shape required for
-  Inception.
+  The Inception graph is loaded once and the session is kept open, so the
+  extractor can be reused for all checkpoints and averaging runs. Use
+  get_inception_feature_extractor() to get the instance shared by this
+  process.
+  """
+
+  def __init__(self,
+               batch_size=64,
+               intra_op_parallelism_threads=0,
+               inter_op_parallelism_threads=0):
+    """Constructor.
+
+    Args:
+      batch_size: Default number of images per session call.
+      intra_op_parallelism_threads: Number of threads used within an op.
+        0 lets TensorFlow choose.
+      inter_op_parallelism_threads: Number of ops run in parallel. 0 lets
+        TensorFlow choose.
+    """
+    logging.info("Loading Inception graph for feature extraction.")
+    self._batch_size = batch_size
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      self._inputs = tf.placeholder(
+          dtype=tf.float32, shape=[None, None, None, 3])
+      self._features_and_logits = inception_transform(self._inputs)
+    config = get_session_config(
+        intra_op_parallelism_threads=intra_op_parallelism_threads,
+        inter_op_parallelism_threads=inter_op_parallelism_threads)
+    self._sess = tf.Session(graph=self._graph, config=config)
+
+  def extract(self, images, batch_size=None):
+    """Returns Inception features and logits for the given images.
+
+    Args:
+      images: NumPy array of shape [-1, H, W, 3] with values in [0, 255].
+      batch_size: Number of images per session call. Defaults to the batch
+        size given to the constructor.
+
+    Returns:
+      A tuple of NumPy arrays with Inception features and logits for each
+      image.
+    """
+    batch_size = batch_size or self._batch_size
+    num_images = images.shape[0]
+    features = None
+    logits = None
+    for start in range(0, num_images, batch_size):
+      end = min(start + batch_size, num_images)
+      batch_features, batch_logits = self._sess.run(
+          self._features_and_logits,
+          feed_dict={self._inputs: images[start:end]})
+      if features is None:
+        features = np.empty((num_images, batch_features.shape[1]), np.float32)
+        logits = np.empty((num_images, batch_logits.shape[1]), np.float32)
+      features[start:end] = batch_features
+      logits[start:end] = batch_logits
+    return features, logits
+
+  def close(self):
+    self._sess.close()
+
+
+def get_inception_feature_extractor():
+  """Returns the `InceptionFeatureExtractor` shared by this process."""
+  global _inception_feature_extractor
+  if _inception_feature_extractor is None:
+    _inception_feature_extractor = InceptionFeatureExtractor(
+        intra_op_parallelism_threads=FLAGS.eval_inception_intra_op_threads,
+        inter_op_parallelism_threads=FLAGS.eval_inception_inter_op_threads)
+  return _inception_feature_extractor
+
+
+def _get_inception_graph_digest():
+  """Returns the SHA1 digest of the Inception graph, computed only once."""
+  global _inception_graph_digest
+  if _inception_graph_digest is None:
+    _inception_graph_digest = hashlib.sha1(
+        get_inception_graph_def().SerializeToString()).hexdigest()
+  return _inception_graph_digest
+
+
+def _get_real_cache_key(dataset, split, num_examples):
+  """Returns a key identifying the Inception features of real images.
 
   Args:
-    inputs: NumPy array of shape [-1, H, W, 3].
-    batch_size: Batch size.
+    dataset: `ImageDataset` object.
+    split: Split of the dataset.
+    num_examples: Number of images.
 
   Returns:
-    A tuple of NumPy arrays with Inception features and logits for each input.
+    Hex string that changes whenever the dataset, the split, the evaluation
+    transformation, the input pipeline flags changing the real images or the
+    Inception graph changes.
   """
-  with tf.Session(graph=tf.Graph()) as sess:
-    inputs_placeholder = tf.placeholder(
-        dtype=tf.float32, shape=[None] + list(inputs[0].shape))
-    features_and_logits = inception_transform(inputs_placeholder)
-    features = []
-    logits = []
-    num_batches = int(np.ceil(inputs.shape[0] / batch_size))
-    for i in range(num_batches):
-      input_batch = inputs[i * batch_size:(i + 1) * batch_size]
-      x = sess.run(
-          features_and_logits, feed_dict={inputs_placeholder: input_batch})
-      features.append(x[0])
-      logits.append(x[1])
-    features = np.vstack(features)
-    logits = np.vstack(logits)
-    return features, logits
+  key_parts = [
+      dataset.name,
+      str(split),
+      "x".join(str(d) for d in dataset.image_shape),
+      dataset.eval_transform_name,
+      str(num_examples),
+      "uint8_pipeline=%s" % FLAGS.data_uint8_pipeline,
+      "decode_and_crop=%s" % FLAGS.data_decode_and_crop,
+      "cache_dir=%s" % (FLAGS.data_cache_dir or ""),
+      _get_inception_graph_digest(),
+  ]
+  logging.info("Cache key parts for real images: %s", key_parts)
+  return hashlib.sha1("|".join(key_parts).encode("utf-8")).hexdigest()
+
+
+def _load_real_cache(cache_dir):
+  """Returns an `EvalDataSample` from the cache or None on cache miss."""
+  filenames = ["activations.npy", "mean.npy", "covariance.npy"]
+  paths = [os.path.join(cache_dir, fn) for fn in filenames]
+  if not all(os.path.exists(p) for p in paths):
+    return None
+  logging.info("Loading cached real image statistics from %s.", cache_dir)
+  activations, mean, covariance = [np.load(p, mmap_mode="r") for p in paths]
+  real_dset = EvalDataSample(None)
+  real_dset.set_inception_features(activations=activations, logits=None)
+  real_dset.set_moments(mean=mean, covariance=covariance)
+  return real_dset
+
+
+def _save_real_cache(cache_dir, real_dset):
+  """Writes the activations and moments of `real_dset` to `cache_dir`."""
+  if not os.path.exists(cache_dir):
+    os.makedirs(cache_dir)
+  arrays = [
+      ("activations.npy", real_dset.activations),
+      ("mean.npy", real_dset.moments[0]),
+      ("covariance.npy", real_dset.moments[1]),
+  ]
+  for filename, array in arrays:
+    # Write to a temporary file first, so concurrent readers never see
+    # partially written files.
+    path = os.path.join(cache_dir, filename)
+    tmp_path = "{}.tmp-{}".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+      np.save(f, array)
+    os.rename(tmp_path, path)
+  logging.info("Cached real image statistics in %s.", cache_dir)
+
+
+def get_real_eval_data(dataset, num_examples, batch_size, split=None,
+                       inception_extractor=None):
+  """Returns Inception features and their moments for real images.
+
+  If --eval_real_cache_dir is set, the features are read from (or written to)
+  a subdirectory keyed by the dataset, split, evaluation transformation and
+  Inception graph. Cached arrays are memory-mapped. The returned sample does
+  not contain images.
+
+  Args:
+    dataset: `ImageDataset` object.
+    num_examples: Number of images to use.
+    batch_size: Batch size for computing the Inception features.
+    split: Split of the dataset to use. If None will use the default split for
+      eval defined by the dataset.
+    inception_extractor: `InceptionFeatureExtractor` to use. If None the
+      extractor shared by this process is used.
+
+  Returns:
+    `EvalDataSample` with activations and moments for the real images.
+  """
+  cache_dir = None
+  if FLAGS.eval_real_cache_dir:
+    cache_dir = os.path.join(
+        FLAGS.eval_real_cache_dir,
+        _get_real_cache_key(dataset, split, num_examples))
+    real_dset = _load_real_cache(cache_dir)
+    if real_dset is not None:
+      return real_dset
+
+  images = get_real_images(
+      dataset=dataset, num_examples=num_examples, split=split)
+  logging.info("Getting Inception features for real images.")
+  if inception_extractor is None:
+    inception_extractor = get_inception_feature_extractor()
+  activations, _ = inception_extractor.extract(images, batch_size)
+  del images
+  real_dset = EvalDataSample(None)
+  real_dset.set_inception_features(activations=activations, logits=None)
+  real_dset.set_num_examples(num_examples)
+  real_dset.set_moments(*fid_score.compute_moments(real_dset.activations))
+  if cache_dir:
+    _save_real_cache(cache_dir, real_dset)
+  return real_dset
@@ -0,0 +1,252 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for eval_utils."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import threading
+
+from absl import flags
+from absl.testing import flagsaver
+from absl.testing import parameterized
+
+from compare_gan import datasets
+from compare_gan import eval_utils
+from compare_gan import test_utils
+
+import mock
+import numpy as np
+import tensorflow as tf
+
+FLAGS = flags.FLAGS
+
+
+class EvalUtilsTest(parameterized.TestCase, test_utils.CompareGanTestCase):
+
+  @flagsaver.flagsaver
+  def test_real_eval_data_is_cached(self):
+    FLAGS.eval_real_cache_dir = os.path.join(
+        self._get_empty_model_dir(), "real_cache")
+    dataset = datasets.get_dataset("cifar10")
+    real_dset = eval_utils.get_real_eval_data(
+        dataset, num_examples=100, batch_size=10)
+    self.assertEqual(real_dset.activations.shape, (100, 10))
+    mean, covariance = real_dset.moments
+    self.assertAllClose(mean, np.mean(real_dset.activations, axis=0))
+    self.assertEqual(covariance.shape, (10, 10))
+
+    with mock.patch.object(eval_utils, "get_real_images") as mock_get_images:
+      cached_dset = eval_utils.get_real_eval_data(
+          dataset, num_examples=100, batch_size=10)
+      mock_get_images.assert_not_called()
+    self.assertAllClose(real_dset.activations, cached_dset.activations)
+    self.assertAllClose(mean, cached_dset.moments[0])
+    self.assertAllClose(covariance, cached_dset.moments[1])
+
+  @flagsaver.flagsaver
+  def test_real_eval_data_cache_key_depends_on_split(self):
+    FLAGS.eval_real_cache_dir = os.path.join(
+        self._get_empty_model_dir(), "real_cache")
+    dataset = datasets.get_dataset("cifar10")
+    eval_utils.get_real_eval_data(dataset, num_examples=100, batch_size=10)
+    eval_utils.get_real_eval_data(
+        dataset, num_examples=100, batch_size=10, split="train")
+    self.assertLen(tf.gfile.ListDirectory(FLAGS.eval_real_cache_dir), 2)
+
+  @flagsaver.flagsaver
+  def test_real_eval_data_cache_key_depends_on_input_flags(self):
+    FLAGS.eval_real_cache_dir = os.path.join(
+        self._get_empty_model_dir(), "real_cache")
+    dataset = datasets.get_dataset("cifar10")
+    eval_utils.get_real_eval_data(dataset, num_examples=100, batch_size=10)
+    FLAGS.data_uint8_pipeline = True
+    eval_utils.get_real_eval_data(dataset, num_examples=100, batch_size=10)
+    self.assertLen(tf.gfile.ListDirectory(FLAGS.eval_real_cache_dir), 2)
+
+  def test_get_real_images(self):
+    dataset = datasets.get_dataset("mnist")
+    images = eval_utils.get_real_images(
+        dataset, num_examples=100, batch_size=30)
+    self.assertEqual(images.shape, (100, 28, 28, 3))
+    self.assertEqual(images.dtype, np.float32)
+    self.assertGreaterEqual(images.min(), 0.0)
+    self.assertLessEqual(images.max(), 255.0)
+    self.assertAllEqual(images[..., 0], images[..., 2])
+
+  def test_get_real_images_uint8_mmap(self):
+    dataset = datasets.get_dataset("cifar10")
+    mmap_path = os.path.join(self._get_empty_model_dir(), "images.npy")
+    tf.gfile.MakeDirs(os.path.dirname(mmap_path))
+    images = eval_utils.get_real_images(
+        dataset, num_examples=100, batch_size=64, dtype=np.uint8,
+        mmap_path=mmap_path)
+    expected_images = eval_utils.get_real_images(dataset, num_examples=100)
+    self.assertEqual(images.dtype, np.uint8)
+    self.assertAllClose(images, expected_images, atol=0.5)
+    self.assertAllEqual(np.load(mmap_path), images)
+
+  def test_get_real_images_insufficient_examples(self):
+    dataset = datasets.get_dataset("cifar10")
+    with self.assertRaises(ValueError):
+      eval_utils.get_real_images(dataset, num_examples=150)
+    images = eval_utils.get_real_images(
+        dataset, num_examples=150, failure_on_insufficient_examples=False)
+    self.assertEqual(images.shape[0], 100)
+
+  def test_inception_feature_extractor(self):
+    extractor = eval_utils.InceptionFeatureExtractor(batch_size=7)
+    images = np.random.uniform(0, 255, size=(20, 16, 16, 3))
+    features, logits = extractor.extract(images)
+    self.assertEqual(features.shape, (20, 10))
+    self.assertEqual(logits.shape, (20, 10))
+    # The result must not depend on the batch size.
+    features_bs20, logits_bs20 = extractor.extract(images, batch_size=20)
+    self.assertAllClose(features, features_bs20)
+    self.assertAllClose(logits, logits_bs20)
+    # Images of another resolution can be passed to the same extractor.
+    features, _ = extractor.extract(np.zeros((3, 32, 32, 3)))
+    self.assertEqual(features.shape, (3, 10))
+    self.assertEqual(self.inception_graph_def_mock.call_count, 1)
+    extractor.close()
+
+  def test_sample_fake_features(self):
+    with tf.Graph().as_default():
+      generator = tf.random.uniform([4, 8, 8, 1])
+      with tf.Session() as sess:
+        fake_dset = eval_utils.sample_fake_features(
+            sess, generator, num_batches=3)
+        self.assertIsNone(fake_dset.images)
+        self.assertEqual(fake_dset.activations.shape, (12, 10))
+        self.assertEqual(fake_dset.logits.shape, (12, 10))
+
+        fake_dset = eval_utils.sample_fake_features(
+            sess, generator, num_batches=3, keep_images=True)
+        self.assertEqual(fake_dset.images.shape, (12, 8, 8, 3))
+        self.assertGreaterEqual(fake_dset.images.min(), 0.0)
+        self.assertLessEqual(fake_dset.images.max(), 255.0)
+
+  def test_sample_fake_features_streams_moments(self):
+    with tf.Graph().as_default():
+      tf.set_random_seed(42)
+      generator = tf.random.uniform([4, 8, 8, 3])
+      with tf.Session() as sess:
+        fake_dset = eval_utils.sample_fake_features(
+            sess, generator, num_batches=5, num_examples=18)
+    self.assertEqual(fake_dset.activations.shape, (18, 10))
+    self.assertEqual(fake_dset.logits.shape, (18, 10))
+    mean, covariance = fake_dset.moments
+    self.assertAllClose(mean, np.mean(fake_dset.activations, axis=0))
+    self.assertAllClose(covariance,
+                        np.cov(fake_dset.activations, rowvar=False))
+
+    with tf.Graph().as_default():
+      tf.set_random_seed(42)
+      generator = tf.random.uniform([4, 8, 8, 3])
+      with tf.Session() as sess:
+        moments_only_dset = eval_utils.sample_fake_features(
+            sess, generator, num_batches=5, num_examples=18,
+            keep_activations=False)
+    self.assertIsNone(moments_only_dset.activations)
+    self.assertAllClose(mean, moments_only_dset.moments[0])
+    self.assertAllClose(covariance, moments_only_dset.moments[1])
+
+  def test_bootstrap_samples(self):
+    fake_dset = eval_utils.EvalDataSample(np.random.uniform(size=(50, 2, 2, 3)))
+    fake_dset.set_inception_features(
+        activations=np.random.normal(size=(50, 4)),
+        logits=np.random.normal(size=(50, 6)))
+    resamples = eval_utils.BootstrapSamples(fake_dset, num_resamples=3)
+    self.assertLen(resamples, 3)
+    resamples_list = list(resamples)
+    self.assertLen(resamples_list, 3)
+    for resample in resamples_list:
+      self.assertEqual(resample.images.shape, (50, 2, 2, 3))
+      self.assertEqual(resample.logits.shape, (50, 6))
+      mean, covariance = resample.moments
+      self.assertAllClose(mean, np.mean(resample.activations, axis=0))
+      self.assertAllClose(covariance,
+                          np.cov(resample.activations, rowvar=False))
+    self.assertNotAllClose(resamples_list[0].activations,
+                           resamples_list[1].activations)
+    # All tasks iterate over the same resamples.
+    for resample, same_resample in zip(resamples_list, resamples):
+      self.assertAllEqual(resample.activations, same_resample.activations)
+      self.assertAllEqual(resample.logits, same_resample.logits)
+      self.assertAllEqual(np.asarray(resample.images),
+                          np.asarray(same_resample.images))
+
+    resamples = eval_utils.BootstrapSamples(
+        fake_dset, num_resamples=3, keep_activations=False)
+    for resample, expected_resample in zip(resamples, resamples_list):
+      self.assertIsNone(resample.activations)
+      self.assertAllClose(resample.moments[1], expected_resample.moments[1])
+
+  def test_bootstrap_samples_index_images_lazily(self):
+    images = np.random.uniform(size=(20, 2, 2, 3))
+    fake_dset = eval_utils.EvalDataSample(images)
+    fake_dset.set_inception_features(
+        activations=np.random.normal(size=(20, 4)), logits=None)
+    resample = next(iter(eval_utils.BootstrapSamples(fake_dset, 2)))
+    resampled_images = np.asarray(resample.images)
+    self.assertEqual(resampled_images.shape, (20, 2, 2, 3))
+    self.assertAllEqual(resample.images[[1, 5]], resampled_images[[1, 5]])
+    self.assertAllEqual(resample.images[2:4], resampled_images[2:4])
+    # Every resampled image is one of the generated images.
+    for image in resampled_images:
+      self.assertTrue(np.any(np.all(images == image, axis=(1, 2, 3))))
+
+  def test_sample_fake_features_pipelined(self):
+    fake_dsets = []
+    for queue_size in [0, 2]:
+      with tf.Graph().as_default():
+        tf.set_random_seed(42)
+        generator = tf.random.uniform([4, 8, 8, 3])
+        with tf.Session() as sess:
+          fake_dsets.append(eval_utils.sample_fake_features(
+              sess, generator, num_batches=5, keep_images=True,
+              queue_size=queue_size))
+    self.assertAllClose(fake_dsets[0].images, fake_dsets[1].images)
+    self.assertAllClose(fake_dsets[0].activations, fake_dsets[1].activations)
+    self.assertAllClose(fake_dsets[0].logits, fake_dsets[1].logits)
+
+  @parameterized.parameters([0, 1])
+  def test_sample_fake_features_raises_on_nan(self, queue_size):
+    with tf.Graph().as_default():
+      generator = tf.fill([4, 8, 8, 3], np.nan)
+      with tf.Session() as sess:
+        with self.assertRaises(eval_utils.NanFoundError):
+          eval_utils.sample_fake_features(
+              sess, generator, num_batches=3, queue_size=queue_size)
+
+  def test_sample_fake_features_stops_generator_thread_on_error(self):
+    extractor = mock.Mock()
+    extractor.extract.side_effect = RuntimeError("Inception failed.")
+    with tf.Graph().as_default():
+      generator = tf.random.uniform([4, 8, 8, 3])
+      with tf.Session() as sess:
+        with self.assertRaises(RuntimeError):
+          eval_utils.sample_fake_features(
+              sess, generator, num_batches=100,
+              inception_extractor=extractor, queue_size=1)
+    self.assertFalse(any(t.name == "eval_producer"
+                         for t in threading.enumerate()))
+
+
+if __name__ == "__main__":
+  tf.test.main()
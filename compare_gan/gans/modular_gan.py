@@ -122,6 +122,8 @@ class ModularGAN(AbstractGAN):
     self._experimental_force_graph_unroll = experimental_force_graph_unroll
     self._g_use_ema = g_use_ema
     self._ema_decay = ema_decay
+    # Tuple (graph, ExponentialMovingAverage) used by generate_for_eval().
+    self._eval_ema = None
     self._ema_start_step = ema_start_step
     self._g_optimizer_fn = g_optimizer_fn
     self._d_optimizer_fn = d_optimizer_fn
@@ -166,6 +168,10 @@ class ModularGAN(AbstractGAN):
   def conditional(self):
     return self._conditional
 
+  @property
+  def z_dim(self):
+    return self._z_dim
+
   @property
   def generator(self):
     if self._generator is None:
@@ -261,30 +267,55 @@ class ModularGAN(AbstractGAN):
       outputs["prediction"], _, _ = self.discriminator(
           inputs["images"], y=y, is_training=is_training)
     else:
-      z = inputs["z"]
-      generated = self.generator(z=z, y=y, is_training=is_training)
-      if self._g_use_ema and not is_training:
+      outputs["generated"] = self.generate_for_eval(
+          inputs["z"], labels=inputs.get("labels"))
+
+    hub.add_signature(inputs=inputs, outputs=outputs)
+
+  def generate_for_eval(self, z, labels=None):
+    """Builds the generator for inference in the current graph.
+
+    The variables have the same names as in the training graph, so
+    checkpoints can be restored directly. If `g_use_ema` is set the moving
+    averages of the weights are used. The method can be called several times
+    in the same graph, all generators share their variables.
+
+    Args:
+      z: Tensor of shape [batch_size, z_dim].
+      labels: Tensor of shape [batch_size] with integer labels. Only used if
+        the GAN is conditional.
+
+    Returns:
+      Tensor with the generated images.
+    """
+    is_training = False
+    y = self._get_one_hot_labels(labels) if self.conditional else None
+    generated = self.generator(z=z, y=y, is_training=is_training)
+    if self._g_use_ema and not is_training:
+      graph = tf.get_default_graph()
+      # The moving averages are shared by all generators built in a graph.
+      if self._eval_ema is None or self._eval_ema[0] is not graph:
         g_vars = [var for var in tf.trainable_variables()
                   if "generator" in var.name]
         ema = tf.train.ExponentialMovingAverage(decay=self._ema_decay)
         # Create the variables that will be loaded from the checkpoint.
         ema.apply(g_vars)
-        def ema_getter(getter, name, *args, **kwargs):
-          var = getter(name, *args, **kwargs)
-          ema_var = ema.average(var)
-          if ema_var is None:
-            var_names_without_ema = {"u_var", "accu_mean", "accu_variance",
-                                     "accu_counter", "update_accus"}
-            if name.split("/")[-1] not in var_names_without_ema:
-              logging.warning("Could not find EMA variable for %s.", name)
-            return var
-          return ema_var
-        with tf.variable_scope("", values=[z, y], reuse=True,
-                               custom_getter=ema_getter):
-          generated = self.generator(z, y=y, is_training=is_training)
-      outputs["generated"] = generated
-
-    hub.add_signature(inputs=inputs, outputs=outputs)
+        self._eval_ema = (graph, ema)
+      ema = self._eval_ema[1]
+      def ema_getter(getter, name, *args, **kwargs):
+        var = getter(name, *args, **kwargs)
+        ema_var = ema.average(var)
+        if ema_var is None:
+          var_names_without_ema = {"u_var", "accu_mean", "accu_variance",
+                                   "accu_counter", "update_accus"}
+          if name.split("/")[-1] not in var_names_without_ema:
+            logging.warning("Could not find EMA variable for %s.", name)
+          return var
+        return ema_var
+      with tf.variable_scope("", values=[z, y], reuse=True,
+                             custom_getter=ema_getter):
+        generated = self.generator(z, y=y, is_training=is_training)
+    return generated
 
   def as_module_spec(self):
     """Returns the generator network as TFHub module spec."""
@@ -542,6 +573,10 @@ class ModularGAN(AbstractGAN):
     # Clean old summaries from previous calls to model_fn().
     self._tpu_summary = tpu_summaries.TpuSummaries(self._model_dir)
 
+    # Images from the uint8 input pipeline are converted on the accelerator.
+    features = dict(features)
+    features["images"] = self._dataset.unpack_images(features["images"])
+
     # Get features for each sub-step.
     fs, ls = self._split_inputs_and_generate_samples(
         features, labels, num_sub_steps=num_sub_steps)
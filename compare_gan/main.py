@@ -49,12 +49,6 @@ flags.DEFINE_string("model_dir", None, "Where to store files.")
 flags.DEFINE_string(
     "schedule", "train",
     "Schedule to run. Options: train, continuous_eval.")
-flags.DEFINE_multi_string(
-    "gin_config", [],
-    "List of paths to the config files.")
-flags.DEFINE_multi_string(
-    "gin_bindings", [],
-    "Newline separated list of Gin parameter bindings.")
 flags.DEFINE_string(
     "score_filename", "scores.csv",
     "Name of the CSV file with evaluation results model_dir.")
@@ -65,6 +59,17 @@ flags.DEFINE_integer(
 flags.DEFINE_integer(
     "eval_every_steps", 5000,
     "Evaluate only checkpoints whose step is divisible by this integer")
+flags.DEFINE_bool(
+    "export_tfhub_modules", False,
+    "If True, every evaluated checkpoint is exported as TF Hub module to "
+    "model_dir/tfhub/<step>. Otherwise checkpoints are evaluated directly.")
+flags.DEFINE_integer(
+    "num_eval_workers", 1,
+    "Number of checkpoints evaluated in parallel by separate processes.")
+flags.DEFINE_integer(
+    "num_eval_threads_per_worker", 0,
+    "Number of intra and inter op threads of each evaluation worker. 0 lets "
+    "TensorFlow choose.")
 
 flags.DEFINE_bool("use_tpu", None, "Whether running on TPU or not.")
 
@@ -131,7 +136,10 @@ def main(unused_argv):
       options=options,
       use_tpu=FLAGS.use_tpu,
       num_eval_averaging_runs=FLAGS.num_eval_averaging_runs,
-      eval_every_steps=FLAGS.eval_every_steps)
+      eval_every_steps=FLAGS.eval_every_steps,
+      export_tfhub_modules=FLAGS.export_tfhub_modules,
+      num_eval_workers=FLAGS.num_eval_workers,
+      num_eval_threads_per_worker=FLAGS.num_eval_threads_per_worker)
   logging.info("I\"m done with my work, ciao!")
 
 
@@ -24,18 +24,28 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+
 from absl import logging
 
 from compare_gan import datasets
+from compare_gan import eval_gan_lib
 from compare_gan import eval_utils
+from compare_gan.gans import loss_lib
 from compare_gan.metrics import eval_task
 
 import numpy as np
+from six.moves import range
+import tensorflow as tf
 
 
 class AccuracyTask(eval_task.EvalTask):
   """Evaluation Task for computing and reporting accuracy."""
 
+  def __init__(self):
+    # The accuracy graph is built once per TF graph.
+    self._accuracy_graph = None
+
   def metric_list(self):
     return frozenset([
         "train_accuracy", "test_accuracy", "fake_accuracy", "train_d_loss",
@@ -44,25 +54,131 @@ class AccuracyTask(eval_task.EvalTask):
 
   def run_in_session(self, options, sess, gan, real_images):
     del options
-    return compute_accuracy_loss(sess, gan, real_images)
+    if (self._accuracy_graph is None or
+        self._accuracy_graph.initializer.graph is not sess.graph):
+      with sess.graph.as_default():
+        self._accuracy_graph = build_accuracy_graph(
+            gan, datasets.get_dataset().image_shape)
+    return compute_accuracy_loss(sess, gan, real_images,
+                                 accuracy_graph=self._accuracy_graph)
+
+
+# Inputs and per batch outputs of the graph built by build_accuracy_graph().
+# The real images are fed to the `test_images` and `train_images`
+# placeholders when running `initializer`. `batch_stats` is a dict with the
+# number of examples in the batch, the number of correct predictions and the
+# sum of the discriminator losses for each kind of images.
+AccuracyGraph = collections.namedtuple(
+    "AccuracyGraph",
+    ["test_images", "train_images", "initializer", "batch_stats"])
+
+
+def build_accuracy_graph(gan, image_shape, batch_size=64):
+  """Builds the graph evaluating the discriminator in the default graph.
+
+  Each batch of test images, training images and the same number of
+  generated images is scored by a single discriminator call. The real images
+  are delivered by a `tf.data` pipeline from placeholders, the generated ones
+  are sampled in the graph. The last batch may be smaller than batch_size,
+  it is padded for the discriminator call and the padding is ignored.
+
+  Args:
+    gan: `ModularGAN` object. Only unconditional GANs are supported.
+    image_shape: Shape [height, width, colors] of the images seen by the
+      discriminator.
+    batch_size: Number of test, training and generated images evaluated per
+      session call.
+
+  Returns:
+    `AccuracyGraph` tuple.
+
+  Raises:
+    ValueError: If the GAN is conditional.
+  """
+  if gan.conditional:
+    raise ValueError("The accuracy metric needs the labels of the real "
+                     "images and does not support conditional GANs.")
+  # The real images are in [0, 255] with 3 channels (see
+  # eval_utils.get_real_images()).
+  images_shape = [None] + list(image_shape[:2]) + [3]
+  test_images = tf.placeholder(tf.float32, images_shape, name="test_images")
+  train_images = tf.placeholder(tf.float32, images_shape, name="train_images")
+  ds = tf.data.Dataset.from_tensor_slices((test_images, train_images))
+  ds = ds.batch(batch_size, drop_remainder=False).prefetch(1)
+  iterator = ds.make_initializable_iterator()
+  test_batch, train_batch = iterator.get_next()
+  num_examples = tf.shape(test_batch)[0]
+
+  def preprocess(images):
+    # Most architectures need a static batch size.
+    images = tf.pad(images[..., :image_shape[-1]] / 255.0,
+                    [[0, batch_size - num_examples], [0, 0], [0, 0], [0, 0]])
+    images.set_shape([batch_size] + list(image_shape))
+    return images
+
+  z = eval_gan_lib.z_generator(shape=[batch_size, gan.z_dim])
+  fake_batch = gan.generate_for_eval(z)
+  all_images = tf.concat(
+      [preprocess(test_batch), preprocess(train_batch), fake_batch], axis=0)
+  d_all, d_all_logits, _ = gan.discriminator(
+      all_images, y=None, is_training=False)
+  # Drop the outputs for the padding.
+  d_test, d_train, d_fake = [x[:num_examples] for x in tf.split(d_all, 3)]
+  d_test_logits, d_train_logits, d_fake_logits = [
+      x[:num_examples] for x in tf.split(d_all_logits, 3)]
+
+  def d_loss_sum(d_real, d_real_logits):
+    d_loss, _, _, _ = loss_lib.get_losses(
+        d_real=d_real, d_fake=d_fake, d_real_logits=d_real_logits,
+        d_fake_logits=d_fake_logits)
+    return d_loss * tf.cast(num_examples, tf.float32)
+
+  def num_correct(predictions):
+    return tf.reduce_sum(tf.cast(predictions, tf.int64))
+
+  batch_stats = {
+      "num_examples": num_examples,
+      "test_correct": num_correct(d_test >= 0.5),
+      "train_correct": num_correct(d_train >= 0.5),
+      "fake_correct": num_correct(d_fake < 0.5),
+      "test_d_loss": d_loss_sum(d_test, d_test_logits),
+      "train_d_loss": d_loss_sum(d_train, d_train_logits),
+  }
+  return AccuracyGraph(
+      test_images=test_images,
+      train_images=train_images,
+      initializer=iterator.initializer,
+      batch_stats=batch_stats)
 
 
 def compute_accuracy_loss(sess,
                           gan,
                           test_images,
                           max_train_examples=50000,
-                          num_repeat=5):
+                          num_repeat=5,
+                          batch_size=64,
+                          train_images=None,
+                          accuracy_graph=None):
   """Compute discriminator's accuracy and loss on a given dataset.
 
+  Each batch is evaluated with a single session call.
+
   Args:
-    sess: Tf.Session object.
-    gan: Any AbstractGAN instance.
+    sess: Tf.Session object. The variables of the GAN must be initialized or
+      restored in its graph.
+    gan: `ModularGAN` instance.
     test_images: numpy array with test images.
     max_train_examples: How many "train" examples to get from the dataset.
                         In each round, some of them will be randomly selected
                         to evaluate train set accuracy.
     num_repeat: How many times to repreat the computation.
                 The mean of all the results is reported.
+    batch_size: Number of test, training and generated images evaluated per
+                session call. Only used if accuracy_graph is None.
+    train_images: Optional numpy array with training images. If None,
+                  max_train_examples images are read from the dataset.
+    accuracy_graph: Optional `AccuracyGraph` in the graph of sess. If None,
+                    it is built in the graph of sess.
   Returns:
     Dict[Text, float] with all the computed scores.
 
@@ -71,20 +187,19 @@ def compute_accuracy_loss(sess,
                 training images returned by the dataset.
   """
   logging.info("Evaluating training and test accuracy...")
-  train_images = eval_utils.get_real_images(
-      dataset=datasets.get_dataset(),
-      num_examples=max_train_examples,
-      split="train",
-      failure_on_insufficient_examples=False)
+  if train_images is None:
+    train_images = eval_utils.get_real_images(
+        dataset=datasets.get_dataset(),
+        num_examples=max_train_examples,
+        split="train",
+        failure_on_insufficient_examples=False)
   if train_images.shape[0] < test_images.shape[0]:
     raise ValueError("num_train %d must be larger than num_test %d." %
                      (train_images.shape[0], test_images.shape[0]))
-
-  num_batches = int(np.floor(test_images.shape[0] / gan.batch_size))
-  if num_batches * gan.batch_size < test_images.shape[0]:
-    logging.error("Ignoring the last batch with %d samples / %d epoch size.",
-                  test_images.shape[0] - num_batches * gan.batch_size,
-                  gan.batch_size)
+  if accuracy_graph is None:
+    with sess.graph.as_default():
+      accuracy_graph = build_accuracy_graph(
+          gan, datasets.get_dataset().image_shape, batch_size=batch_size)
 
   ret = {
       "train_accuracy": [],
@@ -96,48 +211,25 @@ def compute_accuracy_loss(sess,
 
   for _ in range(num_repeat):
     idx = np.random.choice(train_images.shape[0], test_images.shape[0])
-    bs = gan.batch_size
-    train_subset = [train_images[i] for i in idx]
-    train_predictions, test_predictions, fake_predictions = [], [], []
-    train_d_losses, test_d_losses = [], []
-
-    for i in range(num_batches):
-      z_sample = gan.z_generator(gan.batch_size, gan.z_dim)
-      start_idx = i * bs
-      end_idx = start_idx + bs
-      test_batch = test_images[start_idx : end_idx]
-      train_batch = train_subset[start_idx : end_idx]
-
-      test_prediction, test_d_loss, fake_images = sess.run(
-          [gan.discriminator_output, gan.d_loss, gan.fake_images],
-          feed_dict={
-              gan.inputs: test_batch, gan.z: z_sample
-          })
-      train_prediction, train_d_loss = sess.run(
-          [gan.discriminator_output, gan.d_loss],
-          feed_dict={
-              gan.inputs: train_batch,
-              gan.z: z_sample
-          })
-      fake_prediction = sess.run(
-          gan.discriminator_output,
-          feed_dict={gan.inputs: fake_images})[0]
-
-      train_predictions.append(train_prediction[0])
-      test_predictions.append(test_prediction[0])
-      fake_predictions.append(fake_prediction)
-      train_d_losses.append(train_d_loss)
-      test_d_losses.append(test_d_loss)
-
-    train_predictions = [x >= 0.5 for x in train_predictions]
-    test_predictions = [x >= 0.5 for x in test_predictions]
-    fake_predictions = [x < 0.5 for x in fake_predictions]
-
-    ret["train_accuracy"].append(np.array(train_predictions).mean())
-    ret["test_accuracy"].append(np.array(test_predictions).mean())
-    ret["fake_accuracy"].append(np.array(fake_predictions).mean())
-    ret["train_d_loss"].append(np.mean(train_d_losses))
-    ret["test_d_loss"].append(np.mean(test_d_losses))
+    sess.run(accuracy_graph.initializer, feed_dict={
+        accuracy_graph.test_images: test_images,
+        accuracy_graph.train_images: train_images[idx],
+    })
+    totals = collections.defaultdict(float)
+    while True:
+      try:
+        batch_stats = sess.run(accuracy_graph.batch_stats)
+      except tf.errors.OutOfRangeError:
+        break
+      for key, value in batch_stats.items():
+        totals[key] += value
+
+    num_examples = totals["num_examples"]
+    ret["train_accuracy"].append(totals["train_correct"] / num_examples)
+    ret["test_accuracy"].append(totals["test_correct"] / num_examples)
+    ret["fake_accuracy"].append(totals["fake_correct"] / num_examples)
+    ret["train_d_loss"].append(totals["train_d_loss"] / num_examples)
+    ret["test_d_loss"].append(totals["test_d_loss"] / num_examples)
 
   for key in ret:
     ret[key] = np.mean(ret[key])
@@ -0,0 +1,90 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the discriminator accuracy metric."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+from compare_gan import datasets
+from compare_gan import test_utils
+from compare_gan.gans import consts as c
+from compare_gan.gans.modular_gan import ModularGAN
+from compare_gan.metrics import accuracy
+
+import gin
+import mock
+import numpy as np
+import tensorflow as tf
+
+
+class AccuracyTest(test_utils.CompareGanTestCase):
+
+  def _compute_accuracy_loss(self, test_images, train_images, batch_size):
+    gin.bind_parameter("dataset.name", "cifar10")
+    dataset = datasets.get_dataset("cifar10")
+    parameters = {
+        "architecture": c.DUMMY_ARCH,
+        "lambda": 1,
+        "z_dim": 8,
+    }
+    model_dir = os.path.join(tf.test.get_temp_dir(), self.id())
+    gan = ModularGAN(dataset=dataset, parameters=parameters,
+                     model_dir=model_dir)
+    with tf.Graph().as_default():
+      tf.set_random_seed(1)
+      accuracy_graph = accuracy.build_accuracy_graph(
+          gan, dataset.image_shape, batch_size=batch_size)
+      with self.session() as sess:
+        sess.run(tf.global_variables_initializer())
+        with mock.patch.object(sess, "run", wraps=sess.run) as mock_run:
+          result = accuracy.compute_accuracy_loss(
+              sess, gan, test_images, num_repeat=2, train_images=train_images,
+              accuracy_graph=accuracy_graph)
+          num_session_calls = mock_run.call_count
+    return result, num_session_calls
+
+  def test_one_session_call_per_batch(self):
+    rng = np.random.RandomState(0)
+    test_images = rng.uniform(0, 255, size=[10, 32, 32, 3])
+    train_images = rng.uniform(0, 255, size=[20, 32, 32, 3])
+    result, num_session_calls = self._compute_accuracy_loss(
+        test_images, train_images, batch_size=4)
+    self.assertEqual(set(result.keys()), accuracy.AccuracyTask().metric_list())
+    for key in ["train_accuracy", "test_accuracy", "fake_accuracy"]:
+      self.assertBetween(result[key], 0.0, 1.0)
+    # Per repeat: initialize the iterator, 3 batches (the last one with 2
+    # images) and the end of the data set.
+    self.assertEqual(num_session_calls, 2 * (1 + 3 + 1))
+
+  def test_last_partial_batch_is_used(self):
+    rng = np.random.RandomState(0)
+    # The dummy discriminator is linear in the mean color of the image and its
+    # bias is 0. Black images get the prediction 0.5 and are classified as
+    # real, exactly one of the two last images is classified as fake.
+    test_images = np.zeros([10, 32, 32, 3])
+    test_images[-2] = 255.0
+    test_images[-1] = -255.0
+    train_images = rng.uniform(0, 255, size=[20, 32, 32, 3])
+    for batch_size in [4, 10]:
+      result, _ = self._compute_accuracy_loss(
+          test_images, train_images, batch_size=batch_size)
+      self.assertAllClose(result["test_accuracy"], 0.9)
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -41,6 +41,20 @@ class EvalTask(object):
   """
 
   _LABEL = None
+  # Whether run_after_session() needs the generated images. If no task needs
+  # them, only the Inception features of the generated images are kept.
+  _REQUIRES_IMAGES = False
+  # Whether run_after_session() needs the Inception activations of the
+  # generated images. Otherwise only their moments are kept.
+  _REQUIRES_ACTIVATIONS = True
+
+  def requires_images(self):
+    """Returns True if the task uses the images of the fake data set."""
+    return self._REQUIRES_IMAGES
+
+  def requires_activations(self):
+    """Returns True if the task uses the activations of the fake data set."""
+    return self._REQUIRES_ACTIVATIONS
 
   def metric_list(self):
     """List of metrics that this class generates.
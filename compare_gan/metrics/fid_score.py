@@ -15,9 +15,9 @@
 
 """Implementation of the Frechet Inception Distance.
 
-Implemented as a wrapper around the tf.contrib.gan library. The details can be
-found in "GANs Trained by a Two Time-Scale Update Rule Converge to a Local Nash
-Equilibrium", Heusel et al. [https://arxiv.org/abs/1706.08500].
+Implemented in NumPy/SciPy on the first two moments of the activations. The
+details can be found in "GANs Trained by a Two Time-Scale Update Rule Converge
+to a Local Nash Equilibrium", Heusel et al. [https://arxiv.org/abs/1706.08500].
 """
 
 from __future__ import absolute_import
@@ -28,8 +28,8 @@ from absl import logging
 
 from compare_gan.metrics import eval_task
 
-import tensorflow as tf
-import tensorflow_gan as tfgan
+import numpy as np
+import scipy.linalg.blas
 
 
 # Special value returned when FID code returned exception.
@@ -40,19 +40,201 @@ class FIDScoreTask(eval_task.EvalTask):
   """Evaluation task for the FID score."""
 
   _LABEL = "fid_score"
+  _REQUIRES_ACTIVATIONS = False
 
   def run_after_session(self, fake_dset, real_dset):
     logging.info("Calculating FID.")
-    with tf.Graph().as_default():
-      fake_activations = tf.convert_to_tensor(fake_dset.activations)
-      real_activations = tf.convert_to_tensor(real_dset.activations)
-      fid = tfgan.eval.frechet_classifier_distance_from_activations(
-          real_activations=real_activations,
-          generated_activations=fake_activations)
-      with self._create_session() as sess:
-        fid = sess.run(fid)
-      logging.info("Frechet Inception Distance: %.3f.", fid)
-      return {self._LABEL: fid}
+    # The moments of the real data are usually cached (see
+    # eval_utils.get_real_eval_data()), only the fake ones are computed here.
+    fake_mean, fake_covariance = _get_moments(fake_dset)
+    real_mean, real_covariance = _get_moments(real_dset)
+    fid = compute_fid_from_moments(
+        fake_mean, fake_covariance, real_mean, real_covariance)
+    logging.info("Frechet Inception Distance: %.3f.", fid)
+    return {self._LABEL: fid}
+
+
+def _get_moments(dset):
+  if dset.moments is not None:
+    return dset.moments
+  return compute_moments(dset.activations)
+
+
+def compute_moments(activations, counts=None):
+  """Returns the mean and the covariance matrix of the activations.
+
+  The computation is done in float64. The covariance is computed with a single
+  symmetric rank-k update (BLAS syrk) on the centered activations, this is
+  about twice as fast as a general matrix product.
+
+  Args:
+    activations: NumPy array of shape [num_examples, num_features].
+    counts: Optional NumPy array of shape [num_examples] with how often each
+      row occurs, e.g. in a bootstrap resample. This avoids materializing the
+      resampled activations.
+
+  Returns:
+    Tuple (mean, covariance) of NumPy arrays with shapes [num_features] and
+    [num_features, num_features].
+  """
+  activations = np.asarray(activations, dtype=np.float64)
+  if counts is None:
+    num_examples = activations.shape[0]
+    mean = np.mean(activations, axis=0)
+    centered = activations - mean
+  else:
+    counts = np.asarray(counts, dtype=np.float64)
+    num_examples = np.sum(counts)
+    mean = counts.dot(activations) / num_examples
+    # Each row is scaled by sqrt(count), its outer product by the count.
+    centered = (activations - mean) * np.sqrt(counts)[:, None]
+  covariance = _centered_scatter(centered, alpha=1.0 / (num_examples - 1))
+  return mean, covariance
+
+
+def _centered_scatter(centered, alpha=1.0):
+  """Returns alpha * centered^T * centered for a float64 matrix."""
+  # centered.T is Fortran contiguous, so it is passed to BLAS without a copy.
+  # syrk only fills the upper triangle.
+  scatter = scipy.linalg.blas.dsyrk(alpha=alpha, a=centered.T)
+  return np.triu(scatter) + np.triu(scatter, 1).T
+
+
+class StreamingMoments(object):
+  """Accumulates the mean and covariance of activations batch by batch.
+
+  Each batch is reduced to its mean and scatter matrix (sum of the outer
+  products of the centered rows), which are merged into the running values
+  with the pairwise update of Chan et al. This is numerically stable and only
+  needs memory for a [num_features, num_features] matrix, the activations
+  themselves are not kept.
+
+  Accumulators of disjoint parts of a data set (e.g. computed by different
+  processes) can be combined with merge(). The state is a dictionary of NumPy
+  arrays, see get_state() and from_state(), and objects can be pickled.
+  """
+
+  def __init__(self):
+    self._num_examples = 0
+    self._mean = None
+    self._scatter = None
+
+  @property
+  def num_examples(self):
+    return self._num_examples
+
+  @property
+  def mean(self):
+    return self._mean
+
+  @property
+  def covariance(self):
+    """Returns the unbiased estimate of the covariance matrix."""
+    if self._num_examples < 2:
+      raise ValueError("The covariance needs at least 2 examples, got %d." %
+                       self._num_examples)
+    return self._scatter / (self._num_examples - 1)
+
+  def moments(self):
+    """Returns a tuple (mean, covariance) like compute_moments()."""
+    return self.mean, self.covariance
+
+  def update(self, activations):
+    """Adds a batch of activations of shape [batch_size, num_features]."""
+    activations = np.asarray(activations, dtype=np.float64)
+    if not activations.shape[0]:
+      return
+    mean = np.mean(activations, axis=0)
+    scatter = _centered_scatter(activations - mean)
+    self._merge(activations.shape[0], mean, scatter)
+
+  def merge(self, other):
+    """Adds the examples accumulated by another `StreamingMoments` object."""
+    if other.num_examples:
+      self._merge(other.num_examples, other.mean, other._scatter)  # pylint: disable=protected-access
+
+  def _merge(self, num_examples, mean, scatter):
+    if not self._num_examples:
+      self._num_examples = num_examples
+      self._mean = np.array(mean, dtype=np.float64)
+      self._scatter = np.array(scatter, dtype=np.float64)
+      return
+    total = self._num_examples + num_examples
+    delta = mean - self._mean
+    self._scatter += scatter
+    self._scatter += np.outer(delta, delta) * (
+        self._num_examples * num_examples / total)
+    self._mean += delta * (num_examples / total)
+    self._num_examples = total
+
+  def get_state(self):
+    """Returns the accumulated values as dictionary of NumPy arrays."""
+    return {
+        "num_examples": np.array(self._num_examples, dtype=np.int64),
+        "mean": self._mean,
+        "scatter": self._scatter,
+    }
+
+  @classmethod
+  def from_state(cls, state):
+    """Creates an accumulator from the output of get_state()."""
+    moments = cls()
+    num_examples = int(state["num_examples"])
+    if num_examples:
+      moments._merge(num_examples, state["mean"], state["scatter"])  # pylint: disable=protected-access
+    return moments
+
+
+def _sqrtm_psd(matrix):
+  """Returns the square root of a symmetric positive semi-definite matrix."""
+  eigenvalues, eigenvectors = np.linalg.eigh(matrix)
+  # Negative eigenvalues are numerical errors.
+  eigenvalues = np.sqrt(np.maximum(eigenvalues, 0.0))
+  return (eigenvectors * eigenvalues).dot(eigenvectors.T)
+
+
+def _trace_sqrt_product(sigma, sigma_v):
+  """Returns Tr(sqrt(sigma * sigma_v)) for two covariance matrices.
+
+  sqrt(sigma * sigma_v) is similar to sqrt(A) with the symmetric matrix
+  A = sqrt(sigma) * sigma_v * sqrt(sigma), so only eigendecompositions of
+  symmetric matrices are needed.
+
+  Args:
+    sigma: Covariance matrix of shape [n, n].
+    sigma_v: Covariance matrix of shape [n, n].
+
+  Returns:
+    The trace of the square root of the product.
+  """
+  sqrt_sigma = _sqrtm_psd(sigma)
+  sqrt_a_sqrt = sqrt_sigma.dot(sigma_v).dot(sqrt_sigma)
+  eigenvalues = np.linalg.eigvalsh(sqrt_a_sqrt)
+  return np.sum(np.sqrt(np.maximum(eigenvalues, 0.0)))
+
+
+def compute_fid_from_moments(mean1, covariance1, mean2, covariance2):
+  """Returns the FID between two Gaussians.
+
+  Args:
+    mean1: NumPy array of shape [n] with the mean of the first distribution.
+    covariance1: NumPy array of shape [n, n] with the covariance of the first
+      distribution.
+    mean2: NumPy array of shape [n] with the mean of the second distribution.
+    covariance2: NumPy array of shape [n, n] with the covariance of the second
+      distribution.
+
+  Returns:
+    A float, the Frechet Inception Distance.
+  """
+  mean1 = np.asarray(mean1, dtype=np.float64)
+  mean2 = np.asarray(mean2, dtype=np.float64)
+  covariance1 = np.asarray(covariance1, dtype=np.float64)
+  covariance2 = np.asarray(covariance2, dtype=np.float64)
+  mean_term = np.sum(np.square(mean1 - mean2))
+  trace_term = (np.trace(covariance1) + np.trace(covariance2) -
+                2.0 * _trace_sqrt_product(covariance1, covariance2))
+  return float(mean_term + trace_term)
 
 
 def compute_fid_from_activations(fake_activations, real_activations):
@@ -66,10 +248,7 @@ def compute_fid_from_activations(fake_activations, real_activations):
   """
   logging.info("Computing FID score.")
   assert fake_activations.shape == real_activations.shape
-  with tf.Session(graph=tf.Graph()) as sess:
-    fake_activations = tf.convert_to_tensor(fake_activations)
-    real_activations = tf.convert_to_tensor(real_activations)
-    fid = tfgan.eval.frechet_classifier_distance_from_activations(
-        real_activations=real_activations,
-        generated_activations=fake_activations)
-    return sess.run(fid)
+  fake_mean, fake_covariance = compute_moments(fake_activations)
+  real_mean, real_covariance = compute_moments(real_activations)
+  return compute_fid_from_moments(
+      fake_mean, fake_covariance, real_mean, real_covariance)
@@ -19,10 +19,14 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import pickle
+
+from compare_gan import eval_utils
 from compare_gan.metrics import fid_score as fid_score_lib
 
 import numpy as np
 import tensorflow as tf
+import tensorflow_gan as tfgan
 
 
 class FIDScoreTest(tf.test.TestCase):
@@ -39,5 +43,80 @@ class FIDScoreTest(tf.test.TestCase):
     result = fid_score_lib.compute_fid_from_activations(real_data, gen_data)
     self.assertNear(result, 89.091, 1e-4)
 
+  def test_compute_moments(self):
+    activations = np.random.normal(size=(500, 20)).astype(np.float32)
+    mean, covariance = fid_score_lib.compute_moments(activations)
+    self.assertEqual(mean.dtype, np.float64)
+    self.assertEqual(covariance.dtype, np.float64)
+    self.assertAllClose(mean, np.mean(activations, axis=0))
+    self.assertAllClose(covariance, np.cov(activations, rowvar=False))
+    self.assertAllEqual(covariance, covariance.T)
+
+  def test_fid_from_moments_matches_tfgan(self):
+    real_activations = np.random.normal(size=(200, 16))
+    fake_activations = np.random.normal(
+        loc=0.5, size=(200, 16)).dot(np.random.normal(size=(16, 16)))
+    with tf.Graph().as_default():
+      expected_fid = tfgan.eval.frechet_classifier_distance_from_activations(
+          real_activations=tf.convert_to_tensor(real_activations),
+          generated_activations=tf.convert_to_tensor(fake_activations))
+      with self.session() as sess:
+        expected_fid = sess.run(expected_fid)
+    fid = fid_score_lib.compute_fid_from_moments(
+        *(fid_score_lib.compute_moments(fake_activations) +
+          fid_score_lib.compute_moments(real_activations)))
+    self.assertAllClose(fid, expected_fid, rtol=1e-5)
+
+  def test_fid_task_uses_cached_real_moments(self):
+    real_activations = np.random.normal(size=(100, 8))
+    fake_activations = np.random.normal(loc=1.0, size=(100, 8))
+    real_dset = eval_utils.EvalDataSample(None)
+    real_dset.set_inception_features(activations=None, logits=None)
+    real_dset.set_moments(*fid_score_lib.compute_moments(real_activations))
+    fake_dset = eval_utils.EvalDataSample(None)
+    fake_dset.set_inception_features(activations=fake_activations,
+                                     logits=None)
+    result = fid_score_lib.FIDScoreTask().run_after_session(
+        fake_dset, real_dset)
+    self.assertNear(
+        result["fid_score"],
+        fid_score_lib.compute_fid_from_activations(
+            fake_activations, real_activations),
+        1e-6)
+
+  def test_streaming_moments(self):
+    activations = np.random.normal(loc=100.0, scale=3.0, size=(1000, 16))
+    moments = fid_score_lib.StreamingMoments()
+    for start in range(0, 600, 64):
+      moments.update(activations[start:min(start + 64, 600)])
+    other_moments = fid_score_lib.StreamingMoments()
+    other_moments.update(activations[600:])
+    # Partial results are combined after a serialization round trip.
+    merged_moments = fid_score_lib.StreamingMoments.from_state(
+        moments.get_state())
+    merged_moments.merge(pickle.loads(pickle.dumps(other_moments)))
+    self.assertEqual(merged_moments.num_examples, 1000)
+    expected_mean, expected_covariance = fid_score_lib.compute_moments(
+        activations)
+    mean, covariance = merged_moments.moments()
+    self.assertAllClose(mean, expected_mean, rtol=1e-10)
+    self.assertAllClose(covariance, expected_covariance, rtol=1e-10)
+
+  def test_streaming_moments_merge_into_empty(self):
+    moments = fid_score_lib.StreamingMoments()
+    moments.merge(fid_score_lib.StreamingMoments())
+    self.assertEqual(moments.num_examples, 0)
+    with self.assertRaises(ValueError):
+      moments.covariance  # pylint: disable=pointless-statement
+    other_moments = fid_score_lib.StreamingMoments()
+    other_moments.update(np.eye(3))
+    moments.merge(other_moments)
+    moments.update(np.eye(3))
+    self.assertAllClose(moments.covariance,
+                        np.cov(np.concatenate([np.eye(3)] * 2), rowvar=False))
+    # The merged object is not modified.
+    self.assertEqual(other_moments.num_examples, 3)
+
+
 if __name__ == "__main__":
   tf.test.main()
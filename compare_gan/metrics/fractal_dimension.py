@@ -19,10 +19,11 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+from absl import logging
+
 from compare_gan.metrics import eval_task
 
 import numpy as np
-import scipy.spatial
 
 
 class FractalDimensionTask(eval_task.EvalTask):
@@ -30,16 +31,67 @@ class FractalDimensionTask(eval_task.EvalTask):
 
   _LABEL = "fractal_dimension"
 
-  def run_after_session(self, options, eval_data_fake, eval_data_real=None):
-    print(eval_data_fake)
-    score = compute_fractal_dimension(eval_data_fake.images)
+  def __init__(self, use_inception_features=False):
+    """Constructor.
+
+    Args:
+      use_inception_features: If True the fractal dimension of the Inception
+        features is computed instead of the one of the pixels. The generated
+        images do not need to be kept in memory then.
+    """
+    self._use_inception_features = use_inception_features
+
+  def requires_images(self):
+    return not self._use_inception_features
+
+  def requires_activations(self):
+    return self._use_inception_features
+
+  def run_after_session(self, fake_dset, real_dset):
+    del real_dset
+    if self._use_inception_features:
+      points = fake_dset.activations
+    else:
+      points = fake_dset.images
+    score = compute_fractal_dimension(points)
     return {self._LABEL: score}
 
 
+def _compute_distances(points, seeds, chunk_size):
+  """Returns the Euclidean distances between all points and the seeds.
+
+  The squared distances are computed as ||a||^2 + ||b||^2 - 2 a.b in chunks
+  of points, so only [chunk_size, dim] and [num_points, num_seeds] arrays
+  are allocated besides the inputs.
+
+  Args:
+    points: NumPy array of shape [num_points, dim].
+    seeds: NumPy array of shape [num_seeds, dim].
+    chunk_size: Number of points per chunk.
+
+  Returns:
+    NumPy array of shape [num_points, num_seeds].
+  """
+  seeds = np.asarray(seeds, dtype=np.float64)
+  seed_norms = np.sum(np.square(seeds), axis=1)
+  distances = np.empty((points.shape[0], seeds.shape[0]))
+  for start in range(0, points.shape[0], chunk_size):
+    chunk = np.asarray(points[start:start + chunk_size], dtype=np.float64)
+    chunk_distances = distances[start:start + chunk_size]
+    np.dot(chunk, seeds.T, out=chunk_distances)
+    chunk_distances *= -2.0
+    chunk_distances += np.sum(np.square(chunk), axis=1)[:, None]
+    chunk_distances += seed_norms
+  # Rounding errors can make squared distances slightly negative.
+  np.maximum(distances, 0.0, out=distances)
+  return np.sqrt(distances, out=distances)
+
+
 def compute_fractal_dimension(fake_images,
                               num_fd_seeds=100,
                               n_bins=1000,
-                              scale=0.1):
+                              scale=0.1,
+                              chunk_size=256):
   """Compute Fractal Dimension of fake_images.
 
   Args:
@@ -50,6 +102,8 @@ def compute_fractal_dimension(fake_images,
      n_bins: number of bins to split the range of distance values into
      scale: the scale of the y interval in the log-log plot for which we apply a
        linear regression fit
+     chunk_size: number of datapoints for which the distances to the seeds are
+       computed at once
 
   Returns:
     fractal dimension of the dataset.
@@ -58,16 +112,22 @@ def compute_fractal_dimension(fake_images,
   assert fake_images.shape[0] >= num_fd_seeds
 
   num_images = fake_images.shape[0]
-  # In order to apply scipy function we need to flatten the number of dimensions
-  # to 2
+  # Flatten the number of dimensions to 2.
   fake_images = np.reshape(fake_images, (num_images, -1))
-  fake_images_subset = fake_images[np.random.randint(
-      num_images, size=num_fd_seeds)]
-
-  distances = scipy.spatial.distance.cdist(fake_images,
-                                           fake_images_subset).flatten()
-  min_distance = np.min(distances[np.nonzero(distances)])
-  max_distance = np.max(distances)
+  seed_indices = np.random.randint(num_images, size=num_fd_seeds)
+  distances = _compute_distances(
+      fake_images, fake_images[seed_indices], chunk_size)
+  # The distance of each seed to itself is exactly 0.
+  distances[seed_indices, np.arange(num_fd_seeds)] = 0.0
+  distances = np.sort(distances, axis=None)
+
+  min_index = np.searchsorted(distances, 0.0, side="right")
+  if min_index >= len(distances):
+    logging.error("All distances are zero, cannot compute the fractal "
+                  "dimension, returning NaN.")
+    return np.nan
+  min_distance = distances[min_index]
+  max_distance = distances[-1]
   buckets = min_distance * (
       (max_distance / min_distance)**np.linspace(0, 1, n_bins))
   # Create a table where first column corresponds to distances r
@@ -75,7 +135,7 @@ def compute_fractal_dimension(fake_images,
   # within distance r from the random seeds
   fd_result = np.zeros((n_bins - 1, 2))
   fd_result[:, 0] = buckets[1:]
-  fd_result[:, 1] = np.sum(np.less.outer(distances, buckets[1:]), axis=0)
+  fd_result[:, 1] = np.searchsorted(distances, buckets[1:], side="left")
 
   # We compute the slope of the log-log plot at the middle y value
   # which is stored in y_val; the linear regression fit is computed on
@@ -90,6 +150,10 @@ def compute_fractal_dimension(fake_images,
 
   start = np.argmax(y > y_val - scale * y_width)
   end = np.argmax(y > y_val + scale * y_width)
+  if end - start < 2:
+    logging.error("Not enough distinct distances to fit the fractal "
+                  "dimension, returning NaN.")
+    return np.nan
 
   slope = np.linalg.lstsq(
       a=np.vstack([x[start:end], np.ones(end - start)]).transpose(),
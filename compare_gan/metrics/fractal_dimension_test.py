@@ -19,6 +19,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+from compare_gan import eval_utils
 from compare_gan.metrics import fractal_dimension as fractal_dimension_lib
 
 import numpy as np
@@ -38,3 +39,30 @@ class FractalDimensionTest(tf.test.TestCase):
     self.assertAllClose(
         fractal_dimension_lib.compute_fractal_dimension(
             np.random.uniform(size=(10000, 2))), 2.0, atol=0.1)
+
+  def test_identical_points(self):
+    """Identical points have no positive distances and give NaN."""
+    self.assertTrue(np.isnan(
+        fractal_dimension_lib.compute_fractal_dimension(
+            np.ones((1000, 2)))))
+
+  def test_compute_distances(self):
+    points = np.random.uniform(high=255.0, size=(103, 30))
+    seeds = points[:7]
+    distances = fractal_dimension_lib._compute_distances(
+        points, seeds, chunk_size=10)
+    self.assertEqual(distances.shape, (103, 7))
+    expected_distances = np.linalg.norm(
+        points[:, None, :] - seeds[None, :, :], axis=2)
+    self.assertAllClose(distances, expected_distances)
+
+  def test_task_with_inception_features(self):
+    fake_dset = eval_utils.EvalDataSample(None)
+    fake_dset.set_inception_features(
+        activations=np.random.uniform(size=(5000, 2)), logits=None)
+    task = fractal_dimension_lib.FractalDimensionTask(
+        use_inception_features=True)
+    self.assertFalse(task.requires_images())
+    self.assertTrue(task.requires_activations())
+    result = task.run_after_session(fake_dset, None)
+    self.assertAllClose(result["fractal_dimension"], 2.0, atol=0.15)
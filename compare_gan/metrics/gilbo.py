@@ -97,6 +97,28 @@ def _build_regressor(x, z_dim=64):
   return tdist
 
 
+def _generate(gan, z):
+  """Returns the images generated by the GAN for the latent Tensor z.
+
+  The generator is called on z directly, so samples never leave the device.
+  Conditional GANs get uniformly sampled labels.
+
+  Args:
+    gan: GAN object.
+    z: Tensor of shape [batch_size, z_dim].
+
+  Returns:
+    Tensor with the generated images.
+  """
+  labels = None
+  if gan.conditional:
+    labels = gan.label_generator(shape=[z.shape[0].value], name="gilbo_y")
+  # Reuse the generator variables instead of creating them under the current
+  # (GILBO) variable scope.
+  with tf.variable_scope(tf.VariableScope(reuse=tf.AUTO_REUSE)):
+    return gan.generate_for_eval(z, labels)
+
+
 def train_gilbo(gan, sess, outdir, checkpoint_path, dataset, options):
   """Build and train GILBO model.
 
@@ -139,10 +161,10 @@ def train_gilbo(gan, sess, outdir, checkpoint_path, dataset, options):
     epsneg = np.finfo("float32").epsneg
     # Clip samples from the GAN uniform prior because the Beta distribution
     # doesn"t include the top endpoint and has issues with the bottom endpoint.
-    ganz_clip = tf.clip_by_value(gan.z, -(1 - epsneg), 1 - epsneg)
+    ganz_clip = tf.clip_by_value(z_sample, -(1 - epsneg), 1 - epsneg)
 
-    # Get generated images from the model.
-    fake_images = gan.fake_images
+    # Get generated images from the model. Every session call samples new z.
+    fake_images = _generate(gan, z_sample)
 
     # Build the regressor distribution that encodes images back to predicted
     # samples from the prior.
@@ -235,11 +257,7 @@ def _train_gilbo(sess, gan, saver, learning_rate, gilbo_step, z_sample,
     for j in range(train_steps_per_cycle):
       if j % (train_steps_per_cycle // 10) == 0:
         tf.logging.info("step:%d, gilbo:%.3f" % (j, ai))
-      samp = sess.run(z_sample)
-
-      _, z_info = sess.run(
-          [train_op, avg_info],
-          feed_dict={gan.z: samp, learning_rate: lr})
+      _, z_info = sess.run([train_op, avg_info], feed_dict={learning_rate: lr})
       ai += (z_info - ai) / (j + 1)
     tf.logging.info("cycle:%d gilbo:%.3f min next gilbo:%.3f learning rate:%.3f"
                     % (i, ai, min_ai, lr))
@@ -288,22 +306,22 @@ def _eval_gilbo(sess, gan, z_sample, avg_info, dist_p1, dist_p2, fake_images,
     The mean GILBO on the evaluation set. Also writes a pickle file saving
     distribution parameters and generated images for later analysis.
   """
+  del z_sample  # The other Tensors sample z in the graph.
   eval_steps = options.get("gilbo_eval_steps", 10000)
   z_infos = np.zeros(eval_steps, np.float32)
   z_dist_p1s, z_dist_p2s, z_fake_images = [], [], []
   mean_eval_info = 0
   for i in range(eval_steps):
-    samp = sess.run(z_sample)
     if i * gan.batch_size < 1000:
       # Save the first 1000 distribution parameters and generated images for
       # separate data processing.
       z_infos[i], z_dist_p1, z_dist_p2, images = sess.run(
-          [avg_info, dist_p1, dist_p2, fake_images], feed_dict={gan.z: samp})
+          [avg_info, dist_p1, dist_p2, fake_images])
       z_dist_p1s.append(z_dist_p1)
       z_dist_p2s.append(z_dist_p2)
       z_fake_images.append(images)
     else:
-      z_infos[i] = sess.run(avg_info, feed_dict={gan.z: samp})
+      z_infos[i] = sess.run(avg_info)
 
     if i % (eval_steps // 10) == 0:
       tf.logging.info("eval step:%d gilbo:%3.1f" % (i, z_infos[i]))
@@ -322,22 +340,62 @@ def _eval_gilbo(sess, gan, z_sample, avg_info, dist_p1, dist_p2, fake_images,
   return mean_eval_info
 
 
+def _build_consistency_graph(input_images, gan):
+  """Builds the fused consistency computation for a batch of input images.
+
+  The graph regresses the input images to distributions over z, samples from
+  them, regenerates images from the samples and regresses these again. The
+  KL divergences between both distributions are the consistency measures.
+
+  Args:
+    input_images: Tensor. Dataset images, or images generated by the GAN.
+    gan: GAN object.
+
+  Returns:
+    Dict of Tensors with per example distribution parameters and divergences,
+    the regenerated images and the running mean of the symmetric KL.
+  """
+  with tf.variable_scope("regressor", reuse=True):
+    input_dist = _build_regressor(input_images, gan.z_dim)
+  consistency_images = _generate(gan, input_dist.sample())
+  with tf.variable_scope("regressor", reuse=True):
+    consistency_dist = _build_regressor(consistency_images, gan.z_dim)
+  # The KL divergences are invariant to the affine bijector, they are
+  # computed on the underlying Beta distributions.
+  input_beta = input_dist.distribution
+  consistency_beta = consistency_dist.distribution
+  consistency_kl = input_beta.kl_divergence(consistency_beta)
+  consistency_rkl = consistency_beta.kl_divergence(input_beta)
+  consistency_skl = (consistency_kl + consistency_rkl) / 2.0
+  _, mean_consistency_skl = tf.metrics.mean(consistency_skl)
+  return dict(
+      dist_p1=input_beta.distribution.concentration0,
+      dist_p2=input_beta.distribution.concentration1,
+      consist_dist_p1=consistency_beta.distribution.concentration0,
+      consist_dist_p2=consistency_beta.distribution.concentration1,
+      consistency_kl=consistency_kl,
+      consistency_rkl=consistency_rkl,
+      consistency_skl=consistency_skl,
+      consistency_images=consistency_images,
+      mean_consistency_skl=mean_consistency_skl)
+
+
 def _run_gilbo_consistency(
-    input_images, mode, dist_p1, dist_p2, z_pred_dist,
-    z_sample, gan, sess, outdir, dataset, extract_input_images=0,
+    input_images, mode, gan, sess, outdir, dataset, extract_input_images=0,
     save_consistency_images=0, num_batches=3000, **unused_kw):
   """Measure consistency of the gilbo estimator with the GAN or VAE.
 
   Arguments without documentation are variables from the calling function needed
   here. Pass them with **locals().
 
+  The computation for a batch is a single graph: regress the input images,
+  resample z, regenerate, regress again and compute the KL divergences. Each
+  batch takes one session call and the mean consistency is aggregated in the
+  graph.
+
   Args:
     input_images: Tensor. Dataset images, or images generated by the GAN or VAE.
     mode: "train", "eval", or "self". Which consistency measure to compute.
-    dist_p1:
-    dist_p2:
-    z_pred_dist:
-    z_sample:
     gan:
     sess:
     outdir:
@@ -352,62 +410,35 @@ def _run_gilbo_consistency(
     pickle as well as any requested images as pngs to outdir.
   """
   with tf.variable_scope("gilbo"):
-    with tf.variable_scope("regressor", reuse=True):
-      z_pred_dist_train = _build_regressor(input_images, gan.z_dim)
-      z_sample_train = z_pred_dist_train.sample()
-    dist_p1_ph = tf.placeholder(tf.float32, dist_p1.shape)
-    dist_p2_ph = tf.placeholder(tf.float32, dist_p2.shape)
-    consist_dist_p1_ph = tf.placeholder(tf.float32, dist_p1.shape)
-    consist_dist_p2_ph = tf.placeholder(tf.float32, dist_p2.shape)
-    dist_p1 = z_pred_dist_train.distribution.distribution.concentration0
-    dist_p2 = z_pred_dist_train.distribution.distribution.concentration1
-    consist_z_dist_p1 = z_pred_dist.distribution.distribution.concentration0
-    consist_z_dist_p2 = z_pred_dist.distribution.distribution.concentration1
-    base_dist = ds.Beta
-    kl_dist_p = ds.Independent(base_dist(dist_p1_ph, dist_p2_ph), 1)
-    kl_dist_q = ds.Independent(
-        base_dist(consist_dist_p1_ph, consist_dist_p2_ph), 1)
-    consistency_kl = kl_dist_p.kl_divergence(kl_dist_q)
-    consistency_rkl = kl_dist_q.kl_divergence(kl_dist_p)
-
-  z_dist_p1s, z_dist_p2s = [], []
-  consist_z_dist_p1s, consist_z_dist_p2s = [], []
-  consistency_kls, consistency_rkls, consistency_skls = [], [], []
+    with tf.variable_scope("%s_consistency" % mode) as scope:
+      consistency = _build_consistency_graph(input_images, gan)
+      metric_vars = tf.local_variables(scope=scope.name)
+  sess.run(tf.variables_initializer(metric_vars))
+  image_keys = ["consistency_images", "input_images"]
+  stats_keys = [k for k in consistency if k not in image_keys]
+  consistency["input_images"] = input_images
+
+  out_dists = {k: [] for k in stats_keys if k != "mean_consistency_skl"}
+  mean_consistency_skl = np.nan
 
   i = 0
   while i < num_batches:
     try:
-      samp = sess.run(z_sample)
-      z_dist_p1, z_dist_p2, images, train_samp = sess.run(
-          [dist_p1, dist_p2, input_images, z_sample_train],
-          feed_dict={gan.z: samp})
-      z_dist_p1s.append(z_dist_p1)
-      z_dist_p2s.append(z_dist_p2)
-
-      (consist_z_dist_p1_out, consist_z_dist_p2_out,
-       consistency_images) = sess.run(
-           [consist_z_dist_p1, consist_z_dist_p2, gan.fake_images],
-           feed_dict={gan.z: train_samp})
-
-      consist_z_dist_p1s.append(consist_z_dist_p1_out)
-      consist_z_dist_p2s.append(consist_z_dist_p2_out)
-
-      consist_kls, consist_rkls = sess.run(
-          [consistency_kl, consistency_rkl],
-          feed_dict={
-              dist_p1_ph: z_dist_p1,
-              dist_p2_ph: z_dist_p2,
-              consist_dist_p1_ph: consist_z_dist_p1_out,
-              consist_dist_p2_ph: consist_z_dist_p2_out,
-          })
-
-      consistency_kls.append(consist_kls)
-      consistency_rkls.append(consist_rkls)
-      consistency_skls.append((consist_kls + consist_rkls) / 2.0)
+      # Only fetch the images that are saved.
+      fetches = {k: consistency[k] for k in stats_keys}
+      if save_consistency_images or extract_input_images:
+        fetches["consistency_images"] = consistency["consistency_images"]
+      if extract_input_images:
+        fetches["input_images"] = consistency["input_images"]
+      results = sess.run(fetches)
+      for k in out_dists:
+        out_dists[k].append(results[k])
+      mean_consistency_skl = results["mean_consistency_skl"]
 
       if save_consistency_images:
         save_consistency_images -= 1
 
+        consistency_images = results["consistency_images"]
         filename = os.path.join(
             outdir,
             "consistency_image_%s_%06d_%06d.png"
@@ -421,14 +452,15 @@ def _run_gilbo_consistency(
       if extract_input_images:
         extract_input_images -= 1
 
+        images = results["input_images"]
         if mode == "self":
           filename = os.path.join(
               outdir,
               "%s_image_%06d_%06d.png"
               % (mode, i * gan.batch_size, (i + 1) * gan.batch_size - 1))
           img = images.reshape(
-              [gan.batch_size * consistency_images.shape[1],
-               consistency_images.shape[2],
+              [gan.batch_size * images.shape[1],
+               images.shape[2],
                -1])
           _save_image(img, filename)
         else:
@@ -441,26 +473,20 @@ def _run_gilbo_consistency(
       if i % 100 == 0:
         tf.logging.info(
             "%s: step:%d consistency KL:%3.1f" %
-            (mode, i, np.mean(consistency_skls)))
+            (mode, i, mean_consistency_skl))
 
       i += 1
     except tf.errors.OutOfRangeError:
       break
 
-  out_dists = dict(
-      dist_p1=np.reshape(z_dist_p1s, [-1, gan.batch_size]),
-      dist_p2=np.reshape(z_dist_p2s, [-1, gan.batch_size]),
-      consist_dist_p1=np.reshape(consist_z_dist_p1s, [-1, gan.batch_size]),
-      consist_dist_p2=np.reshape(consist_z_dist_p2s, [-1, gan.batch_size]),
-      consistency_kl=np.reshape(consistency_kls, [-1, gan.batch_size]),
-      consistency_rkl=np.reshape(consistency_rkls, [-1, gan.batch_size]),
-      consistency_skl=np.reshape(consistency_skls, [-1, gan.batch_size]),
-  )
+  out_dists = {
+      k: np.reshape(v, [-1, gan.batch_size]) for k, v in out_dists.items()
+  }
   with tf.gfile.Open(
       os.path.join(outdir, "%s_consistency_dists.p" % mode), "w") as f:
     pickle.dump(out_dists, f)
 
-  return np.mean(consistency_skls)
+  return mean_consistency_skl
 
 
 def _save_image(img, filename):
@@ -479,7 +505,7 @@ def _save_z_histograms(gan, z_sample, z_pred_dist, outdir, step):
   bins = np.linspace(-1, 1, 70)
 
   samp = z_sample.eval()
-  z_pred_samp = z_pred_dist.sample(10000).eval({gan.z: samp})
+  z_pred_samp = z_pred_dist.sample(10000).eval({z_sample: samp})
 
   try:
     for j in range(64):
@@ -15,8 +15,9 @@
 
 """Implementation of the Inception Score.
 
-Implemented as a wrapper around the tensorflow_gan library. The details can be
-found in "Improved Techniques for Training GANs", Salimans et al.
+Implemented in NumPy, the result matches the one of
+`tfgan.eval.classifier_score_from_logits`. The details can be found in
+"Improved Techniques for Training GANs", Salimans et al.
 [https://arxiv.org/abs/1606.03498].
 """
 
@@ -27,22 +28,73 @@ from __future__ import print_function
 from absl import logging
 
 from compare_gan.metrics import eval_task
-import tensorflow as tf
-import tensorflow_gan as tfgan
+
+import numpy as np
+import scipy.special
 
 
 class InceptionScoreTask(eval_task.EvalTask):
   """Task that computes inception score for the generated images."""
 
   _LABEL = "inception_score"
+  _REQUIRES_ACTIVATIONS = False
+
+  def __init__(self, num_splits=1):
+    """Constructor.
+
+    Args:
+      num_splits: Number of splits of the generated data. The reported score
+        is the mean of the scores of the splits.
+    """
+    self._num_splits = num_splits
 
   def run_after_session(self, fake_dset, real_dest):
     del real_dest
     logging.info("Computing inception score.")
-    with tf.Graph().as_default():
-      fake_logits = tf.convert_to_tensor(fake_dset.logits)
-      inception_score = tfgan.eval.classifier_score_from_logits(fake_logits)
-      with self._create_session() as sess:
-        inception_score = sess.run(inception_score)
-      logging.info("Inception score: %.3f", inception_score)
+    inception_score = compute_inception_score(
+        fake_dset.logits, num_splits=self._num_splits)
+    logging.info("Inception score: %.3f", inception_score)
     return {self._LABEL: inception_score}
+
+
+def compute_inception_score(logits, num_splits=1):
+  """Returns the Inception Score for the given logits.
+
+  The score of a split is exp(E_x[KL(p(y|x) || p(y))]). With
+  E_x[p(y|x)] = p(y) the expected KL divergence simplifies to
+  E_x[sum_y p(y|x) log p(y|x)] - sum_y p(y) log p(y). The softmax and the
+  row-wise negative entropies are computed once for all splits, with a
+  single exponentiation of the logits.
+
+  Args:
+    logits: NumPy array of shape [num_examples, num_classes].
+    num_splits: Number of splits. The examples are split into consecutive
+      blocks of (almost) equal size.
+
+  Returns:
+    A float, the mean of the Inception Scores of the splits.
+
+  Raises:
+    ValueError: If num_splits is not in [1, num_examples].
+  """
+  if not 0 < num_splits <= len(logits):
+    raise ValueError(
+        "num_splits must be between 1 and the number of examples (%d), got "
+        "%d." % (len(logits), num_splits))
+  # shifted = logits - max(logits), computed in place on a float64 copy.
+  shifted = np.array(logits, dtype=np.float64)
+  shifted -= np.max(shifted, axis=1, keepdims=True)
+  probs = np.exp(shifted)
+  normalizers = np.sum(probs, axis=1)
+  probs /= normalizers[:, None]
+  # sum_y p log p = sum_y p * shifted - log(normalizer) since sum_y p = 1.
+  negative_entropies = (np.einsum("ij,ij->i", probs, shifted) -
+                        np.log(normalizers))
+  scores = []
+  for split in np.array_split(np.arange(probs.shape[0]), num_splits):
+    split = slice(split[0], split[-1] + 1)
+    marginal = np.mean(probs[split], axis=0)
+    kl = (np.mean(negative_entropies[split]) -
+          np.sum(scipy.special.xlogy(marginal, marginal)))
+    scores.append(np.exp(kl))
+  return float(np.mean(scores))
@@ -0,0 +1,83 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the Inception Score."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from compare_gan import eval_utils
+from compare_gan.metrics import inception_score as inception_score_lib
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_gan as tfgan
+
+
+class InceptionScoreTest(tf.test.TestCase):
+
+  def _compute_tfgan_inception_score(self, logits):
+    with tf.Graph().as_default():
+      inception_score = tfgan.eval.classifier_score_from_logits(
+          tf.convert_to_tensor(logits))
+      with self.session() as sess:
+        return sess.run(inception_score)
+
+  def test_inception_score_matches_tfgan(self):
+    logits = np.random.normal(scale=3.0, size=(500, 20)).astype(np.float32)
+    self.assertAllClose(
+        inception_score_lib.compute_inception_score(logits),
+        self._compute_tfgan_inception_score(logits),
+        rtol=1e-6)
+
+  def test_inception_score_with_splits(self):
+    logits = np.random.normal(scale=3.0, size=(503, 20))
+    expected_scores = [self._compute_tfgan_inception_score(split)
+                       for split in np.array_split(logits, 5)]
+    self.assertAllClose(
+        inception_score_lib.compute_inception_score(logits, num_splits=5),
+        np.mean(expected_scores),
+        rtol=1e-6)
+
+  def test_inception_score_bounds(self):
+    # Uniform predictions give the minimum, one-hot predictions for evenly
+    # distributed classes the maximum (the number of classes).
+    self.assertAllClose(
+        inception_score_lib.compute_inception_score(np.zeros((10, 4))), 1.0)
+    one_hot_logits = np.tile(np.eye(4) * 100.0, [3, 1])
+    self.assertAllClose(
+        inception_score_lib.compute_inception_score(one_hot_logits), 4.0)
+
+  def test_inception_score_invalid_num_splits(self):
+    logits = np.random.normal(size=(10, 4))
+    for num_splits in [0, -1, 11]:
+      with self.assertRaises(ValueError):
+        inception_score_lib.compute_inception_score(
+            logits, num_splits=num_splits)
+
+  def test_inception_score_task(self):
+    logits = np.random.normal(size=(100, 10))
+    fake_dset = eval_utils.EvalDataSample(None)
+    fake_dset.set_inception_features(activations=None, logits=logits)
+    result = inception_score_lib.InceptionScoreTask(
+        num_splits=2).run_after_session(fake_dset, None)
+    self.assertAllClose(
+        result["inception_score"],
+        inception_score_lib.compute_inception_score(logits, num_splits=2))
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -91,30 +91,47 @@ def compute_jacobian(xs, fx):
   We assume x and fx are both batched, so the shape of the Jacobian is:
   [fx.shape[0]] + fx.shape[1:] + xs.shape[1:]
 
-  This function computes the grads inside a TF loop so that we don't
-  end up storing many extra copies of the function we are taking the
-  Jacobian of.
+  The Jacobian is computed column by column with Jacobian-vector products, so
+  it needs xs.shape[1] passes (e.g. z_dim for a generator) instead of one
+  backward pass per element of fx. TF1 has no forward-mode differentiation,
+  so the products are computed with the double-backward trick: the gradient
+  g(u) = J^T u of fx for a dummy cotangent u is linear in u and its gradient
+  with respect to u for the cotangent v is J v. Every pass computes the
+  column for all elements of the batch. The passes run inside a TF loop so
+  that we don't end up storing many extra copies of the function we are
+  taking the Jacobian of.
 
   Args:
-    xs: input tensor(s) of arbitrary shape.
-    fx: f(x) tensor of arbitrary shape.
+    xs: input tensor of shape [batch_size, x_dim].
+    fx: f(x) tensor of shape [batch_size, ...]. Each example may only depend
+      on the same example of xs.
 
   Returns:
-    df/dx tensor of shape [fx.shape[0], fx.shape[1], xs.shape[1]].
+    df/dx tensor of shape fx.shape + [xs.shape[1]].
   """
-  # Declares an iterator and tensor array loop variables for the gradients.
-  n = fx.get_shape().as_list()[1]
-  loop_vars = [tf.constant(0, tf.int32), tf.TensorArray(xs.dtype, n)]
+  n = xs.get_shape().as_list()[1]
+  batch_size = tf.shape(xs)[0]
+  # The value of the dummy cotangent does not matter since J^T u is linear.
+  cotangent = tf.zeros_like(fx)
+  vjp = tf.gradients(fx, xs, grad_ys=cotangent)[0]
+  loop_vars = [
+      tf.constant(0, tf.int32),
+      tf.TensorArray(fx.dtype, n, element_shape=fx.get_shape())
+  ]
 
   def accumulator(j, result):
-    return (j + 1, result.write(j, tf.gradients(fx[:, j], xs)[0]))
+    tangent = tf.one_hot(tf.fill([batch_size], j), n, dtype=xs.dtype)
+    jvp = tf.gradients(vjp, cotangent, grad_ys=tangent)[0]
+    return (j + 1, result.write(j, jvp))
 
-  # Iterates over all elements of the gradient and computes all partial
-  # derivatives.
+  # Iterates over all input dimensions and computes the columns of the
+  # Jacobian.
   _, df_dxs = tf.while_loop(lambda j, _: j < n, accumulator, loop_vars)
 
+  # Shape [x_dim, batch_size] + fx.shape[1:].
   df_dx = df_dxs.stack()
-  df_dx = tf.transpose(df_dx, perm=[1, 0, 2])
+  rank = fx.get_shape().ndims + 1
+  df_dx = tf.transpose(df_dx, perm=list(range(1, rank)) + [0])
 
   return df_dx
 
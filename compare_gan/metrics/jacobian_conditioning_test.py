@@ -114,6 +114,21 @@ class JacobianConditioningTest(tf.test.TestCase):
             rtol=1e-3,
             atol=1e-3)
 
+  def test_jacobian_of_image_output(self):
+    x = tf.random_normal([_BATCH_SIZE, 3])
+    h = tf.contrib.layers.fully_connected(x, 4 * 4 * 2)
+    f = tf.reshape(tf.contrib.layers.fully_connected(h, 4 * 4 * 2),
+                   [_BATCH_SIZE, 4, 4, 2])
+    j_slow_tensor = SlowJacobian(xs=x, fx=tf.reshape(f, [_BATCH_SIZE, -1]))
+    j_fast_tensor = jacobian_conditioning.compute_jacobian(xs=x, fx=f)
+    self.assertAllEqual(j_fast_tensor.get_shape().as_list(),
+                        [_BATCH_SIZE, 4, 4, 2, 3])
+
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      j_fast, j_slow = sess.run([j_fast_tensor, j_slow_tensor])
+    self.assertAllClose(np.reshape(j_fast, j_slow.shape), j_slow)
+
   def test_analyze_metric_tensor(self):
     # Assumes NumPy works, just tests that output shapes are as expected.
     jacobian = np.random.normal(0, 1, (_BATCH_SIZE, 2, 10))
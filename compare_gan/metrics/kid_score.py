@@ -23,29 +23,129 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import math
+import hashlib
+
+from absl import logging
 
 from compare_gan.metrics import eval_task
 
 import numpy as np
-import tensorflow as tf
+import scipy.linalg.blas
 
 
 class KIDScoreTask(eval_task.EvalTask):
-  """Evaluation task for the KID score."""
+  """Evaluation task for the KID score.
+
+  The kernel terms of the real data only depend on the real activations, they
+  are computed once and reused for all evaluations by this task object.
+  """
 
   _LABEL = "kid_score"
 
+  def __init__(self, max_batch_size=1024, dtype=np.float32):
+    """Constructor.
+
+    Args:
+      max_batch_size: Maximum size of the blocks of the estimator.
+      dtype: Type used by the kernel computations.
+    """
+    self._max_batch_size = max_batch_size
+    self._dtype = dtype
+    self._real_kernel_terms_cache = {}
+
+  def _get_real_kernel_terms(self, real_activations, num_blocks):
+    real_activations = np.ascontiguousarray(real_activations)
+    key = (hashlib.sha1(real_activations.data).hexdigest(),
+           real_activations.shape, num_blocks)
+    if key not in self._real_kernel_terms_cache:
+      self._real_kernel_terms_cache[key] = compute_real_kernel_terms(
+          real_activations, num_blocks, dtype=self._dtype)
+    return self._real_kernel_terms_cache[key]
+
   def run_after_session(self, fake_dset, real_dset):
-    score = kid(fake_dset.activations, real_dset.activations)
+    num_blocks = get_num_blocks(
+        fake_dset.activations.shape[0], real_dset.activations.shape[0],
+        self._max_batch_size)
+    real_kernel_terms = self._get_real_kernel_terms(
+        real_dset.activations, num_blocks)
+    score, stderr = kid(fake_dset.activations, real_dset.activations,
+                        max_batch_size=self._max_batch_size,
+                        dtype=self._dtype, return_stderr=True,
+                        real_kernel_terms=real_kernel_terms)
+    logging.info("KID: %.5f (stderr %.5f).", score, stderr)
     return {self._LABEL: score}
 
 
+def get_num_blocks(n_gen, n_real, max_batch_size=1024):
+  """Returns the number of blocks used by the KID estimator."""
+  return int(np.ceil(max(n_real, n_gen) / max_batch_size))
+
+
+def _get_block_boundaries(num_examples, num_blocks):
+  """Splits into the largest approximately-equally-sized blocks."""
+  sizes = np.full(num_blocks, num_examples // num_blocks)
+  sizes[:num_examples % num_blocks] += 1
+  assert sizes.min() >= 2
+  return np.r_[0, np.cumsum(sizes)]
+
+
+def _cubic_kernel_inplace(k, dim):
+  """Applies the polynomial kernel (k / dim + 1)^3 in place."""
+  k /= dim
+  k += 1
+  np.power(k, 3, out=k)
+  return k
+
+
+def _mean_offdiagonal_kernel(x):
+  """Returns the mean of the off-diagonal entries of k(x, x)."""
+  m, dim = x.shape
+  syrk = scipy.linalg.blas.get_blas_funcs("syrk", dtype=x.dtype)
+  # x.T is Fortran contiguous, so BLAS reads x without a copy. syrk only
+  # fills the upper triangle, the lower one stays 0.
+  k = _cubic_kernel_inplace(syrk(alpha=1.0, a=x.T, trans=1), dim)
+  # After the polynomial the m * (m - 1) / 2 entries of the strict lower
+  # triangle are 1.
+  upper_sum = np.sum(k, dtype=np.float64) - m * (m - 1) / 2
+  return 2 * (upper_sum - np.trace(k, dtype=np.float64)) / (m * (m - 1))
+
+
+def _mean_kernel(x, y):
+  """Returns the mean of all entries of k(x, y)."""
+  k = _cubic_kernel_inplace(x.dot(y.T), x.shape[1])
+  return np.mean(k, dtype=np.float64)
+
+
+def compute_real_kernel_terms(real_activations, num_blocks,
+                              dtype=np.float32):
+  """Returns the mean off-diagonal real-real kernel value of each block.
+
+  These terms never change between evaluations of the same real data and can
+  be passed to kid() as `real_kernel_terms`.
+
+  Args:
+    real_activations: [batch, num_features] NumPy array with inception
+      features.
+    num_blocks: Number of blocks, see get_num_blocks().
+    dtype: Type used by the computations.
+
+  Returns:
+    NumPy array of shape [num_blocks].
+  """
+  real_activations = np.asarray(real_activations, dtype=dtype)
+  inds_r = _get_block_boundaries(real_activations.shape[0], num_blocks)
+  return np.array([
+      _mean_offdiagonal_kernel(real_activations[inds_r[i]:inds_r[i + 1]])
+      for i in range(num_blocks)
+  ])
+
+
 def kid(fake_activations,
         real_activations,
         max_batch_size=1024,
-        dtype=None,
-        return_stderr=False):
+        dtype=np.float32,
+        return_stderr=False,
+        real_kernel_terms=None):
   """Unbiased estimator of the Kernel Inception Distance.
 
   As defined by https://arxiv.org/abs/1801.01401.
@@ -60,90 +160,52 @@ def kid(fake_activations,
   provided code, but is also unbiased (and provides more-valid a variance
   estimate).
 
+  The kernel matrices of each block are computed with BLAS and the cubic
+  polynomial is applied in place. The real-real kernel only depends on the
+  real data, its terms can be precomputed with compute_real_kernel_terms().
+
   NOTE: the blocking code assumes that real_activations and
   fake_activations are in random order. If real_activations is sorted
   in a meaningful order, the estimator will be biased.
 
   Args:
-    fake_activations: [batch, num_features] tensor with inception features.
-    real_activations: [batch, num_features] tensor with inception features.
+    fake_activations: [batch, num_features] NumPy array with inception
+      features.
+    real_activations: [batch, num_features] NumPy array with inception
+      features.
     max_batch_size: Batches to compute the KID.
     dtype: Type used by the computations.
     return_stderr: If true, also returns the std_error from the KID computation.
+    real_kernel_terms: Optional output of compute_real_kernel_terms() for
+      `real_activations` and the same number of blocks.
 
   Returns:
     KID score (and optionally std error).
   """
-  real_activations.get_shape().assert_has_rank(2)
-  fake_activations.get_shape().assert_has_rank(2)
-
-  # need to know dimension for the kernel, and batch size to split things
-  real_activations.get_shape().assert_is_fully_defined()
-  fake_activations.get_shape().assert_is_fully_defined()
-
-  n_real, dim = real_activations.get_shape().as_list()
-  n_gen, dim2 = fake_activations.get_shape().as_list()
+  n_real, dim = real_activations.shape
+  n_gen, dim2 = fake_activations.shape
   assert dim2 == dim
 
-  # tensorflow_gan forces doubles for FID, but I don't think we need that here
-  if dtype is None:
-    dtype = real_activations.dtype
-    assert fake_activations.dtype == dtype
-  else:
-    real_activations = tf.cast(real_activations, dtype)
-    fake_activations = tf.cast(fake_activations, dtype)
-
-  # split into largest approximately-equally-sized blocks
-  n_bins = int(math.ceil(max(n_real, n_gen) / max_batch_size))
-  bins_r = np.full(n_bins, int(math.ceil(n_real / n_bins)))
-  bins_g = np.full(n_bins, int(math.ceil(n_gen / n_bins)))
-  bins_r[:(n_bins * bins_r[0]) - n_real] -= 1
-  bins_g[:(n_bins * bins_r[0]) - n_gen] -= 1
-  assert bins_r.min() >= 2
-  assert bins_g.min() >= 2
-
-  inds_r = tf.constant(np.r_[0, np.cumsum(bins_r)])
-  inds_g = tf.constant(np.r_[0, np.cumsum(bins_g)])
-
-  dim_ = tf.cast(dim, dtype)
-
-  def get_kid_batch(i):
-    """Computes KID on a given batch of features.
-
-    Takes real_activations[ind_r[i] : ind_r[i+1]] and
-    fake_activations[ind_g[i] : ind_g[i+1]].
-
-    Args:
-     i: is the index of the batch.
-
-    Returns:
-      KID for the given batch.
-    """
-    r_s = inds_r[i]
-    r_e = inds_r[i + 1]
-    r = real_activations[r_s:r_e]
-    m = tf.cast(r_e - r_s, dtype)
-
-    g_s = inds_g[i]
-    g_e = inds_g[i + 1]
-    g = fake_activations[g_s:g_e]
-    n = tf.cast(r_e - r_s, dtype)
-
-    # Could probably do this a bit faster...
-    k_rr = (tf.matmul(r, r, transpose_b=True) / dim_ + 1)**3
-    k_rg = (tf.matmul(r, g, transpose_b=True) / dim_ + 1)**3
-    k_gg = (tf.matmul(g, g, transpose_b=True) / dim_ + 1)**3
-    return (
-        -2 * tf.reduce_mean(k_rg) + (tf.reduce_sum(k_rr) - tf.trace(k_rr)) /
-        (m * (m - 1)) + (tf.reduce_sum(k_gg) - tf.trace(k_gg)) / (n * (n - 1)))
-
-  ests = tf.map_fn(
-      get_kid_batch, np.arange(n_bins), dtype=dtype, back_prop=False)
+  num_blocks = get_num_blocks(n_gen, n_real, max_batch_size)
+  if real_kernel_terms is None:
+    real_kernel_terms = compute_real_kernel_terms(
+        real_activations, num_blocks, dtype=dtype)
+  assert len(real_kernel_terms) == num_blocks
+  real_activations = np.asarray(real_activations, dtype=dtype)
+  fake_activations = np.asarray(fake_activations, dtype=dtype)
+  inds_r = _get_block_boundaries(n_real, num_blocks)
+  inds_g = _get_block_boundaries(n_gen, num_blocks)
+
+  ests = np.empty(num_blocks)
+  for i in range(num_blocks):
+    r = real_activations[inds_r[i]:inds_r[i + 1]]
+    g = fake_activations[inds_g[i]:inds_g[i + 1]]
+    ests[i] = (real_kernel_terms[i] + _mean_offdiagonal_kernel(g) -
+               2 * _mean_kernel(r, g))
 
   if return_stderr:
-    if n_bins < 5:
-      return tf.reduce_mean(ests), np.nan
-    mn, var = tf.nn.moments(ests, [0])
-    return mn, tf.sqrt(var / n_bins)
+    if num_blocks < 5:
+      return np.mean(ests), np.nan
+    return np.mean(ests), np.sqrt(np.var(ests) / num_blocks)
   else:
-    return tf.reduce_mean(ests)
+    return np.mean(ests)
@@ -0,0 +1,99 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the KID score."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from compare_gan import eval_utils
+from compare_gan.metrics import kid_score as kid_score_lib
+
+import mock
+import numpy as np
+import tensorflow as tf
+
+
+def _kid_reference(fake_activations, real_activations, num_blocks):
+  """Straightforward implementation of the block estimator."""
+  dim = real_activations.shape[1]
+  estimates = []
+  for r, g in zip(np.array_split(real_activations, num_blocks),
+                  np.array_split(fake_activations, num_blocks)):
+    k_rr = (r.dot(r.T) / dim + 1) ** 3
+    k_gg = (g.dot(g.T) / dim + 1) ** 3
+    k_rg = (r.dot(g.T) / dim + 1) ** 3
+    m, n = len(r), len(g)
+    estimates.append((k_rr.sum() - np.trace(k_rr)) / (m * (m - 1)) +
+                     (k_gg.sum() - np.trace(k_gg)) / (n * (n - 1)) -
+                     2 * k_rg.mean())
+  return np.mean(estimates), np.std(estimates) / np.sqrt(num_blocks)
+
+
+class KIDScoreTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(KIDScoreTest, self).setUp()
+    self.real_activations = np.random.normal(size=(1003, 16))
+    self.fake_activations = np.random.normal(loc=0.2, size=(990, 16))
+
+  def test_kid_matches_reference(self):
+    kid, stderr = kid_score_lib.kid(
+        self.fake_activations, self.real_activations, max_batch_size=100,
+        dtype=np.float64, return_stderr=True)
+    expected_kid, expected_stderr = _kid_reference(
+        self.fake_activations, self.real_activations, num_blocks=11)
+    self.assertAllClose(kid, expected_kid, rtol=1e-10)
+    self.assertAllClose(stderr, expected_stderr, rtol=1e-10)
+
+  def test_kid_float32(self):
+    kid = kid_score_lib.kid(
+        self.fake_activations, self.real_activations, max_batch_size=100)
+    expected_kid, _ = _kid_reference(
+        self.fake_activations, self.real_activations, num_blocks=11)
+    self.assertAllClose(kid, expected_kid, rtol=1e-4)
+
+  def test_kid_stderr_nan_for_few_blocks(self):
+    _, stderr = kid_score_lib.kid(
+        self.fake_activations, self.real_activations, return_stderr=True)
+    self.assertTrue(np.isnan(stderr))
+
+  def test_kid_task_reuses_real_kernel_terms(self):
+    real_dset = eval_utils.EvalDataSample(None)
+    real_dset.set_inception_features(
+        activations=self.real_activations, logits=None)
+    fake_dset = eval_utils.EvalDataSample(None)
+    fake_dset.set_inception_features(
+        activations=self.fake_activations, logits=None)
+    task = kid_score_lib.KIDScoreTask(max_batch_size=100, dtype=np.float64)
+    with mock.patch.object(
+        kid_score_lib, "compute_real_kernel_terms",
+        wraps=kid_score_lib.compute_real_kernel_terms) as mock_compute:
+      result = task.run_after_session(fake_dset, real_dset)
+      # A copy of the same real data, e.g. loaded from the cache.
+      real_dset.activations = np.copy(self.real_activations)
+      self.assertEqual(task.run_after_session(fake_dset, real_dset), result)
+      self.assertEqual(mock_compute.call_count, 1)
+      real_dset.activations = self.real_activations + 1.0
+      task.run_after_session(fake_dset, real_dset)
+      self.assertEqual(mock_compute.call_count, 2)
+    expected_kid, _ = _kid_reference(
+        self.fake_activations, self.real_activations, num_blocks=11)
+    self.assertAllClose(result["kid_score"], expected_kid, rtol=1e-10)
+
+
+if __name__ == "__main__":
+  tf.test.main()
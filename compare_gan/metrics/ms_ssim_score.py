@@ -25,46 +25,193 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+
 from absl import logging
 
 from compare_gan.metrics import eval_task
-from compare_gan.metrics import image_similarity
 
 import numpy as np
 from six.moves import range
-import tensorflow as tf
+from six.moves import zip
 
 
 class MultiscaleSSIMTask(eval_task.EvalTask):
   """Task that computes MSSIMScore for generated images."""
 
   _LABEL = "ms_ssim"
+  _REQUIRES_IMAGES = True
+  _REQUIRES_ACTIVATIONS = False
 
-  def run_after_session(self, options, eval_data_fake, eval_data_real=None):
-    del options, eval_data_real
-    score = _compute_multiscale_ssim_score(eval_data_fake.images)
+  def run_after_session(self, fake_dset, real_dset):
+    del real_dset
+    score = _compute_multiscale_ssim_score(fake_dset.images)
     return {self._LABEL: score}
 
 
-def _compute_multiscale_ssim_score(fake_images):
-  """Compute ms-ssim score ."""
-  batch_size = 64
-  with tf.Graph().as_default():
-    fake_images_batch = tf.train.shuffle_batch(
-        [tf.convert_to_tensor(fake_images, dtype=tf.float32)],
-        capacity=16*batch_size,
-        min_after_dequeue=8*batch_size,
-        num_threads=4,
-        enqueue_many=True,
-        batch_size=batch_size)
+def _compute_multiscale_ssim_score(fake_images, batch_size=64, num_batches=5,
+                                   seed=42):
+  """Compute ms-ssim score.
+
+  Following section 5.3 of https://arxiv.org/pdf/1710.08446.pdf, we only
+  evaluate 5 batches of the generated images. The batches are drawn with a
+  seeded permutation, so the same images are used for every evaluation.
+
+  Args:
+    fake_images: NumPy array of shape [num_images, height, width, channels]
+      with values in [0, 255].
+    batch_size: Number of images in each batch.
+    num_batches: Number of batches to evaluate.
+    seed: Seed for drawing the batches.
+
+  Returns:
+    The mean over the batches of the average MS-SSIM of all image pairs of a
+    batch.
+  """
+  num_images = fake_images.shape[0]
+  permutation = np.random.RandomState(seed).permutation(num_images)
+  scores = []
+  for i in range(num_batches):
+    # Wrap around the permutation so every batch has batch_size images.
+    start = (i * batch_size) % num_images
+    indices = np.sort(np.take(
+        permutation, range(start, start + batch_size), mode="wrap"))
+    scores.append(compute_mean_pairwise_msssim(fake_images[indices]))
+  return np.mean(scores)
+
+
+# Weights of the scales from Wang et al., see image_similarity.py.
+_MSSSIM_WEIGHTS = (.0448, 0.2856, 0.3001, 0.2363, 0.1333)
+_SSIM_K1 = 0.01
+_SSIM_K2 = 0.03
+
+# Precomputed terms of the images at a single scale of the pyramid. `means`
+# and `square_means` are the Gaussian filtered images and squared images.
+_Scale = collections.namedtuple(
+    "_Scale", ["images", "means", "square_means", "filter_weights"])
+
+
+def _gaussian_filter_weights(size, sigma):
+  """Returns the 1D factor of the 2D Gaussian filter (MATLAB's fspecial)."""
+  coords = np.arange(size, dtype=np.float64) - (size - 1) / 2.0
+  weights = np.exp(-0.5 * np.square(coords) / sigma**2)
+  return weights / np.sum(weights)
+
+
+def _filter_valid(images, filter_weights):
+  """Applies the separable filter to [N, H, W, C] images without padding."""
+  size = len(filter_weights)
+  height = images.shape[1] - size + 1
+  width = images.shape[2] - size + 1
+  rows = filter_weights[0] * images[:, :height]
+  for k in range(1, size):
+    rows += filter_weights[k] * images[:, k:k + height]
+  result = filter_weights[0] * rows[:, :, :width]
+  for k in range(1, size):
+    result += filter_weights[k] * rows[:, :, k:k + width]
+  return result
+
+
+def _downsample(images):
+  """Average pools [N, H, W, C] images by 2 with symmetric padding."""
+  padding = [(0, 0), (0, images.shape[1] % 2), (0, images.shape[2] % 2),
+             (0, 0)]
+  if any(p[1] for p in padding):
+    images = np.pad(images, padding, mode="symmetric")
+  return 0.25 * (images[:, 0::2, 0::2] + images[:, 1::2, 0::2] +
+                 images[:, 0::2, 1::2] + images[:, 1::2, 1::2])
+
+
+def compute_pyramids(images, num_scales=len(_MSSSIM_WEIGHTS), filter_size=11,
+                     filter_width=1.5, dtype=np.float32):
+  """Precomputes the per image terms of MS-SSIM for all scales.
+
+  Args:
+    images: NumPy array of shape [num_images, height, width, channels] with
+      values in [0, 255].
+    num_scales: Number of scales.
+    filter_size: Size of the Gaussian filter. It is reduced to the image size
+      for small scales.
+    filter_width: Standard deviation of the Gaussian filter.
+    dtype: Type used for the computations.
+
+  Returns:
+    List of `_Scale` tuples, one for each scale.
+  """
+  images = np.asarray(images, dtype=dtype)
+  pyramid = []
+  for k in range(num_scales):
+    if k > 0:
+      images = _downsample(images)
+    size = min(filter_size, images.shape[1], images.shape[2])
+    filter_weights = _gaussian_filter_weights(size, filter_width).astype(dtype)
+    pyramid.append(_Scale(
+        images=images,
+        means=_filter_valid(images, filter_weights),
+        square_means=_filter_valid(np.square(images), filter_weights),
+        filter_weights=filter_weights))
+  return pyramid
+
+
+def _pairwise_msssim(pyramid, indices1, indices2, max_val=255.0,
+                     power_factors=_MSSSIM_WEIGHTS):
+  """Returns the MS-SSIM of the image pairs (indices1[i], indices2[i])."""
+  c1 = (_SSIM_K1 * max_val)**2
+  c2 = (_SSIM_K2 * max_val)**2
+  mcs_and_ssim = []
+  for k, scale in enumerate(pyramid):
+    mean1 = scale.means[indices1]
+    mean2 = scale.means[indices2]
+    # The only term that depends on both images.
+    cross_means = _filter_valid(
+        scale.images[indices1] * scale.images[indices2],
+        scale.filter_weights)
+    num0 = 2.0 * mean1 * mean2
+    den0 = np.square(mean1) + np.square(mean2)
+    cs = ((2.0 * cross_means - num0 + c2) /
+          (scale.square_means[indices1] + scale.square_means[indices2] -
+           den0 + c2))
+    if k < len(pyramid) - 1:
+      mcs_and_ssim.append(np.maximum(np.mean(cs, axis=(1, 2)), 0.0))
+    else:
+      luminance = (num0 + c1) / (den0 + c1)
+      mcs_and_ssim.append(
+          np.maximum(np.mean(luminance * cs, axis=(1, 2)), 0.0))
+  # Weighted geometric mean across the scales, averaged over the channels.
+  ms_ssim = np.ones_like(mcs_and_ssim[0])
+  for value, power_factor in zip(mcs_and_ssim, power_factors):
+    ms_ssim *= np.power(value, power_factor)
+  return np.mean(ms_ssim, axis=-1)
+
+
+def compute_mean_pairwise_msssim(images, chunk_size=128, dtype=np.float32):
+  """Returns the average MS-SSIM of all pairs of distinct images.
+
+  The Gaussian filtered images of each scale are computed once per image,
+  each pair only needs to filter the product of the two images. The pairs
+  are processed in chunks, so the memory does not grow with the number of
+  pairs. This scales to thousands of images, e.g. all samples of a class.
 
-    # Following section 5.3 of https://arxiv.org/pdf/1710.08446.pdf, we only
-    # evaluate 5 batches of the generated images.
-    eval_fn = compute_msssim(
-        generated_images=fake_images_batch, num_batches=5)
-    with tf.train.MonitoredTrainingSession() as sess:
-      score = eval_fn(sess)
-  return score
+  Args:
+    images: NumPy array of shape [num_images, height, width, channels] with
+      values in [0, 255].
+    chunk_size: Number of pairs processed at once.
+    dtype: Type used for the computations.
+
+  Returns:
+    The average MS-SSIM. MS-SSIM is symmetric, so each unordered pair is
+    evaluated once.
+  """
+  num_images = images.shape[0]
+  assert num_images > 1
+  pyramid = compute_pyramids(images, dtype=dtype)
+  indices1, indices2 = np.triu_indices(num_images, k=1)
+  total = 0.0
+  for start in range(0, len(indices1), chunk_size):
+    end = start + chunk_size
+    total += np.sum(_pairwise_msssim(
+        pyramid, indices1[start:end], indices2[start:end]), dtype=np.float64)
+  return total / len(indices1)
 
 
 def compute_msssim(generated_images, num_batches):
@@ -83,20 +230,6 @@ def compute_msssim(generated_images, num_batches):
   batch_size = int(generated_images.get_shape()[0])
   assert batch_size > 1
 
-  # Generate all possible image pairs from input set of imgs.
-  pair1 = tf.tile(generated_images, [batch_size, 1, 1, 1])
-  pair2 = tf.reshape(
-      tf.tile(generated_images, [1, batch_size, 1, 1]), [
-          batch_size * batch_size, generated_images.shape[1],
-          generated_images.shape[2], generated_images.shape[3]
-      ])
-
-  # Compute the mean of the scores (but ignore the 'identical' images - which
-  # should get 1.0 from the MultiscaleSSIM)
-  score = tf.reduce_sum(image_similarity.multiscale_ssim(pair1, pair2))
-  score -= batch_size
-  score = tf.div(score, batch_size * batch_size - batch_size)
-
   # Define a function which wraps some session.run calls to generate a large
   # number of images and compute multiscale ssim metric on them.
   def _eval_fn(session):
@@ -104,7 +237,8 @@ def compute_msssim(generated_images, num_batches):
     logging.info("Computing MS-SSIM score...")
     scores = []
     for _ in range(num_batches):
-      scores.append(session.run(score))
+      scores.append(
+          compute_mean_pairwise_msssim(session.run(generated_images)))
 
     result = np.mean(scores)
     return result
@@ -19,7 +19,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+from compare_gan.metrics import image_similarity
 from compare_gan.metrics import ms_ssim_score
+import numpy as np
 import tensorflow as tf
 
 
@@ -39,6 +41,51 @@ class MsSsimScoreTest(tf.test.TestCase):
         result = metric(sess)
         self.assertNear(result, 0.989989, 0.001)
 
+  def test_pairwise_matches_image_similarity(self):
+    rng = np.random.RandomState(0)
+    base = rng.uniform(0, 255, size=(1, 37, 45, 3))
+    images = np.clip(base + rng.normal(0, 40, size=(5, 37, 45, 3)), 0, 255)
+    images = images.astype(np.float32)
+    indices1, indices2 = np.triu_indices(5, k=1)
+    with tf.Graph().as_default():
+      expected = image_similarity.multiscale_ssim(
+          tf.constant(images[indices1]), tf.constant(images[indices2]))
+      with self.session() as sess:
+        expected = np.mean(sess.run(expected))
+    for chunk_size in [1, 3, 128]:
+      result = ms_ssim_score.compute_mean_pairwise_msssim(
+          images, chunk_size=chunk_size)
+      self.assertNear(result, expected, 1e-4)
+
+  def test_batches_use_seeded_permutation(self):
+    rng = np.random.RandomState(0)
+    images = rng.uniform(0, 255, size=(20, 32, 32, 3)).astype(np.float32)
+    score1 = ms_ssim_score._compute_multiscale_ssim_score(
+        images, batch_size=8, num_batches=3, seed=1)
+    score2 = ms_ssim_score._compute_multiscale_ssim_score(
+        images, batch_size=8, num_batches=3, seed=1)
+    self.assertEqual(score1, score2)
+    indices = np.sort(np.random.RandomState(1).permutation(20)[:8])
+    self.assertNear(
+        ms_ssim_score._compute_multiscale_ssim_score(
+            images, batch_size=8, num_batches=1, seed=1),
+        ms_ssim_score.compute_mean_pairwise_msssim(images[indices]), 1e-6)
+
+  def test_batches_wrap_around_permutation(self):
+    rng = np.random.RandomState(0)
+    images = rng.uniform(0, 255, size=(20, 32, 32, 3)).astype(np.float32)
+    permutation = np.random.RandomState(1).permutation(20)
+    # The third batch starts at image 16 and wraps around to the start.
+    expected_scores = [
+        ms_ssim_score.compute_mean_pairwise_msssim(
+            images[np.sort(np.take(permutation, range(start, start + 8),
+                                   mode='wrap'))])
+        for start in [0, 8, 16]]
+    self.assertNear(
+        ms_ssim_score._compute_multiscale_ssim_score(
+            images, batch_size=8, num_batches=3, seed=1),
+        np.mean(expected_scores), 1e-6)
+
 
 if __name__ == '__main__':
   tf.test.main()
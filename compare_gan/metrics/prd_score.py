@@ -34,11 +34,111 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import hashlib
+import multiprocessing
+
+from absl import logging
+
+from compare_gan.metrics import eval_task
+from compare_gan.metrics import fid_score
+
 from matplotlib import pyplot as plt
 import numpy as np
 import sklearn.cluster
 
 
+class PRDTask(eval_task.EvalTask):
+  """Evaluation task for precision and recall for distributions.
+
+  Reports the maximum F_8 and F_{1/8} scores of the PRD curve, which
+  correlate with recall and precision respectively. The PCA projection and
+  the projected real activations only depend on the real data, they are
+  computed once and reused for all evaluations by this task object.
+  """
+
+  _F_BETA = 'prd_f8'
+  _F_BETA_INV = 'prd_f1_8'
+
+  def __init__(self, num_clusters=20, num_angles=1001, num_runs=10,
+               num_pca_components=None, num_workers=None, seed=0):
+    """Constructor.
+
+    Args:
+      num_clusters: Number of cluster centers to fit.
+      num_angles: Number of angles for which to compute PRD.
+      num_runs: Number of independent clusterings to average the PRD over.
+      num_pca_components: If set, the Inception activations are projected on
+        this many principal components of the real activations before the
+        clustering.
+      num_workers: Number of processes running the clusterings. Defaults to
+        the number of CPUs.
+      seed: Seed for the k-means initializations, so that every evaluation
+        of this task uses the same clusterings.
+    """
+    self._num_clusters = num_clusters
+    self._num_angles = num_angles
+    self._num_runs = num_runs
+    self._num_pca_components = num_pca_components
+    if num_workers is None:
+      num_workers = multiprocessing.cpu_count()
+    self._num_workers = num_workers
+    self._seed = seed
+    self._real_projection_cache = {}
+
+  def metric_list(self):
+    return frozenset([self._F_BETA, self._F_BETA_INV])
+
+  def _get_real_projection(self, real_activations):
+    """Returns the PCA projection (or None) and the projected real data."""
+    real_activations = np.ascontiguousarray(real_activations)
+    key = (hashlib.sha1(real_activations.data).hexdigest(),
+           real_activations.shape, self._num_pca_components)
+    if key not in self._real_projection_cache:
+      pca = None
+      if self._num_pca_components:
+        pca = fit_pca(real_activations, self._num_pca_components)
+        projected = apply_pca(pca, real_activations)
+      else:
+        projected = real_activations.astype(np.float32)
+      self._real_projection_cache[key] = (pca, projected)
+    return self._real_projection_cache[key]
+
+  def run_after_session(self, fake_dset, real_dset):
+    pca, ref_data = self._get_real_projection(real_dset.activations)
+    if pca is None:
+      eval_data = fake_dset.activations.astype(np.float32)
+    else:
+      eval_data = apply_pca(pca, fake_dset.activations)
+    precision, recall = compute_prd_from_embedding(
+        eval_data, ref_data, num_clusters=self._num_clusters,
+        num_angles=self._num_angles, num_runs=self._num_runs,
+        num_workers=self._num_workers, seed=self._seed)
+    f_beta, f_beta_inv = prd_to_max_f_beta_pair(precision, recall)
+    logging.info('PRD: F_8 %.5f, F_1/8 %.5f.', f_beta, f_beta_inv)
+    return {self._F_BETA: f_beta, self._F_BETA_INV: f_beta_inv}
+
+
+# Mean and principal directions (as columns, sorted by decreasing variance)
+# of a PCA.
+PCAProjection = collections.namedtuple('PCAProjection', ['mean', 'components'])
+
+
+def fit_pca(data, num_components):
+  """Fits a PCA with num_components components to the rows of data."""
+  mean, covariance = fid_score.compute_moments(data)
+  # eigh() returns the eigenvalues in ascending order.
+  _, eigenvectors = np.linalg.eigh(covariance)
+  components = eigenvectors[:, ::-1][:, :num_components]
+  return PCAProjection(mean=mean, components=components)
+
+
+def apply_pca(pca, data, dtype=np.float32):
+  """Projects the rows of data on the principal components."""
+  data = np.asarray(data, dtype=dtype)
+  return (data - pca.mean.astype(dtype)).dot(pca.components.astype(dtype))
+
+
 def compute_prd(eval_dist, ref_dist, num_angles=1001, epsilon=1e-10):
   """Computes the PRD curve for discrete distributions.
 
@@ -91,7 +191,7 @@ def compute_prd(eval_dist, ref_dist, num_angles=1001, epsilon=1e-10):
   return precision, recall
 
 
-def _cluster_into_bins(eval_data, ref_data, num_clusters):
+def _cluster_into_bins(eval_data, ref_data, num_clusters, random_state=None):
   """Clusters the union of the data points and returns the cluster distribution.
 
   Clusters the union of eval_data and ref_data into num_clusters using minibatch
@@ -102,6 +202,7 @@ def _cluster_into_bins(eval_data, ref_data, num_clusters):
     eval_data: NumPy array of data points from the distribution to be evaluated.
     ref_data: NumPy array of data points from the reference distribution.
     num_clusters: Number of cluster centers to fit.
+    random_state: Seed for the k-means initialization.
 
   Returns:
     Two NumPy arrays, each of size num_clusters, where i-th entry represents the
@@ -109,11 +210,19 @@ def _cluster_into_bins(eval_data, ref_data, num_clusters):
   """
 
   cluster_data = np.vstack([eval_data, ref_data])
-  kmeans = sklearn.cluster.MiniBatchKMeans(n_clusters=num_clusters, n_init=10)
+  return _cluster_stacked_into_bins(cluster_data, len(eval_data), num_clusters,
+                                    random_state)
+
+
+def _cluster_stacked_into_bins(cluster_data, num_eval, num_clusters,
+                               random_state=None):
+  """As _cluster_into_bins() for the stacked eval_data and ref_data."""
+  kmeans = sklearn.cluster.MiniBatchKMeans(n_clusters=num_clusters, n_init=10,
+                                           random_state=random_state)
   labels = kmeans.fit(cluster_data).labels_
 
-  eval_labels = labels[:len(eval_data)]
-  ref_labels = labels[len(eval_data):]
+  eval_labels = labels[:num_eval]
+  ref_labels = labels[num_eval:]
 
   eval_bins = np.histogram(eval_labels, bins=num_clusters,
                            range=[0, num_clusters], density=True)[0]
@@ -122,9 +231,52 @@ def _cluster_into_bins(eval_data, ref_data, num_clusters):
   return eval_bins, ref_bins
 
 
+# Arguments of _cluster_stacked_into_bins() shared by all runs in a worker.
+_worker_cluster_args = None
+
+
+def _init_cluster_worker(cluster_data, num_eval, num_clusters):
+  global _worker_cluster_args
+  _worker_cluster_args = (cluster_data, num_eval, num_clusters)
+
+
+def _cluster_in_worker(random_state):
+  return _cluster_stacked_into_bins(*_worker_cluster_args,
+                                    random_state=random_state)
+
+
+def _cluster_runs_into_bins(cluster_data, num_eval, num_clusters,
+                            random_states, num_workers):
+  """Runs _cluster_stacked_into_bins() for each seed in random_states."""
+  num_workers = min(num_workers, len(random_states))
+  if num_workers > 1 and multiprocessing.current_process().daemon:
+    # Daemonic processes (e.g. the evaluation workers in runner_lib) cannot
+    # have children.
+    logging.info('Running the PRD clusterings sequentially in a daemon.')
+    num_workers = 1
+  if num_workers <= 1:
+    return [
+        _cluster_stacked_into_bins(cluster_data, num_eval, num_clusters,
+                                   random_state)
+        for random_state in random_states
+    ]
+  # The workers are spawned since forking a process that runs TensorFlow
+  # sessions is not safe. Each worker receives a copy of the clustered data.
+  pool = multiprocessing.get_context('spawn').Pool(
+      processes=num_workers,
+      initializer=_init_cluster_worker,
+      initargs=(cluster_data, num_eval, num_clusters))
+  try:
+    return pool.map(_cluster_in_worker, random_states)
+  finally:
+    pool.terminate()
+    pool.join()
+
+
 def compute_prd_from_embedding(eval_data, ref_data, num_clusters=20,
                                num_angles=1001, num_runs=10,
-                               enforce_balance=True):
+                               enforce_balance=True, num_pca_components=None,
+                               num_workers=1, dtype=np.float32, seed=None):
   """Computes PRD data from sample embeddings.
 
   The points from both distributions are mixed and then clustered. This leads
@@ -145,6 +297,13 @@ def compute_prd_from_embedding(eval_data, ref_data, num_clusters=20,
     num_runs: Number of independent runs over which to average the PRD data.
     enforce_balance: If enabled, throws exception if eval_data and ref_data do
                      not have the same length. The default value is True.
+    num_pca_components: If set, the points are projected on this many
+                        principal components of ref_data before clustering.
+    num_workers: Number of processes running the independent runs. The
+                 default value is 1.
+    dtype: Type of the clustered points. The default value is float32.
+    seed: Seed for the k-means initializations. The default value is None,
+          i.e. the runs are not reproducible.
 
   Returns:
     precision: NumPy array of shape [num_angles] with the precision for the
@@ -163,12 +322,21 @@ def compute_prd_from_embedding(eval_data, ref_data, num_clusters=20,
         'points in ref_data %d. To disable this exception, set enforce_balance '
         'to False (not recommended).' % (len(eval_data), len(ref_data)))
 
-  eval_data = np.array(eval_data, dtype=np.float64)
-  ref_data = np.array(ref_data, dtype=np.float64)
+  if num_pca_components:
+    pca = fit_pca(ref_data, num_pca_components)
+    eval_data = apply_pca(pca, eval_data, dtype=dtype)
+    ref_data = apply_pca(pca, ref_data, dtype=dtype)
+  # The points are stacked once and shared by all runs.
+  cluster_data = np.vstack([np.asarray(eval_data, dtype=dtype),
+                            np.asarray(ref_data, dtype=dtype)])
+  # Every run needs its own seed, forked workers share the global NumPy state.
+  random_states = np.random.RandomState(seed).randint(
+      np.iinfo(np.int32).max, size=num_runs)
+  bins = _cluster_runs_into_bins(cluster_data, len(eval_data), num_clusters,
+                                 list(random_states), num_workers)
   precisions = []
   recalls = []
-  for _ in range(num_runs):
-    eval_dist, ref_dist = _cluster_into_bins(eval_data, ref_data, num_clusters)
+  for eval_dist, ref_dist in bins:
     precision, recall = compute_prd(eval_dist, ref_dist, num_angles)
     precisions.append(precision)
     recalls.append(recall)
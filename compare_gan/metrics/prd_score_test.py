@@ -19,6 +19,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
 import unittest
 from compare_gan.metrics import prd_score as prd
 import numpy as np
@@ -104,6 +105,48 @@ class PRDTest(unittest.TestCase):
           'compute_prd_from_embedding should not raise a ValueError when '
           'enforce_balance is set to False.')
 
+  def test_compute_prd_from_embedding_pool_matches_sequential(self):
+    rng = np.random.RandomState(0)
+    eval_data = rng.normal(size=[200, 16])
+    ref_data = rng.normal(size=[200, 16]) + 0.5
+    sequential = prd.compute_prd_from_embedding(
+        eval_data, ref_data, num_runs=4, num_workers=1, seed=1)
+    parallel = prd.compute_prd_from_embedding(
+        eval_data, ref_data, num_runs=4, num_workers=3, seed=1)
+    np.testing.assert_allclose(parallel, sequential)
+
+  def test_fit_pca(self):
+    rng = np.random.RandomState(0)
+    data = rng.normal(size=[500, 3]) * [[10, 3, 0.1]] + [[1, 2, 3]]
+    pca = prd.fit_pca(data, 2)
+    np.testing.assert_allclose(pca.mean, np.mean(data, axis=0))
+    np.testing.assert_allclose(np.abs(pca.components), [[1, 0], [0, 1], [0, 0]],
+                               atol=0.05)
+    projected = prd.apply_pca(pca, data)
+    self.assertEqual(projected.shape, (500, 2))
+    self.assertEqual(projected.dtype, np.float32)
+    np.testing.assert_allclose(np.mean(projected, axis=0), 0, atol=1e-4)
+
+  def test_prd_task_caches_real_projection(self):
+    rng = np.random.RandomState(0)
+    dset = collections.namedtuple('EvalDataSample', ['activations'])
+    fake_dset = dset(rng.normal(size=[100, 8]))
+    real_dset = dset(rng.normal(size=[100, 8]))
+    task = prd.PRDTask(num_runs=2, num_pca_components=4, num_workers=1)
+    for _ in range(2):
+      result = task.run_after_session(fake_dset, real_dset)
+      self.assertEqual(set(result.keys()), task.metric_list())
+      self.assertEqual(len(task._real_projection_cache), 1)
+
+  def test_prd_task_is_reproducible(self):
+    rng = np.random.RandomState(0)
+    dset = collections.namedtuple('EvalDataSample', ['activations'])
+    fake_dset = dset(rng.normal(size=[100, 8]))
+    real_dset = dset(rng.normal(size=[100, 8]))
+    result1 = prd.PRDTask(num_runs=2).run_after_session(fake_dset, real_dset)
+    result2 = prd.PRDTask(num_runs=2).run_after_session(fake_dset, real_dset)
+    self.assertEqual(result1, result2)
+
   def test__prd_to_f_beta_correct_computation(self):
     precision = np.array([1, 1, 0, 0, 0.5, 1, 0.5])
     recall = np.array([1, 0, 1, 0, 0.5, 0.5, 1])
@@ -20,18 +20,23 @@ from __future__ import division
 from __future__ import print_function
 
 import csv
+import multiprocessing
 import os
 import re
+import threading
 import time
 
 from absl import flags
 from absl import logging
 from compare_gan import datasets
 from compare_gan import eval_gan_lib
+from compare_gan import eval_utils
 from compare_gan import hooks
 from compare_gan.gans import utils
 from compare_gan.metrics import fid_score as fid_score_lib
+from compare_gan.metrics import fractal_dimension as fractal_dimension_lib
 from compare_gan.metrics import inception_score as inception_score_lib
+from compare_gan.metrics import prd_score as prd_score_lib
 import gin.tf
 import numpy as np
 import six
@@ -40,6 +45,15 @@ import tensorflow as tf
 
 FLAGS = flags.FLAGS
 
+# Defined here (and not in main.py) because the evaluation workers restore the
+# Gin config from them.
+flags.DEFINE_multi_string(
+    "gin_config", [],
+    "List of paths to the config files.")
+flags.DEFINE_multi_string(
+    "gin_bindings", [],
+    "Newline separated list of Gin parameter bindings.")
+
 
 class _DummyParserDelegate(gin.config_parser.ParserDelegate):
   """Dummy class required to parse Gin configs.
@@ -241,41 +255,89 @@ class TaskManagerWithCsvResults(TaskManager):
     return set()
 
 
-def _run_eval(module_spec, checkpoints, task_manager, run_config,
-              use_tpu, num_averaging_runs):
-  """Evaluates the given checkpoints and add results to a result writer.
-
-  Args:
-    module_spec: `ModuleSpec` of the model.
-    checkpoints: Generator for for checkpoint paths.
-    task_manager: `TaskManager`. init_eval() will be called before adding
-      results.
-    run_config: `RunConfig` to use. Values for master and tpu_config are
-      currently ignored.
-    use_tpu: Whether to use TPU for evaluation.
-    num_averaging_runs: Determines how many times each metric is computed.
-  """
-  # By default, we compute FID and Inception scores. Other tasks defined in
-  # the metrics folder (such as the one in metrics/kid_score.py) can be added
-  # to this list if desired.
-  eval_tasks = [
+def _get_eval_tasks():
+  # By default, we compute FID and Inception scores, precision and recall for
+  # distributions and the fractal dimension of the Inception features
+  # (computing it on the pixels would require to keep all generated images in
+  # memory). Other tasks defined in the metrics folder (such as the one in
+  # metrics/kid_score.py) can be added to this list if desired.
+  return [
       inception_score_lib.InceptionScoreTask(),
-      fid_score_lib.FIDScoreTask()
+      fid_score_lib.FIDScoreTask(),
+      prd_score_lib.PRDTask(),
+      fractal_dimension_lib.FractalDimensionTask(use_inception_features=True),
   ]
-  logging.info("eval_tasks: %s", eval_tasks)
 
-  for checkpoint_path in checkpoints:
+
+class _CheckpointEvalRunner(object):
+  """Evaluates single checkpoints of a GAN.
+
+  By default the generator graph is built once and every checkpoint is
+  restored into it. If `export_tfhub_modules` is set, each checkpoint is
+  exported as TF Hub module to model_dir/tfhub/<step> and evaluated from
+  there.
+  """
+
+  def __init__(self, gan, model_dir, use_tpu, num_averaging_runs,
+               inception_extractor, export_tfhub_modules=False,
+               session_config=None):
+    """Constructor.
+
+    Args:
+      gan: GAN object (e.g. `ModularGAN`) that was used for training.
+      model_dir: Model directory. TF Hub modules are exported to a
+        subdirectory.
+      use_tpu: Whether to use TPU for evaluation.
+      num_averaging_runs: Determines how many times each metric is computed.
+      inception_extractor: `eval_utils.InceptionFeatureExtractor` to use.
+      export_tfhub_modules: Whether to export and evaluate TF Hub modules.
+      session_config: Optional `tf.ConfigProto` for the generator session.
+    """
+    self._gan = gan
+    self._model_dir = model_dir
+    self._use_tpu = use_tpu
+    self._num_averaging_runs = num_averaging_runs
+    self._inception_extractor = inception_extractor
+    self._session_config = session_config
+    self._eval_tasks = _get_eval_tasks()
+    logging.info("eval_tasks: %s", self._eval_tasks)
+    if export_tfhub_modules:
+      self._module_spec = gan.as_module_spec()
+      self._checkpoint_evaluator = None
+    else:
+      self._module_spec = None
+      self._checkpoint_evaluator = eval_gan_lib.CheckpointEvaluator(
+          gan, use_tpu=use_tpu, session_config=session_config)
+
+  def _evaluate_tfhub_module(self, checkpoint_path):
     step = os.path.basename(checkpoint_path).split("-")[-1]
-    if step == 0:
-      continue
-    export_path = os.path.join(run_config.model_dir, "tfhub", str(step))
+    export_path = os.path.join(self._model_dir, "tfhub", str(step))
     if not tf.gfile.Exists(export_path):
-      module_spec.export(export_path, checkpoint_path=checkpoint_path)
+      self._module_spec.export(export_path, checkpoint_path=checkpoint_path)
+    return eval_gan_lib.evaluate_tfhub_module(
+        export_path, self._eval_tasks, use_tpu=self._use_tpu,
+        num_averaging_runs=self._num_averaging_runs,
+        inception_extractor=self._inception_extractor,
+        session_config=self._session_config)
+
+  def evaluate(self, checkpoint_path):
+    """Evaluates a single checkpoint.
+
+    Args:
+      checkpoint_path: Path of the checkpoint to evaluate.
+
+    Returns:
+      Tuple (result_dict, default_value) for TaskManager.add_eval_result().
+    """
     default_value = -1.0
     try:
-      result_dict = eval_gan_lib.evaluate_tfhub_module(
-          export_path, eval_tasks, use_tpu=use_tpu,
-          num_averaging_runs=num_averaging_runs)
+      if self._checkpoint_evaluator is None:
+        result_dict = self._evaluate_tfhub_module(checkpoint_path)
+      else:
+        result_dict = self._checkpoint_evaluator.evaluate(
+            checkpoint_path, self._eval_tasks,
+            num_averaging_runs=self._num_averaging_runs,
+            inception_extractor=self._inception_extractor)
     except ValueError as nan_found_error:
       result_dict = {}
       logging.exception(nan_found_error)
@@ -283,11 +345,183 @@ def _run_eval(module_spec, checkpoints, task_manager, run_config,
 
     logging.info("Evaluation result for checkpoint %s: %s (default value: %s)",
                  checkpoint_path, result_dict, default_value)
+    return result_dict, default_value
+
+
+# _CheckpointEvalRunner of an evaluation worker process. Set by
+# _init_eval_worker().
+_eval_worker_runner = None
+
+
+def _init_eval_worker(flags_string, options, model_dir, inception_graph_def,
+                      num_averaging_runs, export_tfhub_modules, num_threads):
+  """Initializes the state of an evaluation worker process.
+
+  Workers are spawned and start with a fresh interpreter. The flag values of
+  the parent are restored, the Gin config is parsed from the restored
+  --gin_config and --gin_bindings and the GAN is rebuilt from them.
+
+  Args:
+    flags_string: Flag values of the parent, see `flags_into_string()`.
+    options: Python dictionary with the run options, see get_options_dict().
+    model_dir: Directory with the checkpoints.
+    inception_graph_def: Serialized Inception `GraphDef` of the parent.
+    num_averaging_runs: Determines how many times each metric is computed.
+    export_tfhub_modules: Whether to export and evaluate TF Hub modules.
+    num_threads: If set, number of intra and inter op threads of the sessions.
+  """
+  global _eval_worker_runner
+  FLAGS(["eval_worker"] + flags_string.splitlines(), known_only=True)
+  gin.parse_config_files_and_bindings(FLAGS.gin_config, FLAGS.gin_bindings)
+  eval_utils.set_inception_graph_def(
+      tf.GraphDef.FromString(inception_graph_def))
+  gan = options["gan_class"](dataset=datasets.get_dataset(),
+                             parameters=options,
+                             model_dir=model_dir)
+  # Each worker runs Inception in its own session.
+  inception_extractor = eval_utils.InceptionFeatureExtractor(
+      intra_op_parallelism_threads=num_threads,
+      inter_op_parallelism_threads=num_threads)
+  _eval_worker_runner = _CheckpointEvalRunner(
+      gan, model_dir,
+      use_tpu=False,
+      num_averaging_runs=num_averaging_runs,
+      inception_extractor=inception_extractor,
+      export_tfhub_modules=export_tfhub_modules,
+      session_config=eval_utils.get_session_config(
+          intra_op_parallelism_threads=num_threads,
+          inter_op_parallelism_threads=num_threads))
+
+
+def _evaluate_checkpoint_in_worker(checkpoint_path):
+  result_dict, default_value = _eval_worker_runner.evaluate(checkpoint_path)
+  return checkpoint_path, result_dict, default_value
+
+
+def _run_eval(gan, checkpoints, task_manager, run_config,
+              use_tpu, num_averaging_runs, export_tfhub_modules=False,
+              num_workers=1, num_threads_per_worker=0, options=None):
+  """Evaluates the given checkpoints and add results to a result writer.
+
+  Args:
+    gan: GAN object (e.g. `ModularGAN`) that was used for training.
+    checkpoints: Generator for for checkpoint paths.
+    task_manager: `TaskManager`. init_eval() will be called before adding
+      results.
+    run_config: `RunConfig` to use. Values for master and tpu_config are
+      currently ignored.
+    use_tpu: Whether to use TPU for evaluation.
+    num_averaging_runs: Determines how many times each metric is computed.
+    export_tfhub_modules: If True each checkpoint is exported as TF Hub
+      module to model_dir/tfhub/<step> and evaluated from there. Otherwise
+      the checkpoints are restored directly into the generator graph.
+    num_workers: Number of checkpoints evaluated in parallel. If larger than
+      1, checkpoints are evaluated by a pool of worker processes and the
+      results are written by this process in the order they are completed.
+    num_threads_per_worker: If set, number of intra and inter op threads for
+      the generator and Inception sessions of each worker.
+    options: Python dictionary with the options used to create `gan`.
+      Required if `num_workers` is larger than 1.
+  """
+  if num_workers > 1:
+    if use_tpu:
+      raise ValueError("Parallel evaluation is not supported on TPUs.")
+    _run_eval_in_pool(options, checkpoints, task_manager, run_config,
+                      num_averaging_runs, export_tfhub_modules, num_workers,
+                      num_threads_per_worker)
+    return
+
+  # Load the Inception graph once for all checkpoints.
+  runner = _CheckpointEvalRunner(
+      gan, run_config.model_dir,
+      use_tpu=use_tpu,
+      num_averaging_runs=num_averaging_runs,
+      inception_extractor=eval_utils.get_inception_feature_extractor(),
+      export_tfhub_modules=export_tfhub_modules,
+      session_config=eval_utils.get_generator_session_config())
+  for checkpoint_path in checkpoints:
+    result_dict, default_value = runner.evaluate(checkpoint_path)
     task_manager.add_eval_result(checkpoint_path, result_dict, default_value)
 
 
+def _run_eval_in_pool(options, checkpoints, task_manager, run_config,
+                      num_averaging_runs, export_tfhub_modules, num_workers,
+                      num_threads_per_worker):
+  """Evaluates checkpoints with a pool of worker processes.
+
+  Workers are spawned (not forked, this process may already run TensorFlow
+  threads) and rebuild the GAN from the flags and the options of this process.
+  Each worker owns its generator session and Inception extractor.
+
+  Only this thread reads `checkpoints`, and at most `num_workers` checkpoints
+  are submitted at a time. Results are written to `task_manager` by the result
+  handler thread of the pool as soon as an evaluation finishes, also while
+  this thread waits for the next checkpoint.
+
+  Args:
+    options: Python dictionary with the options used to create the GAN.
+    checkpoints: Generator for for checkpoint paths.
+    task_manager: `TaskManager` to add the results to.
+    run_config: `RunConfig` to use.
+    num_averaging_runs: Determines how many times each metric is computed.
+    export_tfhub_modules: Whether to export and evaluate TF Hub modules.
+    num_workers: Number of worker processes.
+    num_threads_per_worker: If set, number of intra and inter op threads for
+      the sessions of each worker.
+
+  Raises:
+    Exception: The first error raised by an evaluation or by writing its
+      result.
+  """
+  logging.info("Evaluating checkpoints with %d worker processes.",
+               num_workers)
+  pool = multiprocessing.get_context("spawn").Pool(
+      processes=num_workers,
+      initializer=_init_eval_worker,
+      initargs=(FLAGS.flags_into_string(), options, run_config.model_dir,
+                eval_utils.get_inception_graph_def().SerializeToString(),
+                num_averaging_runs, export_tfhub_modules,
+                num_threads_per_worker))
+  # Released whenever a submitted evaluation finished.
+  free_workers = threading.Semaphore(num_workers)
+  errors = []
+
+  def write_result(result):
+    # Called in the single result handler thread of the pool, which is the
+    # only thread writing to the task manager.
+    try:
+      task_manager.add_eval_result(*result)
+    except Exception as e:  # pylint: disable=broad-except
+      errors.append(e)
+    finally:
+      free_workers.release()
+
+  def record_error(error):
+    errors.append(error)
+    free_workers.release()
+
+  try:
+    for checkpoint_path in checkpoints:
+      free_workers.acquire()
+      if errors:
+        break
+      pool.apply_async(
+          _evaluate_checkpoint_in_worker, (checkpoint_path,),
+          callback=write_result, error_callback=record_error)
+    pool.close()
+    # Waits until all submitted evaluations finished and were written.
+    pool.join()
+    if errors:
+      raise errors[0]
+  finally:
+    pool.terminate()
+    pool.join()
+
+
 def run_with_schedule(schedule, run_config, task_manager, options, use_tpu,
-                      num_eval_averaging_runs=1, eval_every_steps=-1):
+                      num_eval_averaging_runs=1, eval_every_steps=-1,
+                      export_tfhub_modules=False, num_eval_workers=1,
+                      num_eval_threads_per_worker=0):
   """Run the schedule with the given options.
 
   Available schedules:
@@ -307,6 +541,11 @@ def run_with_schedule(schedule, run_config, task_manager, options, use_tpu,
     use_tpu: Boolean whether to use TPU.
     num_eval_averaging_runs: Determines how many times each metric is computed.
     eval_every_steps: Integer determining which checkpoints to evaluate.
+    export_tfhub_modules: If True, export every evaluated checkpoint as TF Hub
+      module and evaluate the module.
+    num_eval_workers: Number of checkpoints evaluated in parallel processes.
+    num_eval_threads_per_worker: If set, number of intra and inter op threads
+      used by each evaluation worker.
   """
   logging.info("Running schedule '%s' with options: %s", schedule, options)
   if run_config.tf_random_seed:
@@ -355,9 +594,13 @@ def run_with_schedule(schedule, run_config, task_manager, options, use_tpu,
         eval_every_steps=eval_every_steps)
   if schedule in {"continuous_eval", "eval_after_train"}:
     _run_eval(
-        gan.as_module_spec(),
+        gan,
         checkpoints=checkpoints,
         task_manager=task_manager,
         run_config=run_config,
         use_tpu=use_tpu,
-        num_averaging_runs=num_eval_averaging_runs)
+        num_averaging_runs=num_eval_averaging_runs,
+        export_tfhub_modules=export_tfhub_modules,
+        num_workers=num_eval_workers,
+        num_threads_per_worker=num_eval_threads_per_worker,
+        options=options)
@@ -26,7 +26,6 @@ from absl import logging
 from absl.testing import flagsaver
 from absl.testing import parameterized
 
-from compare_gan import eval_gan_lib
 from compare_gan import runner_lib
 from compare_gan import test_utils
 from compare_gan.architectures import arch_ops
@@ -147,10 +146,11 @@ class RunnerLibTest(parameterized.TestCase, test_utils.CompareGanTestCase):
       self.assertAllClose(t0, t1, msg=name)
 
   @parameterized.parameters([
-      {"use_tpu": False},
+      {"use_tpu": False, "export_tfhub_modules": False},
+      {"use_tpu": False, "export_tfhub_modules": True},
       # {"use_tpu": True},
   ])
-  def testTrainAndEval(self, use_tpu):
+  def testTrainAndEval(self, use_tpu, export_tfhub_modules):
     gin.bind_parameter("dataset.name", "cifar10")
     options = {
         "architecture": "resnet_cifar_arch",
@@ -173,13 +173,52 @@ class RunnerLibTest(parameterized.TestCase, test_utils.CompareGanTestCase):
         options=options,
         use_tpu=use_tpu,
         num_eval_averaging_runs=1,
-        eval_every_steps=None)
+        eval_every_steps=None,
+        export_tfhub_modules=export_tfhub_modules)
     expected_files = [
         "TRAIN_DONE", "checkpoint", "model.ckpt-0.data-00000-of-00001",
         "model.ckpt-0.index", "model.ckpt-0.meta",
         "model.ckpt-1.data-00000-of-00001", "model.ckpt-1.index",
-        "model.ckpt-1.meta", "operative_config-0.gin", "tfhub"]
-    self.assertAllInSet(expected_files, tf.gfile.ListDirectory(model_dir))
+        "model.ckpt-1.meta", "operative_config-0.gin"]
+    if export_tfhub_modules:
+      expected_files.append("tfhub")
+    model_dir_files = tf.gfile.ListDirectory(model_dir)
+    self.assertAllInSet(expected_files, model_dir_files)
+    self.assertEqual(export_tfhub_modules, "tfhub" in model_dir_files)
+
+  # The workers parse the Gin config from the flags.
+  @flagsaver.flagsaver(gin_bindings=["dataset.name = 'cifar10'"])
+  def testTrainAndEvalWithEvalWorkers(self):
+    gin.bind_parameter("dataset.name", "cifar10")
+    options = {
+        "architecture": "resnet_cifar_arch",
+        "batch_size": 2,
+        "disc_iters": 1,
+        "gan_class": ModularGAN,
+        "lambda": 1,
+        "training_steps": 2,
+        "z_dim": 128,
+    }
+    model_dir = self._get_empty_model_dir()
+    run_config = tf.contrib.tpu.RunConfig(
+        model_dir=model_dir,
+        save_checkpoints_steps=1,
+        tpu_config=tf.contrib.tpu.TPUConfig(iterations_per_loop=1))
+    task_manager = runner_lib.TaskManagerWithCsvResults(model_dir)
+    runner_lib.run_with_schedule(
+        "eval_after_train",
+        run_config=run_config,
+        task_manager=task_manager,
+        options=options,
+        use_tpu=False,
+        num_eval_averaging_runs=1,
+        eval_every_steps=None,
+        num_eval_workers=2,
+        num_eval_threads_per_worker=1)
+    checkpoints = tf.train.get_checkpoint_state(
+        model_dir).all_model_checkpoint_paths
+    self.assertSetEqual(
+        set(checkpoints), task_manager.get_checkpoints_with_results())
 
   def testTrainAndEvalWithSpectralNormAndEma(self):
     gin.bind_parameter("dataset.name", "cifar10")
@@ -211,7 +250,7 @@ class RunnerLibTest(parameterized.TestCase, test_utils.CompareGanTestCase):
         "TRAIN_DONE", "checkpoint", "model.ckpt-0.data-00000-of-00001",
         "model.ckpt-0.index", "model.ckpt-0.meta",
         "model.ckpt-1.data-00000-of-00001", "model.ckpt-1.index",
-        "model.ckpt-1.meta", "operative_config-0.gin", "tfhub"]
+        "model.ckpt-1.meta", "operative_config-0.gin"]
     self.assertAllInSet(expected_files, tf.gfile.ListDirectory(model_dir))
 
   def testTrainAndEvalWithBatchNormAccu(self):
@@ -232,13 +271,9 @@ class RunnerLibTest(parameterized.TestCase, test_utils.CompareGanTestCase):
         model_dir=model_dir,
         tpu_config=tf.contrib.tpu.TPUConfig(iterations_per_loop=1))
     task_manager = runner_lib.TaskManager(model_dir)
-    # Wrap _UpdateBnAccumulators to only perform one accumulator update step.
-    # Otherwise the test case would time out.
-    orig_update_bn_accumulators = eval_gan_lib._update_bn_accumulators
-    def mock_update_bn_accumulators(sess, generated, num_accu_examples):
-      del num_accu_examples
-      return orig_update_bn_accumulators(sess, generated, num_accu_examples=64)
-    eval_gan_lib._update_bn_accumulators = mock_update_bn_accumulators
+    # Only perform one accumulator update step. Otherwise the test case would
+    # time out.
+    gin.bind_parameter("bn_accumulators.max_examples", 64)
     runner_lib.run_with_schedule(
         "eval_after_train",
         run_config=run_config,
@@ -246,7 +281,8 @@ class RunnerLibTest(parameterized.TestCase, test_utils.CompareGanTestCase):
         options=options,
         use_tpu=False,
         num_eval_averaging_runs=1,
-        eval_every_steps=None)
+        eval_every_steps=None,
+        export_tfhub_modules=True)
     expected_tfhub_files = [
         "checkpoint", "model-with-accu.ckpt.data-00000-of-00001",
         "model-with-accu.ckpt.index", "model-with-accu.ckpt.meta"]
@@ -63,19 +63,34 @@ def add_random_offset_to_features(dataset, start=1):
     A new `tf.data.Dataset` object with a extra feature for the random offset.
   """
   dataset = dataset.apply(tf.data.experimental.enumerate_dataset(start=start))
-  def map_fn(offset, data):
-    offset = tf.cast(offset, tf.int32)
-    if isinstance(data, tuple) and len(data) == 2 and isinstance(data[0], dict):
-      # Data is a tuple (features, labels) as expected by the Estimator
-      # interface.
-      logging.info("Passing random offset: %s with data %s.", offset, data)
-      features, labels = data
-      features[_RANDOM_OFFSET_FEATURE_KEY] = offset
-      return features, labels
-    raise ValueError("Data in dataset must be a tuple (features, labels) and "
-                     "features must be a Python dictionary. data was {}".format(
-                         data))
-  return dataset.map(map_fn)
+  return dataset.map(add_random_offset_to_example)
+
+
+def add_random_offset_to_example(offset, data):
+  """Adds the random offset to a single example.
+
+  Can be used inside a map function on a dataset enumerated with
+  `tf.data.experimental.enumerate_dataset()`, e.g. to fuse it with other
+  per-example functions.
+
+  Args:
+    offset: Scalar integer Tensor with the offset.
+    data: Tuple (features, labels), where `features` is a Python dictionary.
+
+  Returns:
+    The tuple (features, labels) with an extra feature for the random offset.
+  """
+  offset = tf.cast(offset, tf.int32)
+  if isinstance(data, tuple) and len(data) == 2 and isinstance(data[0], dict):
+    # Data is a tuple (features, labels) as expected by the Estimator
+    # interface.
+    logging.info("Passing random offset: %s with data %s.", offset, data)
+    features, labels = data
+    features[_RANDOM_OFFSET_FEATURE_KEY] = offset
+    return features, labels
+  raise ValueError("Data in dataset must be a tuple (features, labels) and "
+                   "features must be a Python dictionary. data was {}".format(
+                       data))
 
 
 def set_random_offset_from_features(features):